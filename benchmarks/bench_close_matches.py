@@ -0,0 +1,94 @@
+"""
+Compare finding where changed cells came from (the copy_output pass in `opcode_merge_cell_contents`) using
+`difflib.get_close_matches` per cell, as it used to, and using `CloseMatcher`.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_close_matches
+
+Simulates a bulk edit: N changed cells to be matched against N unmatched current cells.
+"""
+import argparse
+import random
+import time
+from difflib import get_close_matches
+from typing import List
+from typing import Optional
+
+from jupyter_ascending.notebook import close_matches
+from jupyter_ascending.notebook.close_matches import CloseMatcher
+
+
+def make_cells(cells: int, seed: int = 0):
+    rng = random.Random(seed)
+
+    current = [
+        "code::::" + "\n".join(f"value_{i}_{j} = compute({rng.randint(0, 10 ** 6)})" for j in range(rng.randint(1, 5)))
+        for i in range(cells)
+    ]
+    updated = [x.replace("compute", "compute_faster") for x in current]
+    rng.shuffle(updated)
+
+    return current, updated
+
+
+def with_get_close_matches(current: List[str], updated: List[str]) -> List[Optional[str]]:
+    remaining = set(range(len(current)))
+    matches = []
+    for word in updated:
+        closest_match = get_close_matches(word, [current[x] for x in remaining], n=1)
+        matches.append(closest_match[0] if closest_match else None)
+
+        if closest_match:
+            remaining.remove(next(x for x in remaining if current[x] == closest_match[0]))
+
+    return matches
+
+
+def with_close_matcher(current: List[str], updated: List[str]) -> List[Optional[str]]:
+    matcher = CloseMatcher(updated, current)
+    remaining = set(range(len(current)))
+    matches = []
+    for word_index in range(len(updated)):
+        match = matcher.closest(word_index, remaining)
+        matches.append(match)
+
+        if match is not None:
+            remaining.remove(next(x for x in remaining if current[x] == match))
+
+    return matches
+
+
+def _time(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+def run(cells: int) -> None:
+    current, updated = make_cells(cells)
+
+    expected, difflib_seconds = _time(with_get_close_matches, current, updated)
+    results = [f"{cells:>5} cells   get_close_matches {difflib_seconds * 1000:>9.1f} ms"]
+
+    numpy = close_matches.np
+    for name, backend in (("numpy", numpy), ("python", None)):
+        if name == "numpy" and numpy is None:
+            continue
+
+        close_matches.np = backend
+        matches, seconds = _time(with_close_matcher, current, updated)
+        results.append(f"CloseMatcher ({name}) {seconds * 1000:>8.1f} ms, same: {matches == expected}")
+
+    close_matches.np = numpy
+    print("   ".join(results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cells", type=int, nargs="+", default=[100, 300])
+
+    arguments = parser.parse_args()
+
+    for cells in arguments.cells:
+        run(cells)
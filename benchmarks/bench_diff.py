@@ -0,0 +1,71 @@
+"""
+Compare `diff_opcodes` with `difflib.SequenceMatcher` on big synthetic notebooks.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_diff
+
+Each notebook is N cells of generated code (with some repeated cells, like blank cells or `df.head()`).
+"few edits" changes, inserts, deletes and moves a cell. "scattered" changes 5% of the cells all over the notebook
+(e.g. a rename), which is where SequenceMatcher has to search the most.
+"""
+import argparse
+import random
+import time
+from difflib import SequenceMatcher
+from typing import List
+from typing import Tuple
+
+from jupyter_ascending.notebook.diff import diff_opcodes
+
+REPEATED_CELLS = ["code::::", "code::::df.head()", "markdown::::---"]
+
+
+def make_notebooks(cells: int, scattered: bool, seed: int = 0) -> Tuple[List[str], List[str]]:
+    rng = random.Random(seed)
+
+    current = [
+        rng.choice(REPEATED_CELLS) if rng.random() < 0.1 else f"code::::x_{i} = compute({rng.randint(0, 10 ** 6)})"
+        for i in range(cells)
+    ]
+
+    updated = list(current)
+    if scattered:
+        for _ in range(cells // 20):
+            updated[rng.randrange(cells)] += "  # edited"
+    else:
+        updated[rng.randrange(cells)] += "  # edited"
+        updated.insert(rng.randrange(cells), "code::::print('inserted')")
+        del updated[rng.randrange(cells)]
+        updated.insert(rng.randrange(cells), updated.pop(rng.randrange(cells)))
+
+    return current, updated
+
+
+def _time(f, *args) -> float:
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def run(cells: int, scattered: bool) -> None:
+    current, updated = make_notebooks(cells, scattered)
+
+    diff_seconds = _time(lambda: diff_opcodes(current, updated, sequence_matcher_max_cells=0))
+    sequence_matcher_seconds = _time(lambda: SequenceMatcher(None, current, updated).get_opcodes())
+
+    print(
+        f"{cells:>6} cells {'scattered' if scattered else 'few edits':<10}   diff_opcodes {diff_seconds * 1000:>8.1f} ms"
+        f"   SequenceMatcher {sequence_matcher_seconds * 1000:>8.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cells", type=int, nargs="+", default=[1000, 5000, 20000])
+
+    arguments = parser.parse_args()
+
+    for scattered in (False, True):
+        for cells in arguments.cells:
+            run(cells, scattered)
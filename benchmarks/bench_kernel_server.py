@@ -0,0 +1,102 @@
+"""
+Measure how the kernel-side request server copes with concurrent requests.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_kernel_server
+
+Several clients send "syncs" (queued commands that take --sync-ms each) while others send "status" requests
+(which don't change the notebook). This is run against the old single-threaded `HTTPServer` and against the
+`ThreadingHTTPServer` that `start_server_in_thread` uses now, and reports throughput and status latency for each.
+"""
+import argparse
+import statistics
+import threading
+import time
+from http.server import HTTPServer
+from http.server import ThreadingHTTPServer
+from typing import List
+
+import requests
+from jsonrpcclient import request
+from jsonrpcserver import Success
+from loguru import logger
+
+from jupyter_ascending.handlers import CommandQueue
+from jupyter_ascending.handlers import ServerMethods
+from jupyter_ascending.handlers import generate_request_handler
+from jupyter_ascending.handlers import start_server_in_thread
+
+
+def _make_handler(sync_seconds: float):
+    methods = ServerMethods("Bench Start", "Bench Close")
+    queue = CommandQueue("bench_commands")
+
+    def sync():
+        return Success(queue.run(time.sleep, sync_seconds))
+
+    def status():
+        return Success("ok")
+
+    methods.add(sync)
+    methods.add(status)
+
+    return generate_request_handler("Bench", methods)
+
+
+def _client(url: str, method: str, count: int, latencies: List[float]) -> None:
+    session = requests.Session()
+    for _ in range(count):
+        start = time.perf_counter()
+        session.post(url, json=request(method)).raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+def run(server_class, sync_clients: int, status_clients: int, requests_per_client: int, sync_seconds: float) -> None:
+    server = start_server_in_thread(_make_handler(sync_seconds), server_class=server_class)
+    url = f"http://localhost:{server.server_address[1]}"
+
+    sync_latencies: List[float] = []
+    status_latencies: List[float] = []
+
+    threads = [
+        threading.Thread(target=_client, args=(url, "sync", requests_per_client, sync_latencies))
+        for _ in range(sync_clients)
+    ] + [
+        threading.Thread(target=_client, args=(url, "status", requests_per_client, status_latencies))
+        for _ in range(status_clients)
+    ]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    server.shutdown()
+    server.server_close()
+
+    total = len(sync_latencies) + len(status_latencies)
+    status_latencies.sort()
+    print(
+        f"{server_class.__name__:<20} {total / elapsed:>8.1f} req/s"
+        f"   status p50 {statistics.median(status_latencies) * 1000:>7.1f} ms"
+        f"   status p99 {status_latencies[int(len(status_latencies) * 0.99) - 1] * 1000:>7.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sync-clients", type=int, default=2)
+    parser.add_argument("--status-clients", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=25, help="Requests sent by each client")
+    parser.add_argument("--sync-ms", type=float, default=20.0, help="How long each sync takes")
+
+    arguments = parser.parse_args()
+
+    # We want to measure the server, not the logging.
+    logger.remove()
+
+    for server_class in (HTTPServer, ThreadingHTTPServer):
+        run(server_class, arguments.sync_clients, arguments.status_clients, arguments.requests, arguments.sync_ms / 1000)
@@ -0,0 +1,81 @@
+"""
+Compare finding the cell for a line in a big .sync.py file by reading it with jupytext, as `execute` used to,
+and with the line index.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_line_index
+
+Times the first lookup (index built from scratch), lookups after that (index cached in memory, and on disk for a
+new process), and the first lookup after editing one cell (index rebuilt incrementally).
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from loguru import logger
+
+from jupyter_ascending.requests import line_index
+from jupyter_ascending.tests.test_line_index import _find_cell_number_by_reading
+
+
+def make_file(lines: int) -> str:
+    header = ["# ---", "# jupyter:", "#   jupytext:", "#     formats: ipynb,py:percent", "# ---", ""]
+    cell = ["# %%", "import numpy as np", "", "x = np.arange(10)", "print(x.sum())", "", "# %% [markdown]", "# Notes", ""]
+
+    body = []
+    while len(header) + len(body) < lines:
+        body.extend(cell)
+
+    return "\n".join(header + body) + "\n"
+
+
+def _time(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run(lines: int) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        line_index.INDEX_DIRECTORY = os.path.join(directory, "index")
+        file_name = os.path.join(directory, "big.sync.py")
+        with open(file_name, "w") as writer:
+            writer.write(make_file(lines))
+
+        line_number = lines - 3
+        with open(file_name, "r") as reader:
+            expected, reading_ms = _time(_find_cell_number_by_reading, reader.readlines(), line_number)
+
+        line_index._INDEXES.clear()
+        cell, first_ms = _time(line_index.find_cell_number, file_name, line_number)
+        assert cell == expected
+
+        _, memory_ms = _time(line_index.find_cell_number, file_name, line_number)
+
+        line_index._INDEXES.clear()
+        _, disk_ms = _time(line_index.find_cell_number, file_name, line_number)
+
+        with open(file_name, "r") as reader:
+            contents = reader.read()
+        with open(file_name, "w") as writer:
+            writer.write(contents.replace("print(x.sum())", "print(x.mean())\nprint(x.sum())", 1))
+
+        _, incremental_ms = _time(line_index.find_cell_number, file_name, line_number + 1)
+
+    print(
+        f"{lines:>6} lines   reading with jupytext {reading_ms:>8.1f} ms   first {first_ms:>8.1f} ms   "
+        f"cached in memory {memory_ms:>6.3f} ms   on disk {disk_ms:>6.3f} ms   after an edit {incremental_ms:>6.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 5000])
+
+    arguments = parser.parse_args()
+
+    logger.remove()
+    for lines in arguments.lines:
+        run(lines)
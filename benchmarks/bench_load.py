@@ -0,0 +1,265 @@
+"""
+Load test syncing end to end, without a browser: editor clients, the server extension, and notebook kernels.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_load --clients 8 --notebooks 4 --syncs 50
+
+The server extension runs here, on tornado like in a jupyter server. Each notebook gets a process of its own running
+the kernel-side request server (`jupyter_notebook.py`), which talks to a `SimulatedFrontend` instead of a browser
+tab. Each client is a process of its own too, sharing the notebooks round robin. It edits its own copy of its
+notebook's .sync.py file (with the edits of `bench_sync_engine`) and syncs it with `sync_file` after each edit, like
+an editor that syncs on save, and as fast as it can.
+
+Reports the throughput, the p50 and p99 latency of the syncs (as the clients saw them), what the kernels said
+happened to them, and whether each notebook ended up with the cells of the last sync it applied, which should be
+the last sync of one of its clients.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import jupytext
+import requests
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+from jsonrpcclient import request
+from loguru import logger
+
+from benchmarks.bench_sync_engine import edit_sources
+from benchmarks.bench_sync_engine import make_sources
+from benchmarks.bench_sync_engine import to_text
+from jupyter_ascending._environment import SYNC_EXTENSION
+from jupyter_ascending.delta_sync import SegmentedContents
+from jupyter_ascending.handlers import jupyter_notebook
+from jupyter_ascending.handlers import server_extension
+from jupyter_ascending.handlers import start_server_in_thread
+from jupyter_ascending.handlers.server_extension import register_notebook_server
+from jupyter_ascending.handlers.simulated_frontend import Cells
+from jupyter_ascending.handlers.simulated_frontend import SimulatedFrontend
+from jupyter_ascending.requests import client_lib
+from jupyter_ascending.requests.client_lib import RequestFailure
+from jupyter_ascending.requests.sync import sync_file
+
+# `rename` isn't here: doing it over and over makes names longer and longer.
+EDITS = ("append", "insert", "reorder", "replace")
+
+
+def _notebook_path(directory: str, notebook: int) -> str:
+    return str(Path(directory) / f"notebook_{notebook}.{SYNC_EXTENSION}.ipynb")
+
+
+def start_server_extension() -> Tuple[str, asyncio.AbstractEventLoop]:
+    """Serve the server extension's handlers on a free localhost port, from a thread. Returns its URL and loop."""
+    started = threading.Event()
+    url = []
+    loop = asyncio.new_event_loop()
+
+    def _serve() -> None:
+        asyncio.set_event_loop(loop)
+
+        web_app = tornado.web.Application(base_url="/")
+        server_extension.load_extension(SimpleNamespace(web_app=web_app))
+
+        sockets = tornado.netutil.bind_sockets(0, "localhost")
+        tornado.httpserver.HTTPServer(web_app).add_sockets(sockets)
+        url.append(f"http://localhost:{sockets[0].getsockname()[1]}/jupyter_ascending")
+
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=_serve, daemon=True).start()
+    started.wait()
+
+    return url[0], loop
+
+
+def run_kernel(notebook_path: str, server_url: str, latency: Optional[float], connection: Any) -> None:
+    """A notebook kernel: the kernel-side request server, with a simulated frontend.
+
+    Sends "ready" on `connection` once it's registered with the server extension. Then, when asked, sends the
+    frontend's cells and the version of the last sync applied, and stops."""
+    logger.remove()
+
+    frontend = SimulatedFrontend(latency=latency)
+    jupyter_notebook.attach_comm_handlers(frontend)
+    jupyter_notebook.set_comm(frontend)
+
+    server = start_server_in_thread(jupyter_notebook.NotebookKernelRequestHandler)
+    json = request(
+        register_notebook_server.__name__,
+        params=dict(notebook_path=notebook_path, port_number=server.server_address[1]),
+    )
+    requests.post(server_url, json=json).raise_for_status()
+
+    connection.send("ready")
+    connection.recv()
+
+    last_applied = jupyter_notebook._last_applied
+    connection.send({"cells": frontend.cells, "version": None if last_applied is None else last_applied.version})
+
+    server.shutdown()
+
+
+def run_client(
+    client: int, notebook: int, directory: str, server_url: str, syncs: int, cells: int, cell_lines: int
+) -> Dict[str, Any]:
+    """An editor, editing its copy of `notebook` and syncing it after each edit."""
+    logger.remove()
+    client_lib.EXECUTE_HOST_URL = server_url
+
+    file_name = Path(directory) / f"client_{client}" / f"notebook_{notebook}.{SYNC_EXTENSION}.py"
+    file_name.parent.mkdir()
+
+    rng = random.Random(client)
+    sources = make_sources(cells, cell_lines, seed=notebook)
+
+    latencies: List[Tuple[float, float]] = []
+    statuses: Counter = Counter()
+    # The text of each version we synced, so the notebook's cells can be checked against the one it has.
+    texts: Dict[str, str] = {}
+    version = None
+
+    for _ in range(syncs):
+        sources = edit_sources(sources, rng.choice(EDITS), cell_lines, seed=rng.randrange(10 ** 9))
+        text = to_text(sources)
+        file_name.write_text(text)
+
+        version = SegmentedContents.from_text(text).version
+        texts[version] = text
+
+        start = time.time()
+        try:
+            result = sync_file(str(file_name))
+            statuses[result.get("status", "unknown") if isinstance(result, dict) else "unknown"] += 1
+        except RequestFailure:
+            statuses["error"] += 1
+
+        latencies.append((start, time.time()))
+
+    return {"notebook": notebook, "latencies": latencies, "statuses": statuses, "texts": texts, "last_version": version}
+
+
+def _cells_of(text: str) -> Cells:
+    return [(x["cell_type"], x["source"]) for x in jupytext.reads(text, fmt="py:percent")["cells"]]
+
+
+def check_notebook(kernel_state: Dict[str, Any], clients: List[Dict[str, Any]]) -> Optional[str]:
+    """What's wrong with a notebook's final state, or None if nothing is."""
+    version = kernel_state["version"]
+    if version is None:
+        return "no sync completed (did one time out?)"
+
+    if version not in {x["last_version"] for x in clients}:
+        return f"last applied version {version} isn't the last sync of any of its clients"
+
+    text = next(x["texts"][version] for x in clients if version in x["texts"])
+    if [tuple(x) for x in kernel_state["cells"]] != _cells_of(text):
+        return f"cells don't match version {version}"
+
+    return None
+
+
+def _percentile(values: List[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0]
+
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def run(clients: int, notebooks: int, syncs: int, cells: int, cell_lines: int, latency: Optional[float]) -> bool:
+    """Run the load test and print the results. Returns whether every notebook ended up right."""
+    context = multiprocessing.get_context("spawn")
+    server_url, server_loop = start_server_extension()
+
+    with tempfile.TemporaryDirectory() as directory:
+        kernels = []
+        for notebook in range(notebooks):
+            connection, child_connection = context.Pipe()
+            process = context.Process(
+                target=run_kernel, args=(_notebook_path(directory, notebook), server_url, latency, child_connection)
+            )
+            process.start()
+            kernels.append((process, connection))
+
+        for _, connection in kernels:
+            assert connection.recv() == "ready"
+
+        client_arguments = [(x, x % notebooks, directory, server_url, syncs, cells, cell_lines) for x in range(clients)]
+        with context.Pool(clients) as pool:
+            results = pool.starmap(run_client, client_arguments)
+
+        kernel_states = []
+        for process, connection in kernels:
+            connection.send("done")
+            kernel_states.append(connection.recv())
+            process.join()
+
+    asyncio.run_coroutine_threadsafe(server_extension._close_session(), server_loop).result()
+
+    latencies = [end - start for x in results for start, end in x["latencies"]]
+    seconds = max(end for x in results for _, end in x["latencies"]) - min(
+        start for x in results for start, _ in x["latencies"]
+    )
+    statuses = sum((x["statuses"] for x in results), Counter())
+
+    print(f"{clients} clients, {notebooks} notebooks of {cells} cells of about {cell_lines} lines, {syncs} syncs each")
+    print(f"  {len(latencies)} syncs in {seconds:.2f} s: {len(latencies) / seconds:.1f} syncs/s")
+    print(
+        f"  latency p50 {_percentile(latencies, 50) * 1000:.1f} ms   p99 {_percentile(latencies, 99) * 1000:.1f} ms"
+        f"   max {max(latencies) * 1000:.1f} ms"
+    )
+    print("  " + ", ".join(f"{name} {count}" for name, count in statuses.most_common()))
+
+    problems = [
+        check_notebook(state, [x for x in results if x["notebook"] == notebook])
+        for notebook, state in enumerate(kernel_states)
+    ]
+    print(f"  {problems.count(None)}/{notebooks} notebooks have the cells of the last sync they applied")
+    for notebook, problem in enumerate(problems):
+        if problem is not None:
+            print(f"    notebook {notebook}: {problem}")
+
+    return not any(problems)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--notebooks", type=int, default=4)
+    parser.add_argument("--syncs", type=int, default=50, help="How many syncs each client sends")
+    parser.add_argument("--cells", type=int, default=50, help="How many cells each notebook starts with")
+    parser.add_argument("--cell-lines", type=int, default=5)
+    parser.add_argument(
+        "--frontend-latency",
+        type=float,
+        default=None,
+        help="Seconds the simulated frontend waits before handling each message. By default it handles them at once.",
+    )
+
+    arguments = parser.parse_args()
+    logger.remove()
+
+    ok = run(
+        arguments.clients,
+        arguments.notebooks,
+        arguments.syncs,
+        arguments.cells,
+        arguments.cell_lines,
+        arguments.frontend_latency,
+    )
+    raise SystemExit(0 if ok else 1)
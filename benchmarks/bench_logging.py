@@ -0,0 +1,73 @@
+"""
+Measure how long logging a request and its response takes in the request handler, for big syncs.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_logging
+
+Logs the request and response the way `generate_request_handler` does, with the file sink the old way (the whole
+payload, written before `logger.info` returns) and the way `setup_logger` sets it up now (a summary of the payload,
+written by a background thread). Reports the time spent in the handler's thread per request.
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from jsonrpcclient import request
+from loguru import logger
+
+from benchmarks.bench_wire import make_file
+from jupyter_ascending import logger as logger_module
+from jupyter_ascending.logger import setup_logger
+from jupyter_ascending.logger import summarize
+
+
+def _log_request(json_rpc_request: Any, response: Any, summarized: bool) -> None:
+    if summarized:
+        json_rpc_request, response = summarize(json_rpc_request), summarize(response)
+
+    logger.info("{} processing request:\n\t\t{}", "Bench", json_rpc_request)
+    logger.info("Got Response:\n\t\t{}", response)
+
+
+def run(lines: int, repeats: int) -> None:
+    json_rpc_request = request("SyncRequest", params=dict(data={"file_name": "big.sync.py", "contents": make_file(lines)}))
+    response = {"jsonrpc": "2.0", "result": {"status": "applied", "version": 1}, "id": json_rpc_request["id"]}
+
+    with tempfile.TemporaryDirectory() as directory:
+        logger_module.LOG_DIRECTORY = directory
+
+        results = []
+        for name, summarized in (("full payloads, blocking", False), ("summaries, enqueued", True)):
+            logger.remove()
+            if summarized:
+                setup_logger(stream=open(Path(directory) / "stdout", "w"), process_name="bench")
+            else:
+                logger.add(str(Path(directory) / "log.log"), level="INFO")
+
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                _log_request(json_rpc_request, response, summarized)
+                times.append(time.perf_counter() - start)
+
+            logger.complete()
+            results.append(f"{name} {statistics.median(times) * 1000:>7.3f} ms")
+
+        logger.remove()
+
+    print(f"{lines:>7} lines   " + "   ".join(results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeats", type=int, default=20)
+
+    arguments = parser.parse_args()
+
+    for lines in arguments.lines:
+        run(lines, arguments.repeats)
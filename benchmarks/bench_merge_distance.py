@@ -0,0 +1,74 @@
+"""
+Compare matching cells in `merge_cell_contents` with and without pruning.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_merge_distance
+
+The updated notebook edits every cell a little and shuffles them, so no cell matches exactly and every
+cell has to be matched by distance. Checks that both give the same merge.
+"""
+import argparse
+import random
+import time
+
+from jupyter_ascending.notebook.data_types import JupyterCell
+from jupyter_ascending.notebook.data_types import NotebookContents
+from jupyter_ascending.notebook.merge import JaroWinklerDistance
+from jupyter_ascending.notebook.merge import LevenshteinDistance
+from jupyter_ascending.notebook.merge import TokenSetDistance
+from jupyter_ascending.notebook.merge import merge_cell_contents
+
+DISTANCERS = {x.__name__: x for x in (LevenshteinDistance, JaroWinklerDistance, TokenSetDistance)}
+
+
+def _notebook(sources) -> NotebookContents:
+    return NotebookContents(
+        cells=[JupyterCell(cell_type="code", index=i, source=[x], output=None) for i, x in enumerate(sources)]
+    )
+
+
+def make_notebooks(cells: int, seed: int = 0):
+    rng = random.Random(seed)
+
+    sources = []
+    for i in range(cells):
+        lines = [
+            f"value_{i}_{j} = compute({rng.randint(0, 10 ** 6)}, '{rng.random():.6f}')" for j in range(rng.randint(1, 6))
+        ]
+        sources.append("\n".join(lines))
+
+    edited = [x + f"\nprint({rng.randint(0, 99)})" for x in sources]
+    rng.shuffle(edited)
+
+    return _notebook(sources), _notebook(edited)
+
+
+def _time(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def run(cells: int, distancer) -> None:
+    current, updated = make_notebooks(cells)
+
+    pruned, pruned_seconds = _time(merge_cell_contents, current, updated, distancer, prune=True)
+    full, full_seconds = _time(merge_cell_contents, current, updated, distancer, prune=False)
+
+    print(
+        f"{distancer.__name__:<20} {cells:>5} cells   pruned {pruned_seconds * 1000:>9.1f} ms"
+        f"   all pairs {full_seconds * 1000:>9.1f} ms   same result: {pruned == full}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cells", type=int, nargs="+", default=[100, 300, 600])
+    parser.add_argument("--distancer", choices=list(DISTANCERS), nargs="+", default=["LevenshteinDistance"])
+
+    arguments = parser.parse_args()
+
+    for name in arguments.distancer:
+        for cells in arguments.cells:
+            run(cells, DISTANCERS[name])
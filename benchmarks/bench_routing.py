@@ -0,0 +1,68 @@
+"""
+Measure how long the server extension takes to pick the notebook for a request.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_routing
+
+Registers N notebooks spread over a few directory trees, then looks up paths that are exact matches, tail
+matches from another machine, and misses. "cold" clears the lookup cache first, so it measures the index itself.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from loguru import logger
+
+from jupyter_ascending._environment import SYNC_EXTENSION
+from jupyter_ascending.errors import UnableToFindNotebookException
+from jupyter_ascending.handlers.server_extension import _clear_registered_servers
+from jupyter_ascending.handlers.server_extension import _find_registered_notebook
+from jupyter_ascending.handlers.server_extension import get_server_for_notebook
+from jupyter_ascending.handlers.server_extension import register_notebook_server
+
+
+def _lookup(path: str) -> None:
+    try:
+        get_server_for_notebook(path)
+    except UnableToFindNotebookException:
+        pass
+
+
+def run(notebooks: int, lookups: int) -> None:
+    rng = random.Random(0)
+    _clear_registered_servers()
+
+    registered = [
+        f"/home/user{i % 7}/project{i % 13}/notebooks/nb{i}.{SYNC_EXTENSION}.ipynb" for i in range(notebooks)
+    ]
+    for port, name in enumerate(registered, start=10000):
+        asyncio.run(register_notebook_server(name, port))
+
+    paths = [rng.choice(registered).replace("/home/", "/mnt/remote/") for _ in range(lookups)]
+    paths += [f"/somewhere/else/missing{i}.{SYNC_EXTENSION}.py" for i in range(lookups // 10)]
+
+    for name, clear_cache in (("cold", True), ("cached", False)):
+        start = time.perf_counter()
+        for path in paths:
+            if clear_cache:
+                _find_registered_notebook.cache_clear()
+            _lookup(path)
+        elapsed = time.perf_counter() - start
+
+        print(f"{notebooks:>6} notebooks   {name:<7} {elapsed / len(paths) * 1e6:>8.2f} us/lookup")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notebooks", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--lookups", type=int, default=2000)
+
+    arguments = parser.parse_args()
+
+    # We want to measure the routing, not the logging.
+    logger.remove()
+
+    for notebooks in arguments.notebooks:
+        run(notebooks, arguments.lookups)
@@ -0,0 +1,79 @@
+"""
+Measure how long it takes to start each of the request CLIs.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_startup
+
+For every entry point this runs `python -X importtime -c "import <module>"` a few times and reports
+the import time python measured for the module, plus the wall time of the whole process
+(which includes interpreter startup). It also lists any heavy modules that got imported,
+since the CLIs should never need jupyter, ipykernel or (before parsing a file) jupytext.
+"""
+import argparse
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import List
+from typing import Tuple
+
+ENTRY_POINTS = [
+    "jupyter_ascending",
+    "jupyter_ascending.requests.sync",
+    "jupyter_ascending.requests.execute",
+    "jupyter_ascending.requests.execute_all",
+    "jupyter_ascending.requests.execute_range",
+    "jupyter_ascending.requests.restart",
+    "jupyter_ascending.requests.get_status",
+    "jupyter_ascending.requests.coprocess",
+]
+
+HEAVY_MODULES = ["notebook", "ipykernel", "jupytext", "aiohttp", "tornado", "jsonrpcserver"]
+
+# e.g. "import time:       274 |     147826 | jupyter_ascending.requests.sync"
+_IMPORTTIME_LINE = re.compile(r"import time:\s+\d+\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+
+def measure_import(module: str) -> Tuple[float, float, List[str]]:
+    """Returns (import seconds, wall seconds, heavy top-level modules imported) for one fresh interpreter."""
+    script = f"import sys; import {module}; print(' '.join(sorted(sys.modules)))"
+
+    start = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True, check=True
+    )
+    wall_time = time.perf_counter() - start
+
+    import_time = 0.0
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        # The cumulative time on the module's own line includes everything it imported
+        if match and match.group(2) == module:
+            import_time = int(match.group(1)) / 1e6
+
+    loaded = set(completed.stdout.split())
+    heavy = [x for x in HEAVY_MODULES if x in loaded]
+
+    return import_time, wall_time, heavy
+
+
+def main(repeat: int) -> None:
+    print(f"{'entry point':<45} {'import (ms)':>12} {'wall (ms)':>10}  heavy modules")
+    for module in ENTRY_POINTS:
+        results = [measure_import(module) for _ in range(repeat)]
+
+        import_ms = statistics.median(x[0] for x in results) * 1000
+        wall_ms = statistics.median(x[1] for x in results) * 1000
+        heavy = ", ".join(results[0][2]) or "-"
+
+        print(f"{module:<45} {import_ms:>12.1f} {wall_ms:>10.1f}  {heavy}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters per entry point")
+
+    arguments = parser.parse_args()
+    main(arguments.repeat)
@@ -0,0 +1,263 @@
+"""
+Time the code that decides how long a sync takes, on generated notebooks, and compare with a saved baseline.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_sync_engine
+    python -m benchmarks.bench_sync_engine --save benchmarks/baselines/sync_engine.json
+    python -m benchmarks.bench_sync_engine --compare benchmarks/baselines/sync_engine.json
+
+Each notebook has N cells of generated code, each about L lines long, all using a few shared names. It's edited
+in one of these ways, and then each operation is run on the notebook before and after the edit:
+
+- append: 5 new cells at the end.
+- insert: 5 new cells in the middle.
+- reorder: a tenth of the cells moved somewhere else.
+- replace: a quarter of the cells rewritten.
+- rename: a name used in every cell renamed, so every cell changed a little.
+
+The operations:
+
+- parse: `jupytext.reads(..., fmt="py:percent")` of the edited file, as the kernel does for each sync.
+- opcode_merge: `opcode_merge_cell_contents`, which the kernel runs for each sync.
+- merge: `merge_cell_contents` (with `LevenshteinDistance`).
+- levenshtein: `LevenshteinDistance.find_distance` between each cell and the cell at its index after the edit.
+- find_cell: `_find_cell_number` for a line in the middle of the edited file, as `execute` does.
+
+Reports the median and fastest of `--repeats` runs, and the peak memory allocated by Python during one run before
+those (with `tracemalloc`, which doesn't see memory allocated by C extensions like `editdistance`). Some operations
+grow quickly with the size of the notebook (`merge` after a rename compares every pair of cells), so an operation
+stops being repeated once its runs took `--max-seconds`, and once a single run takes that long, it's skipped for
+bigger notebooks with the same cell length and edit.
+
+`--save` writes the results as JSON, and `--compare` adds how long each took compared to a file written with `--save`.
+Timings from another machine or Python version aren't comparable, so the file says which it's from.
+`benchmarks/baselines/sync_engine.json` has the results for the default arguments from when this was written.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import jupytext
+
+from jupyter_ascending.notebook.data_types import JupyterCell
+from jupyter_ascending.notebook.data_types import NotebookContents
+from jupyter_ascending.notebook.merge import LevenshteinDistance
+from jupyter_ascending.notebook.merge import merge_cell_contents
+from jupyter_ascending.notebook.merge import opcode_merge_cell_contents
+from jupyter_ascending.requests.execute import _find_cell_number
+
+EDITS = ("append", "insert", "reorder", "replace", "rename")
+OPERATIONS = ("parse", "opcode_merge", "merge", "levenshtein", "find_cell")
+
+# The results that identify a measurement, for matching them up with a baseline.
+KEY_FIELDS = ("operation", "cells", "cell_lines", "edit")
+
+
+def _make_cell(rng: random.Random, lines: int, tag: str) -> str:
+    statements = [
+        lambda: f"frame_{tag} = load_frame(path, rows={rng.randint(1, 10 ** 5)})",
+        lambda: f"frame = frame.merge(frame_{tag}, on='key_{rng.randint(0, 9)}')",
+        lambda: f"summary_{tag} = frame.groupby('group').agg({{'value': 'mean'}})",
+        lambda: f"plot(frame['value'] * {rng.random():.6f}, title='cell {tag}')",
+        lambda: f"for row in frame.itertuples():\n    total += row.value * {rng.randint(1, 99)}",
+    ]
+    return "\n".join(rng.choice(statements)() for _ in range(lines))
+
+
+def make_sources(cells: int, cell_lines: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    # Not every cell is the same length, but on average they're `cell_lines` long.
+    return [_make_cell(rng, rng.randint(max(cell_lines // 2, 1), cell_lines * 3 // 2), str(i)) for i in range(cells)]
+
+
+def edit_sources(sources: List[str], edit: str, cell_lines: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    edited = list(sources)
+
+    if edit == "append":
+        edited.extend(_make_cell(rng, cell_lines, f"new_{i}") for i in range(5))
+    elif edit == "insert":
+        middle = len(edited) // 2
+        edited[middle:middle] = [_make_cell(rng, cell_lines, f"new_{i}") for i in range(5)]
+    elif edit == "reorder":
+        for _ in range(max(len(edited) // 10, 1)):
+            edited.insert(rng.randrange(len(edited)), edited.pop(rng.randrange(len(edited))))
+    elif edit == "replace":
+        for i in rng.sample(range(len(edited)), max(len(edited) // 4, 1)):
+            edited[i] = _make_cell(rng, cell_lines, f"replaced_{i}")
+    elif edit == "rename":
+        edited = [x.replace("frame", "data_frame") for x in edited]
+    else:
+        raise ValueError(f"Unknown edit: {edit}")
+
+    return edited
+
+
+def to_text(sources: List[str]) -> str:
+    return "".join(f"# %%\n{x}\n\n" for x in sources)
+
+
+def to_notebook(sources: List[str]) -> NotebookContents:
+    return NotebookContents(
+        cells=[JupyterCell(cell_type="code", index=i, source=x, output=None) for i, x in enumerate(sources)]
+    )
+
+
+def _levenshtein_all(current: List[str], updated: List[str]) -> int:
+    return sum(LevenshteinDistance.find_distance(x, y) for x, y in zip(current, updated))
+
+
+def make_operations(current: List[str], updated: List[str]) -> Dict[str, Callable[[], Any]]:
+    """The operations to time, each ready to run on the notebook before and after the edit."""
+    current_notebook, updated_notebook = to_notebook(current), to_notebook(updated)
+    text = to_text(updated)
+    lines = text.splitlines()
+
+    return {
+        "parse": lambda: jupytext.reads(text, fmt="py:percent"),
+        "opcode_merge": lambda: opcode_merge_cell_contents(current_notebook, updated_notebook),
+        "merge": lambda: merge_cell_contents(current_notebook, updated_notebook, LevenshteinDistance),
+        "levenshtein": lambda: _levenshtein_all(current, updated),
+        "find_cell": lambda: _find_cell_number(lines, len(lines) // 2),
+    }
+
+
+def measure(f: Callable[[], Any], repeats: int, max_seconds: float) -> Dict[str, float]:
+    # Separately, since tracing allocations slows everything down. It also warms up caches (e.g. jupytext's imports).
+    tracemalloc.start()
+    try:
+        f()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    times: List[float] = []
+    while len(times) < repeats and sum(times) < max_seconds:
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+
+    return {
+        "runs": len(times),
+        "median_ms": round(statistics.median(times) * 1000, 4),
+        "min_ms": round(min(times) * 1000, 4),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def _key(result: Dict[str, Any]) -> Tuple[Any, ...]:
+    return tuple(result[x] for x in KEY_FIELDS)
+
+
+def _print_result(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    line = (
+        f"{result['operation']:<13} {result['cells']:>5} cells {result['cell_lines']:>4} lines  {result['edit']:<8}"
+        f"  median {result['median_ms']:>10.3f} ms  min {result['min_ms']:>10.3f} ms"
+        f"  peak {result['peak_kib']:>9.1f} KiB"
+    )
+    if baseline is not None and baseline["median_ms"] > 0:
+        line += f"  {result['median_ms'] / baseline['median_ms']:>6.2f}x baseline"
+
+    print(line, flush=True)
+
+
+def run(
+    cells: List[int],
+    cell_lines: List[int],
+    edits: List[str],
+    operations: List[str],
+    repeats: int,
+    max_seconds: float,
+    baseline: Dict[Tuple[Any, ...], Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    results = []
+    # (operation, cell_lines, edit) that took longer than `max_seconds` for fewer cells.
+    too_slow: Set[Tuple[str, int, str]] = set()
+
+    for cell_count in sorted(cells):
+        for lines in cell_lines:
+            current = make_sources(cell_count, lines)
+
+            for edit in edits:
+                to_run = make_operations(current, edit_sources(current, edit, lines))
+
+                for operation in operations:
+                    if (operation, lines, edit) in too_slow:
+                        print(f"{operation:<13} {cell_count:>5} cells {lines:>4} lines  {edit:<8}  skipped, too slow")
+                        continue
+
+                    result = {"operation": operation, "cells": cell_count, "cell_lines": lines, "edit": edit}
+                    result.update(measure(to_run[operation], repeats, max_seconds))
+
+                    _print_result(result, baseline.get(_key(result)))
+                    results.append(result)
+
+                    if result["min_ms"] > max_seconds * 1000:
+                        too_slow.add((operation, lines, edit))
+
+    return results
+
+
+def _load_baseline(path: Optional[str]) -> Dict[Tuple[Any, ...], Dict[str, Any]]:
+    if path is None:
+        return {}
+
+    with open(path) as f:
+        data = json.load(f)
+
+    if data["environment"] != _environment():
+        print(f"NOTE: {path} was recorded on {data['environment']}, so timings may not be comparable.")
+
+    return {_key(x): x for x in data["results"]}
+
+
+def _environment() -> Dict[str, str]:
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cells", type=int, nargs="+", default=[50, 200, 800])
+    parser.add_argument("--cell-lines", type=int, nargs="+", default=[5, 20])
+    parser.add_argument("--edits", choices=EDITS, nargs="+", default=list(EDITS))
+    parser.add_argument("--operations", choices=OPERATIONS, nargs="+", default=list(OPERATIONS))
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=2.0)
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with the results in this JSON file, written with --save")
+
+    arguments = parser.parse_args()
+
+    results = run(
+        arguments.cells,
+        arguments.cell_lines,
+        arguments.edits,
+        arguments.operations,
+        arguments.repeats,
+        arguments.max_seconds,
+        _load_baseline(arguments.compare),
+    )
+
+    if arguments.save:
+        with open(arguments.save, "w") as f:
+            json.dump(
+                {"environment": _environment(), "argv": sys.argv[1:], "results": results}, f, indent=1, sort_keys=True
+            )
+            f.write("\n")
@@ -0,0 +1,109 @@
+"""
+Compare the wire formats of `wire.py` for syncing a big .sync.py file.
+
+Run from the root of the repository:
+
+    python -m benchmarks.bench_wire
+
+For each format both ends could agree on here (msgpack and zstd only if they're installed), a sync request with
+the file's contents (the modules of this package, over and over) is sent to a kernel-side request server on
+localhost. Reports the size of the request body, the round trip on localhost (so mostly encoding and decoding),
+and an estimate for slower links, like an SSH tunnel to a remote server: the round trip plus the time to transfer
+the request and response at that speed.
+"""
+import argparse
+import statistics
+import time
+from pathlib import Path
+from typing import List
+
+import requests
+from jsonrpcclient import request
+from jsonrpcserver import Success
+from loguru import logger
+
+import jupyter_ascending
+from jupyter_ascending import wire
+from jupyter_ascending.handlers import ServerMethods
+from jupyter_ascending.handlers import generate_request_handler
+from jupyter_ascending.handlers import start_server_in_thread
+
+
+def make_file(lines: int) -> str:
+    """A .sync.py file with a cell for each module of this package, repeated until it has `lines` lines."""
+    sources = [path.read_text() for path in sorted(Path(jupyter_ascending.__file__).parent.rglob("*.py"))]
+
+    body: List[str] = []
+    while len(body) < lines:
+        for source in sources:
+            body.extend(["# %%"] + source.splitlines() + [""])
+
+    return "\n".join(body[:lines]) + "\n"
+
+
+def _formats() -> List[wire.WireFormat]:
+    return [
+        wire.WireFormat(content_type=content_type, content_encoding=content_encoding)
+        for content_type in reversed(wire.readable_content_types())
+        for content_encoding in reversed(wire.readable_encodings())
+    ]
+
+
+def run(lines: int, repeats: int, link_mbits: List[float]) -> None:
+    methods = ServerMethods("Bench Start", "Bench Close")
+
+    def sync(data):
+        return Success({"status": "applied", "version": 1})
+
+    methods.add(sync)
+
+    server = start_server_in_thread(generate_request_handler("Bench", methods))
+    url = f"http://localhost:{server.server_address[1]}"
+    session = requests.Session()
+
+    json_rpc_request = request("sync", params=dict(data={"file_name": "big.sync.py", "contents": make_file(lines)}))
+
+    print(f"{lines} lines")
+    for wire_format in _formats():
+        body, headers = wire.encode(json_rpc_request, wire_format)
+        accept = {"Accept": wire_format.content_type, "Accept-Encoding": wire_format.content_encoding}
+
+        round_trips = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+
+            body, headers = wire.encode(json_rpc_request, wire_format)
+            response = session.post(url, data=body, headers={**headers, **accept})
+            response.raise_for_status()
+            wire.decode(response.content, response.headers)
+
+            round_trips.append(time.perf_counter() - start)
+
+        transferred_bits = (len(body) + len(response.content)) * 8
+
+        link_times = "".join(
+            f"   {mbits:g} Mbit/s {transferred_bits / (mbits * 1e6) * 1000 + statistics.median(round_trips) * 1000:>7.1f} ms"
+            for mbits in link_mbits
+        )
+        print(
+            f"  {wire_format.content_type:<20} {wire_format.content_encoding:<9} {len(body):>9} bytes"
+            f"   localhost {statistics.median(round_trips) * 1000:>6.1f} ms{link_times}"
+        )
+
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--link-mbits", type=float, nargs="+", default=[1, 10, 100], help="Link speeds to estimate")
+
+    arguments = parser.parse_args()
+
+    # We want to measure the wire format, not the logging.
+    logger.remove()
+
+    for lines in arguments.lines:
+        run(lines, arguments.repeats, arguments.link_mbits)
@@ -4,12 +4,27 @@
 # Copyright (c) tjdevries.
 # Distributed under the terms of the Modified BSD License.
 
+import importlib
+
 from jupyter_ascending._version import __version__
 from jupyter_ascending._version import version_info
-from jupyter_ascending.extension import load_ipython_extension
-from jupyter_ascending.extension import load_jupyter_server_extension
 from jupyter_ascending.nbextension import _jupyter_nbextension_paths
 
+# The extension entry points pull in jupyter, ipykernel and jupytext.
+#   They're only imported when jupyter asks for them, so that the client CLIs
+#   (which import this package too) start up quickly.
+_LAZY_ATTRIBUTES = {
+    "load_ipython_extension": "jupyter_ascending.extension",
+    "load_jupyter_server_extension": "jupyter_ascending.extension",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(_LAZY_ATTRIBUTES[name]), name)
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 def _jupyter_server_extension_paths():
     return [{
@@ -8,6 +8,35 @@ EXECUTE_HOST_URL = f"http://{EXECUTE_HOST_LOCATION[0]}:{EXECUTE_HOST_LOCATION[1]
 
 LOG_LEVEL = os.getenv("JUPYTER_ASCENDING_LOG_LEVEL", "INFO")
 SHOW_TO_STDOUT = os.getenv("JUPYTER_ASCENDING_SHOW_TO_STDOUT", False)
+# Requests and responses are logged cut down to about this many characters, with long strings as their hash.
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("JUPYTER_ASCENDING_LOG_PAYLOAD_MAX_CHARS", 500))
+# Each process's log file is rotated when it gets this big, and old ones are removed after this many days.
+LOG_ROTATION = os.getenv("JUPYTER_ASCENDING_LOG_ROTATION", "10 MB")
+LOG_RETENTION_DAYS = float(os.getenv("JUPYTER_ASCENDING_LOG_RETENTION_DAYS", 7))
+# How long a sync waits for the notebook frontend to apply it, in seconds: a base amount plus some per cell.
+SYNC_TIMEOUT = float(os.getenv("JUPYTER_ASCENDING_SYNC_TIMEOUT", 5))
+SYNC_TIMEOUT_PER_CELL = float(os.getenv("JUPYTER_ASCENDING_SYNC_TIMEOUT_PER_CELL", 0.01))
+# How long the server extension waits for a notebook to answer a forwarded request, in seconds.
+KERNEL_REQUEST_TIMEOUT = float(os.getenv("JUPYTER_ASCENDING_KERNEL_REQUEST_TIMEOUT", 60))
+# How many connections the server extension keeps open to each notebook at once.
+KERNEL_CONNECTIONS_PER_NOTEBOOK = int(os.getenv("JUPYTER_ASCENDING_KERNEL_CONNECTIONS_PER_NOTEBOOK", 4))
+# How much of a cell's output is streamed back to a client that asked for it, in bytes. The rest is dropped.
+OUTPUT_STREAM_MAX_BYTES = int(os.getenv("JUPYTER_ASCENDING_OUTPUT_STREAM_MAX_BYTES", 1_000_000))
+# How long to wait for a cell to start running after a client asked for its output, in seconds.
+OUTPUT_STREAM_START_TIMEOUT = float(os.getenv("JUPYTER_ASCENDING_OUTPUT_STREAM_START_TIMEOUT", 60))
+# Only send plain JSON bodies, even if both ends could read msgpack or compressed ones (see `wire.py`).
+PLAIN_JSON_ONLY = bool(os.getenv("JUPYTER_ASCENDING_PLAIN_JSON", False))
+# Bodies smaller than this many bytes aren't compressed, since that only makes them slower.
+WIRE_COMPRESSION_MIN_BYTES = int(os.getenv("JUPYTER_ASCENDING_WIRE_COMPRESSION_MIN_BYTES", 1024))
+
+# If set, clients append the timeline of each request (see `tracing.py`) to this file, as a line of JSON.
+TRACE_FILE = os.getenv("JUPYTER_ASCENDING_TRACE_FILE")
+
+# Keep the notebook in the kernel instead of the browser tab, so syncing and executing work without one.
+HEADLESS = os.getenv("JUPYTER_ASCENDING_HEADLESS", "").lower() in ("1", "true", "yes")
+# How often a headless notebook is written to disk, in seconds, if it changed.
+HEADLESS_SAVE_INTERVAL = float(os.getenv("JUPYTER_ASCENDING_HEADLESS_SAVE_INTERVAL", 5))
+
 # TODO: it would be great for this to be an environment variable... but unfortunately we need to know the value
 #  on the javascript side as well, and I'm not sure how to get this value over there easily. Would love help!
 SYNC_EXTENSION = "sync"
@@ -0,0 +1,79 @@
+"""Helpers for sending only the changed parts of a .sync.py file.
+
+The file text is split into segments, one per cell marker (`# %%`). Both sides identify
+segments and whole files by their hash, so a client that knows what the notebook last synced
+only needs to send the list of segment hashes plus the bodies of segments that are new.
+Joining the segments always gives back the exact original text, so the notebook parses
+exactly what a full sync would have sent.
+"""
+import hashlib
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import attr
+
+CELL_MARKER = "# %%"
+
+
+def hash_text(text: str) -> str:
+    return hashlib.sha1(text.encode("utf8")).hexdigest()
+
+
+def split_segments(text: str) -> List[str]:
+    """Split text before every cell marker line. `"".join(split_segments(x)) == x` always holds."""
+    segments: List[str] = []
+    current: List[str] = []
+
+    for line in text.splitlines(keepends=True):
+        if line.startswith(CELL_MARKER) and current:
+            segments.append("".join(current))
+            current = []
+
+        current.append(line)
+
+    if current:
+        segments.append("".join(current))
+
+    return segments
+
+
+@attr.dataclass
+class SegmentedContents:
+    #: Hash of the full text.
+    version: str
+
+    #: Hash of each segment, in file order.
+    segment_hashes: List[str]
+
+    #: Body of each segment, by hash.
+    segments: Dict[str, str]
+
+    @classmethod
+    def from_text(cls, text: str) -> "SegmentedContents":
+        segments = split_segments(text)
+        segment_hashes = [hash_text(x) for x in segments]
+
+        return cls(version=hash_text(text), segment_hashes=segment_hashes, segments=dict(zip(segment_hashes, segments)))
+
+    def new_segments_since(self, base: "SegmentedContents") -> Dict[str, str]:
+        """The segments that someone who has `base` is missing to rebuild these contents."""
+        return {k: v for k, v in self.segments.items() if k not in base.segments}
+
+    def rebuild(self, segment_hashes: List[str], new_segments: Dict[str, str], version: str) -> Optional[str]:
+        """Rebuild a text from these contents plus `new_segments`.
+
+        Returns None if a segment is missing or the result doesn't hash to `version`."""
+        parts = []
+        for segment_hash in segment_hashes:
+            segment = new_segments.get(segment_hash, self.segments.get(segment_hash))
+            if segment is None:
+                return None
+
+            parts.append(segment)
+
+        text = "".join(parts)
+        if hash_text(text) != version:
+            return None
+
+        return text
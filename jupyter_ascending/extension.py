@@ -5,6 +5,7 @@ from loguru import logger
 import jupyter_ascending.handlers.server_extension
 from jupyter_ascending._environment import SYNC_EXTENSION
 from jupyter_ascending.handlers import jupyter_notebook
+from jupyter_ascending.logger import remove_old_logs
 from jupyter_ascending.logger import setup_logger
 from jupyter_ascending.utils import get_name_from_python
 
@@ -19,7 +20,7 @@ def set_everything_up():
     # Note that this is also called from javascript after a kernel restart
 
     logger.info("Loading Ipython...")
-    setup_logger()
+    setup_logger(process_name="kernel")
 
     # Start the server if it's the right name.
     notebook_name = get_name_from_python()
@@ -35,7 +36,8 @@ def set_everything_up():
 
 def load_jupyter_server_extension(ipython):
     """This is the specially named function that Jupyter will call to load a server extension."""
-    setup_logger()
+    setup_logger(process_name="server")
+    remove_old_logs()
     ipython.log.info("LOADING JUPYTER ASCENDING SERVER PLUGIN")
     logger.info("SERVER LOAD: " + time.ctime())
 
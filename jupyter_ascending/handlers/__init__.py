@@ -1,11 +1,26 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from http.server import ThreadingHTTPServer
+from typing import Any
 from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Type
 
-from jsonrpcserver import dispatch
+from jsonrpcserver import dispatch_to_serializable
 from jsonrpcserver import methods
 from loguru import logger
 
+from jupyter_ascending import metrics
+from jupyter_ascending import tracing
+from jupyter_ascending import wire
+from jupyter_ascending.logger import summarize
+
 
 def _wrap_request(f: Callable, start_msg: str, close_msg: str):
     @wraps(f)
@@ -15,7 +30,7 @@ def _wrap_request(f: Callable, start_msg: str, close_msg: str):
 
         result = f(*args, **kwargs)
 
-        logger.debug("{}: {}", close_msg, result)
+        logger.debug("{}: {}", close_msg, summarize(result))
 
         return result
 
@@ -44,6 +59,75 @@ class ServerMethods:
         return self.items[method_name]
 
 
+class Superseded(Exception):
+    """A queued command was dropped because a newer one with the same `coalesce_key` was submitted."""
+
+
+class CommandQueue:
+    """
+    Runs commands one at a time, in the order they were submitted.
+
+    The request server handles each request on its own thread, so requests that only read can be answered
+    right away, while anything that changes the notebook goes through here and can't interleave with other changes.
+    """
+
+    def __init__(self, name: str):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+        # The newest submission for each coalesce key
+        self._latest: Dict[str, int] = {}
+        self._submissions = 0
+        self._lock = threading.Lock()
+
+    def run(self, f: Callable, *args, coalesce_key: Optional[str] = None, supersedable: bool = True) -> Any:
+        """Wait for every command submitted before this one, then run `f(*args)` and return its result.
+
+        If a newer command with the same `coalesce_key` is submitted before this one starts,
+        this one raises `Superseded` instead of running. With `supersedable=False`, this one still supersedes
+        older commands with the same key, but always runs itself.
+        """
+        tracing.record("queued")
+
+        def _run():
+            tracing.record("started running")
+            return f(*args)
+
+        # Run in a copy of our context, so the command still belongs to the request's trace (see `tracing.py`).
+        context = contextvars.copy_context()
+
+        if coalesce_key is None:
+            return self._executor.submit(context.run, _run).result()
+
+        with self._lock:
+            self._submissions += 1
+            submission = self._submissions
+            self._latest[coalesce_key] = submission
+
+        def _run_unless_superseded():
+            with self._lock:
+                superseded = self._latest[coalesce_key] != submission
+
+            if superseded and supersedable:
+                raise Superseded(coalesce_key)
+
+            return _run()
+
+        return self._executor.submit(context.run, _run_unless_superseded).result()
+
+
+def start_server_in_thread(
+    handler: Type[BaseHTTPRequestHandler], server_class: Type[HTTPServer] = ThreadingHTTPServer
+) -> HTTPServer:
+    """Serve `handler` on a free localhost port. The port is in `server.server_address[1]`."""
+    # Binding to port 0 lets the OS pick the port, so two servers starting at once can't pick the same one.
+    server = server_class(("localhost", 0), handler)
+
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.start()
+
+    return server
+
+
 def generate_request_handler(name: str, methods: ServerMethods) -> BaseHTTPRequestHandler:
     """Build a handler to respond to HTTP POST requests containing JSON-RPC messages.
 
@@ -55,20 +139,47 @@ def generate_request_handler(name: str, methods: ServerMethods) -> BaseHTTPReque
 
     @logger.catch
     def do_POST(self):
-        # Process request
-        request = self.rfile.read(int(self.headers["Content-Length"])).decode()
-        logger.info("{} processing request:\n\t\t{}", name, request)
+        start = time.perf_counter()
 
-        # Dispatch the RPC request to the right function and get the function's response.
-        response = dispatch(request, methods=methods)
-
-        logger.info("Got Response:\n\t\t{}", response)
-
-        # Return response
-        self.send_response(200 if response else 204)
-        self.send_header("Content-Type", "application/json")
+        # Process request
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        try:
+            request = wire.decode(body, self.headers)
+        except wire.UnreadableBody as e:
+            logger.warning("{} got a request it can't read: {}", name, e)
+            self._send_body(wire.UNREADABLE_BODY_STATUS, b"", {})
+            return
+
+        # Part of the caller's trace if it sent us its id, so the caller can see what we spent its time on.
+        with tracing.started(self.headers.get(tracing.TRACE_ID_HEADER), process=name) as trace:
+            logger.info("{} processing request (trace {}):\n\t\t{}", name, trace.trace_id, summarize(request))
+            trace.record("got request")
+
+            # Dispatch the RPC request to the right function and get the function's response.
+            response = dispatch_to_serializable(request, methods=methods, deserializer=lambda x: x)
+
+            trace.record("answered")
+
+        logger.info("Got Response:\n\t\t{}", summarize(response))
+
+        # Return response, in the best format the caller can read.
+        if response is None:
+            self._send_body(204, b"", {})
+        else:
+            body, headers = wire.encode(response, wire.choose_for_request(self.headers))
+            # So the caller can tell how much of its wait was spent getting here and back.
+            headers["Server-Timing"] = metrics.format_timings([("server", time.perf_counter() - start)])
+            headers[tracing.TRACE_HEADER] = tracing.format_events(trace.events)
+            self._send_body(200, body, headers)
+
+    def _send_body(self, status: int, body: bytes, headers: Dict[str, str]):
+        self.send_response(status)
+        for key, value in {**headers, **wire.accept_post_headers()}.items():
+            self.send_header(key, value)
+        # Needed to keep the connection alive for the next request.
+        self.send_header("Content-Length", str(len(body)))
         self.end_headers()
-        self.wfile.write(str(response).encode())
+        self.wfile.write(body)
 
     def log_message(self, format, *args):
         logger.debug(args)
@@ -76,5 +187,14 @@ def generate_request_handler(name: str, methods: ServerMethods) -> BaseHTTPReque
     return type(
         f"{name}RequestHandler",
         (BaseHTTPRequestHandler,),
-        {"allow_reuse_address": True, "do_POST": do_POST, "log_message": log_message},
+        {
+            "allow_reuse_address": True,
+            # HTTP/1.1 so callers (e.g. the server extension) can reuse their connection.
+            "protocol_version": "HTTP/1.1",
+            # Headers and body are written separately, so without this small responses wait for a delayed ACK.
+            "disable_nagle_algorithm": True,
+            "do_POST": do_POST,
+            "_send_body": _send_body,
+            "log_message": log_message,
+        },
     )
@@ -0,0 +1,242 @@
+"""
+Keeps the notebook in the kernel, so syncing and executing don't need a browser tab.
+
+Normally every sync and execute is carried out by `extension.js` in the notebook's browser tab, so nothing happens
+while there is no tab, and a backgrounded tab can make syncs take seconds. With `JUPYTER_ASCENDING_HEADLESS` set,
+the kernel keeps the notebook itself:
+
+- Syncs are merged into the notebook here, with the same `opcode_merge_cell_contents` the frontend merge uses,
+  so cells that didn't change keep their outputs.
+- Cells are run in the kernel directly, and their outputs recorded in the notebook.
+- The notebook is written to the .sync.ipynb file every few seconds, if anything changed.
+
+A browser tab that is attached only mirrors the changes. It shouldn't be saved, since the kernel owns the file.
+"""
+import os
+import sys
+import threading
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import nbformat
+from loguru import logger
+
+from jupyter_ascending._environment import HEADLESS_SAVE_INTERVAL
+from jupyter_ascending.handlers import output_stream
+from jupyter_ascending.handlers.output_stream import OutputBuffer
+from jupyter_ascending.handlers.output_stream import OutputChunk
+from jupyter_ascending.notebook.data_types import JupyterCell
+from jupyter_ascending.notebook.data_types import NotebookContents
+from jupyter_ascending.notebook.merge import OpCodeAction
+from jupyter_ascending.notebook.merge import OpCodes
+from jupyter_ascending.notebook.merge import opcode_merge_cell_contents
+
+#: Called with (cell index, "ok" or "error") after each cell of `HeadlessNotebook.execute_range` runs.
+CellDoneCallback = Callable[[int, str], None]
+
+
+def _contents(cells: List[Any]) -> NotebookContents:
+    return NotebookContents(
+        cells=[JupyterCell(index=i, cell_type=x.cell_type, source=x.source, output=None) for i, x in enumerate(cells)]
+    )
+
+
+def _kept_cells(opcodes: List[OpCodeAction]) -> Dict[int, int]:
+    """For each updated cell that carries on from a current cell, the index of that current cell."""
+    kept = {}
+    for action in opcodes:
+        if action.op_code == OpCodes.EQUAL:
+            kept.update(zip(range(*action.updated), range(*action.current)))
+        elif action.op_code == OpCodes.COPY_OUTPUT:
+            kept[action.updated_start_idx] = action.current_start_idx
+
+    return kept
+
+
+def _to_output(chunk: OutputChunk, execution_count: Optional[int]) -> Dict[str, Any]:
+    if chunk.name in ("stdout", "stderr"):
+        return nbformat.v4.new_output("stream", name=chunk.name, text=chunk.text)
+
+    if chunk.name == "error":
+        data = chunk.data or {}
+        return nbformat.v4.new_output(
+            "error", ename=data.get("ename", ""), evalue=data.get("evalue", ""), traceback=chunk.text.splitlines()
+        )
+
+    data = chunk.data or {"text/plain": chunk.text}
+    if chunk.name == "result":
+        return nbformat.v4.new_output("execute_result", data=data, execution_count=execution_count)
+
+    return nbformat.v4.new_output("display_data", data=data)
+
+
+class HeadlessNotebook:
+    """The notebook at `path`, kept in the kernel that `shell` belongs to.
+
+    `mirror` is called with comm messages for an attached browser tab, if there is one.
+    `run_soon` runs a function on the kernel's main thread; by default, through the kernel's event loop."""
+
+    def __init__(
+        self,
+        path: str,
+        shell: Any,
+        mirror: Callable[[Dict[str, Any]], None],
+        run_soon: Optional[Callable[..., None]] = None,
+    ):
+        self.path = path
+        self.shell = shell
+        self.mirror = mirror
+        self.run_soon = run_soon or shell.kernel.io_loop.add_callback
+
+        if os.path.exists(path):
+            self.notebook = nbformat.read(path, as_version=4)
+        else:
+            self.notebook = nbformat.v4.new_notebook()
+
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Start writing the notebook to disk every `HEADLESS_SAVE_INTERVAL` seconds."""
+        threading.Thread(target=self._save_periodically, name="jupyter_ascending_headless_save", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.save()
+
+    def _save_periodically(self) -> None:
+        while not self._stopped.wait(HEADLESS_SAVE_INTERVAL):
+            self.save()
+
+    def save(self) -> None:
+        """Write the notebook to disk, if it changed since it was last written."""
+        with self._lock:
+            if not self._dirty:
+                return
+
+            self._dirty = False
+            text = nbformat.writes(self.notebook)
+
+        # Write somewhere else first, so nothing ever reads half a notebook.
+        temporary_path = f"{self.path}.jupyter_ascending.tmp"
+        try:
+            with open(temporary_path, "w", encoding="utf8") as writer:
+                writer.write(text)
+
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            logger.warning("Unable to save {}: {}", self.path, e)
+            with self._lock:
+                self._dirty = True
+
+    def sync(self, updated: Any) -> Tuple[List[OpCodeAction], NotebookContents, NotebookContents]:
+        """Make the notebook's cells match `updated` (as read by jupytext), keeping the outputs of cells that stayed.
+
+        Returns the opcodes and both versions of the cells, so the change can be mirrored to the browser."""
+        with self._lock:
+            current_contents = _contents(self.notebook.cells)
+            updated_contents = _contents(updated.cells)
+
+            opcodes = opcode_merge_cell_contents(current_contents, updated_contents)
+            kept_cells = _kept_cells(opcodes)
+
+            cells = []
+            for i, cell in enumerate(updated.cells):
+                current_cell = self.notebook.cells[kept_cells[i]] if i in kept_cells else None
+
+                if current_cell is not None and "id" in current_cell:
+                    cell["id"] = current_cell["id"]
+
+                if cell.cell_type == "code" and current_cell is not None and current_cell.cell_type == "code":
+                    cell.outputs = current_cell.outputs
+                    cell.execution_count = current_cell.execution_count
+
+                cells.append(cell)
+
+            self.notebook.cells = cells
+            self._dirty = True
+
+        return opcodes, current_contents, updated_contents
+
+    def execute_range(
+        self,
+        start_cell: int,
+        end_cell: Optional[int],
+        stop_on_error: bool = True,
+        on_cell_done: Optional[CellDoneCallback] = None,
+        on_complete: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """Run cells `start_cell` to `end_cell` (inclusive, or to the last cell if None) on the kernel's main thread.
+
+        Returns right away, like executing through the browser does."""
+        with self._lock:
+            last_cell = len(self.notebook.cells) - 1
+            end_cell = last_cell if end_cell is None else min(end_cell, last_cell)
+
+            # Take the cells now, so syncs that happen before they run can't change which ones we run.
+            cells = [(i, self.notebook.cells[i]) for i in range(max(start_cell, 0), end_cell + 1)]
+
+        self.run_soon(self._run_cells, cells, stop_on_error, on_cell_done, on_complete)
+
+    def _run_cells(
+        self,
+        cells: List[Tuple[int, Any]],
+        stop_on_error: bool,
+        on_cell_done: Optional[CellDoneCallback],
+        on_complete: Optional[Callable[[], None]],
+    ) -> None:
+        for cell_index, cell in cells:
+            status = self._run_cell(cell_index, cell)
+
+            if on_cell_done is not None:
+                on_cell_done(cell_index, status)
+
+            if status != "ok" and stop_on_error:
+                break
+
+        if on_complete is not None:
+            on_complete()
+
+    def _run_cell(self, cell_index: int, cell: Any) -> str:
+        if cell.cell_type != "code" or not cell.source.strip():
+            return "ok"
+
+        execution_count = self.shell.execution_count
+
+        if hasattr(self.shell, "set_parent"):
+            # Outputs would otherwise be sent as if they came from the last cell the browser ran, which would show
+            #   them there. Without a parent, the browser ignores them, and we mirror them to the right cell below.
+            self.shell.set_parent({})
+
+        # This is the notebook's only copy of the outputs, so unlike for streaming, keep all of them.
+        with output_stream.recording(OutputBuffer(max_bytes=sys.maxsize)) as buffer:
+            result = self.shell.run_cell(cell.source, store_history=True)
+
+        buffer.finish()
+        chunks, _ = buffer.read(wait=0, max_bytes=sys.maxsize)
+        outputs = [_to_output(x, execution_count) for x in chunks]
+
+        with self._lock:
+            cell.outputs = outputs
+            cell.execution_count = execution_count
+            self._dirty = True
+
+            # The cell might have been removed, or moved, by a sync while it ran.
+            cell_index = next((i for i, x in enumerate(self.notebook.cells) if x is cell), -1)
+
+        if cell_index >= 0:
+            self.mirror(
+                {
+                    "command": "set_outputs",
+                    "cell_number": cell_index,
+                    "outputs": outputs,
+                    "execution_count": execution_count,
+                }
+            )
+
+        return "ok" if result.success else "error"
@@ -5,7 +5,9 @@ It receives messages from `jupyter_server.py` and takes the appropriate action i
 """
 import threading
 import time
-from http.server import HTTPServer
+import uuid
+from collections import Counter
+from functools import partial
 from inspect import signature
 from pathlib import Path
 from typing import Any
@@ -14,38 +16,124 @@ from typing import List
 from typing import Optional
 from typing import Type
 
+import attr
 import jupytext
 import requests
+from IPython import get_ipython
 from ipykernel.comm import Comm
 from jsonrpcclient import request
 from jsonrpcserver import Success
 from loguru import logger
 
+from jupyter_ascending import metrics
+from jupyter_ascending import tracing
 from jupyter_ascending._environment import EXECUTE_HOST_URL
+from jupyter_ascending._environment import HEADLESS
+from jupyter_ascending._environment import SYNC_TIMEOUT
+from jupyter_ascending._environment import SYNC_TIMEOUT_PER_CELL
+from jupyter_ascending.delta_sync import SegmentedContents
+from jupyter_ascending.handlers import CommandQueue
 from jupyter_ascending.handlers import ServerMethods
+from jupyter_ascending.handlers import Superseded
 from jupyter_ascending.handlers import generate_request_handler
+from jupyter_ascending.handlers import output_stream
+from jupyter_ascending.handlers import start_server_in_thread
+from jupyter_ascending.handlers.headless import HeadlessNotebook
 from jupyter_ascending.handlers.server_extension import register_notebook_server
+from jupyter_ascending.json_requests import DeltaSyncRequest
 from jupyter_ascending.json_requests import ExecuteAllRequest
+from jupyter_ascending.json_requests import ExecuteRangeRequest
 from jupyter_ascending.json_requests import ExecuteRequest
 from jupyter_ascending.json_requests import FocusCellRequest
+from jupyter_ascending.json_requests import GetMetricsRequest
 from jupyter_ascending.json_requests import GetStatusRequest
+from jupyter_ascending.json_requests import ReadOutputRequest
 from jupyter_ascending.json_requests import RestartRequest
+from jupyter_ascending.json_requests import SyncAndExecuteRequest
+from jupyter_ascending.json_requests import SyncDigestRequest
 from jupyter_ascending.json_requests import SyncRequest
+from jupyter_ascending.json_requests import SyncStatus
+from jupyter_ascending.json_requests import WatchOutputRequest
+from jupyter_ascending.logger import summarize
 from jupyter_ascending.notebook.data_types import JupyterCell
 from jupyter_ascending.notebook.data_types import NotebookContents
+from jupyter_ascending.notebook.line_index import LineIndex
+from jupyter_ascending.notebook.line_index import build_line_index
 from jupyter_ascending.notebook.merge import OpCodeAction
 from jupyter_ascending.notebook.merge import OpCodes
 from jupyter_ascending.notebook.merge import opcode_merge_cell_contents
-from jupyter_ascending.utils import find_free_port
 
 COMM_NAME = "AUTO_SYNC::notebook"
 
 notebook_server_methods = ServerMethods("JupyterNotebook Start", "JupyterNotebook Close")
 
-merge_complete = False
+# Requests that change the notebook are run in order, one at a time. See `dispatch_json_request`.
+command_queue = CommandQueue("jupyter_ascending_commands")
+
+# How many syncs were received, and what happened to them (see `SyncStatus`).
+sync_counters: Counter = Counter()
 
 lock = threading.Lock()
 
+# See `get_comm`.
+_comm: Optional[Comm] = None
+_comm_lock = threading.Lock()
+
+
+@attr.dataclass
+class PendingMerge:
+    """A sync that was sent to the frontend, and is waiting for it to send back its cells and finish merging."""
+
+    cells: List[Dict[str, Any]]
+    complete: threading.Event = attr.ib(factory=threading.Event)
+
+    # When we asked the frontend for its cells, and sent it the changes, by `time.perf_counter()`.
+    started: float = attr.ib(factory=time.perf_counter)
+    patch_sent: Optional[float] = None
+
+    # The trace of the sync request. The frontend answers on another thread, so we hold on to it here.
+    trace: tracing.Trace = attr.ib(factory=lambda: tracing.current() or tracing.Trace(process="NotebookKernel"))
+
+
+@attr.dataclass
+class RangeExecution:
+    """Cells the frontend was asked to execute one after another, and how each one went so far."""
+
+    file_name: str
+    start_cell: int
+    end_cell: Optional[int]
+    stop_on_error: bool
+
+    # Cell index -> "ok", "error" or "aborted", as the frontend reports them.
+    cell_status: Dict[int, str] = attr.ib(factory=dict)
+    complete: bool = False
+
+    # Why the frontend stopped before the end of the range, other than a cell raising (e.g. the kernel restarted).
+    error: Optional[str] = None
+
+
+# How many `RangeExecution`s to keep around for `handle_get_status_request`.
+MAX_RANGE_EXECUTIONS = 10
+
+# By request id, oldest first. See `handle_execute_range_request`.
+_RANGE_EXECUTIONS: Dict[str, RangeExecution] = {}
+
+
+# By request id, which the frontend sends back to us in `merge_notebooks` and `merge_complete`.
+_PENDING_MERGES: Dict[str, PendingMerge] = {}
+
+# The contents we last synced for each client file, so that clients can send just what changed.
+_SYNCED_CONTENTS: Dict[str, SegmentedContents] = {}
+
+# The cells of the contents we last executed a line of, for each client file. See `_find_cell_index`.
+_LINE_INDEXES: Dict[str, LineIndex] = {}
+
+# The contents the notebook was last successfully synced to, so repeated syncs of the same file are free.
+_last_applied: Optional[SegmentedContents] = None
+
+# When running headless, the notebook that the kernel keeps (see `headless.py`). The frontend only mirrors it.
+_headless: Optional[HeadlessNotebook] = None
+
 
 @logger.catch
 def start_notebook_server_in_thread(notebook_name: str, status_widget=None):
@@ -54,14 +142,20 @@ def start_notebook_server_in_thread(notebook_name: str, status_widget=None):
         notebook_name: The name of the notebook you want to be syncing in this process.
     """
 
+    global _headless
+
     notebook_path = Path(notebook_name).absolute()
 
-    # TODO: This might be a race condition if a bunch of these started at once...
-    notebook_server_port = find_free_port()
+    register_comm_target()
+    output_stream.install(get_ipython(), output_text)
 
-    notebook_executor = HTTPServer(("localhost", notebook_server_port), NotebookKernelRequestHandler,)
-    notebook_executor_thread = threading.Thread(target=notebook_executor.serve_forever)
-    notebook_executor_thread.start()
+    if HEADLESS:
+        logger.info("IPYTHON: Keeping {} in the kernel, without the frontend", notebook_path)
+        _headless = HeadlessNotebook(str(notebook_path), get_ipython(), mirror=_mirror_to_frontend)
+        _headless.start()
+
+    notebook_executor = start_server_in_thread(NotebookKernelRequestHandler)
+    notebook_server_port = notebook_executor.server_address[1]
 
     logger.info("IPYTHON: Registering notebook {}", notebook_path)
     json = request(
@@ -76,20 +170,50 @@ def start_notebook_server_in_thread(notebook_name: str, status_widget=None):
     logger.info("==> Success")
 
 
-def dispatch_json_request(f):
+def dispatch_json_request(f=None, *, queued: bool = True, coalesce: bool = False, supersedable: bool = True):
     """
     A kinda weird decorator attempting to remove some boilerplate in the following funcs.
     Automatically dispatch a json request based on the request_type.
 
     Adds it to notebook_server_methods
+
+    Requests are run through `command_queue`, so they happen in the order they arrived.
+    Pass `queued=False` for requests that don't change the notebook, so they don't wait behind a slow sync.
+
+    With `coalesce=True`, a request that is still waiting in the queue when a newer one for the same file arrives
+    is not run at all, and gets a "superseded" sync status instead. Only makes sense for syncs, where only the newest matters.
+    Pass `supersedable=False` for requests that should still supersede older syncs, but must always run themselves.
     """
+    if f is None:
+        return partial(dispatch_json_request, queued=queued, coalesce=coalesce, supersedable=supersedable)
 
     # Get the type from the first argument of the function.
     #   This will define the name that we use to generate the method handling.
     request_type = signature(f).parameters["request_type"].annotation.__args__[0]
 
     def wrapped(data: Dict) -> str:
-        return Success(f(request_type, data))
+        if not queued:
+            return Success(f(request_type, data))
+
+        try:
+            return Success(
+                command_queue.run(
+                    f,
+                    request_type,
+                    data,
+                    coalesce_key=data["file_name"] if coalesce else None,
+                    supersedable=supersedable,
+                )
+            )
+        except Superseded:
+            sync_counters[SyncStatus.SUPERSEDED.value] += 1
+            metrics.increment("syncs_total", status=SyncStatus.SUPERSEDED.value)
+            logger.info(
+                "Dropped sync for {}, a newer one is queued ({} dropped so far)",
+                data["file_name"],
+                sync_counters[SyncStatus.SUPERSEDED.value],
+            )
+            return Success({"status": SyncStatus.SUPERSEDED.value})
 
     wrapped.__name__ = request_type.__name__
 
@@ -100,9 +224,15 @@ def dispatch_json_request(f):
 def handle_execute_request(request_type: Type[ExecuteRequest], data: dict) -> str:
     """JSON-RPC request handler for 'execute cell'"""
     request = request_type(**data)
+    metrics.increment("executes_total", kind="cell")
 
-    comm = make_comm()
-    execute_cell_contents(comm, request.cell_index)
+    if request.stream_id is not None:
+        output_stream.arm(request.stream_id)
+
+    if _headless is not None:
+        _headless.execute_range(request.cell_index, request.cell_index)
+    else:
+        execute_cell_contents(get_comm(), request.cell_index)
 
     return f"Executing cell `{request.cell_index}`"
 
@@ -111,31 +241,201 @@ def handle_execute_request(request_type: Type[ExecuteRequest], data: dict) -> st
 def handle_execute_all_request(request_type: Type[ExecuteAllRequest], data: dict) -> str:
     """JSON-RPC request handler for 'execute all cells'"""
     request = request_type(**data)
+    metrics.increment("executes_total", kind="all")
 
     # TODO: Remind myself why I don't need to say the filename here...
-    comm = make_comm()
-    execute_all_cells(comm)
+    if _headless is not None:
+        _headless.execute_range(0, None)
+    else:
+        execute_all_cells(get_comm())
 
     return f"Executing all cells in {request.file_name}"
 
 
 @dispatch_json_request
-def handle_sync_request(request_type: Type[SyncRequest], data: dict) -> str:
+def handle_execute_range_request(request_type: Type[ExecuteRangeRequest], data: dict) -> Dict[str, Any]:
+    """JSON-RPC request handler for 'execute these cells, one after another'"""
+    request = request_type(**data)
+    metrics.increment("executes_total", kind="range")
+
+    request_id = uuid.uuid4().hex
+    _RANGE_EXECUTIONS[request_id] = RangeExecution(
+        file_name=request.file_name,
+        start_cell=request.start_cell,
+        end_cell=request.end_cell,
+        stop_on_error=request.stop_on_error,
+    )
+    while len(_RANGE_EXECUTIONS) > MAX_RANGE_EXECUTIONS:
+        _RANGE_EXECUTIONS.pop(next(iter(_RANGE_EXECUTIONS)))
+
+    if _headless is not None:
+        _headless.execute_range(
+            request.start_cell,
+            request.end_cell,
+            request.stop_on_error,
+            on_cell_done=lambda cell_number, status: record_range_progress(
+                {
+                    "command": "execute_range_progress",
+                    "request_id": request_id,
+                    "cell_number": cell_number,
+                    "status": status,
+                }
+            ),
+            on_complete=lambda: record_range_progress({"command": "execute_range_complete", "request_id": request_id}),
+        )
+    else:
+        execute_cell_range(get_comm(), request_id, request.start_cell, request.end_cell, request.stop_on_error)
+
+    end = "the last cell" if request.end_cell is None else f"`{request.end_cell}`"
+    return {"request_id": request_id, "message": f"Executing cells `{request.start_cell}` to {end}"}
+
+
+def record_range_progress(data: Dict[str, Any]) -> None:
+    """Called when the frontend finished executing a cell of a range (see `handle_execute_range_request`)."""
+    execution = _RANGE_EXECUTIONS.get(data.get("request_id"))
+    if execution is None:
+        logger.warning("Got progress for unknown cell range {}", data.get("request_id"))
+        return
+
+    if data["command"] == "execute_range_complete":
+        execution.complete = True
+        execution.error = data.get("error")
+        if execution.error is not None:
+            logger.warning("Stopped executing cells of {}: {}", execution.file_name, execution.error)
+        logger.info("Finished executing cells of {}: {}", execution.file_name, execution.cell_status)
+        return
+
+    execution.cell_status[data["cell_number"]] = data["status"]
+    logger.info("Cell {} of {} finished executing: {}", data["cell_number"], execution.file_name, data["status"])
+
+
+@dispatch_json_request(coalesce=True)
+def handle_sync_request(request_type: Type[SyncRequest], data: dict) -> Dict[str, str]:
     """JSON-RPC request handler for 'sync'"""
-    global merge_complete
-    merge_complete = False
     request = request_type(**data)
 
+    return sync_contents(request.file_name, request.contents)
+
+
+@dispatch_json_request(coalesce=True)
+def handle_delta_sync_request(request_type: Type[DeltaSyncRequest], data: dict) -> Dict[str, str]:
+    """JSON-RPC request handler for 'sync only what changed'"""
+    request = request_type(**data)
+
+    base = _SYNCED_CONTENTS.get(request.file_name)
+    if base is None or base.version != request.base_version:
+        logger.info("Delta sync against unknown version {}, asking for a full sync", request.base_version)
+        return {"status": SyncStatus.FULL_SYNC_REQUIRED.value}
+
+    contents = base.rebuild(request.segment_hashes, request.new_segments, request.version)
+    if contents is None:
+        logger.warning("Unable to rebuild version {} from delta, asking for a full sync", request.version)
+        return {"status": SyncStatus.FULL_SYNC_REQUIRED.value}
+
+    return sync_contents(request.file_name, contents)
+
+
+@dispatch_json_request
+def handle_sync_digest_request(request_type: Type[SyncDigestRequest], data: dict) -> Dict[str, str]:
+    """JSON-RPC request handler for 'is the notebook already synced to this version?'"""
+    request = request_type(**data)
+
+    with lock:
+        if _last_applied is not None and _last_applied.version == request.version:
+            # Let the client send deltas against this version from now on.
+            _SYNCED_CONTENTS[request.file_name] = _last_applied
+            return {"status": SyncStatus.UNCHANGED.value, "version": request.version}
+
+    return {"status": SyncStatus.FULL_SYNC_REQUIRED.value}
+
+
+@dispatch_json_request(coalesce=True, supersedable=False)
+def handle_sync_and_execute_request(request_type: Type[SyncAndExecuteRequest], data: dict) -> Dict[str, Any]:
+    """JSON-RPC request handler for 'sync, then execute the cell at this line'"""
+    request = request_type(**data)
+    metrics.increment("executes_total", kind="sync_and_execute")
+
+    # Both happen under one lock, so no other sync can move cells around in between.
+    with lock:
+        result: Dict[str, Any] = _sync_contents_locked(request.file_name, request.contents)
+
+        if _last_applied is None or _last_applied.version != result["version"]:
+            logger.warning("Sync of {} didn't complete, not executing line {}", request.file_name, request.line_number)
+            return {**result, "executed": False}
+
+        cell_index = _find_cell_index(request.file_name, request.contents, request.line_number)
+        if request.stream_id is not None:
+            output_stream.arm(request.stream_id)
+
+        if _headless is not None:
+            _headless.execute_range(cell_index, cell_index)
+        else:
+            execute_cell_contents(get_comm(), cell_index)
+
+    return {**result, "cell_index": cell_index, "executed": True}
+
+
+def _find_cell_index(file_name: str, contents: str, line_number: int) -> int:
+    """The cell that `line_number` of `contents` is in, reusing what we found for the previous contents of the file."""
+    index = build_line_index(contents.splitlines(), _LINE_INDEXES.get(file_name))
+    _LINE_INDEXES[file_name] = index
+
+    return index.cell_for_line(line_number)
+
+
+def sync_contents(file_name: str, contents: str) -> Dict[str, str]:
+    """Make the notebook match `contents`, the text of a .sync.py file."""
     # We lock here because updating the notebook isn't threadsafe.
     # If we got two sync requests simultaneously without a lock,
     # bad things might happen (eg duplicated inserts/deletes).
     with lock:
-        comm = make_comm()
-
-        result = jupytext.reads(request.contents, fmt="py:percent")
-        update_cell_contents(comm, result)
+        return _sync_contents_locked(file_name, contents)
+
+
+@metrics.timed("sync")
+def _sync_contents_locked(file_name: str, contents: str) -> Dict[str, str]:
+    """`sync_contents`, for callers that already hold `lock`."""
+    global _last_applied
+
+    metrics.increment("sync_bytes_total", len(contents))
+    synced = SegmentedContents.from_text(contents)
+    _SYNCED_CONTENTS[file_name] = synced
+
+    if _last_applied is not None and _last_applied.version == synced.version:
+        logger.info("Notebook already matches version {}, skipping sync", synced.version)
+        sync_counters[SyncStatus.UNCHANGED.value] += 1
+        metrics.increment("syncs_total", status=SyncStatus.UNCHANGED.value)
+        return {"status": SyncStatus.UNCHANGED.value, "version": synced.version}
+
+    with metrics.timed("kernel_parse"):
+        result = jupytext.reads(contents, fmt="py:percent")
+    tracing.record(f"parsed {len(result['cells'])} cells")
+
+    if _headless is not None:
+        # Nothing to wait for: the kernel's notebook is the real one, and the frontend just follows along.
+        with metrics.timed("merge"):
+            opcodes, current_contents, updated_contents = _headless.sync(result)
+        changed_cells = count_changed_cells(opcodes)
+        metrics.increment("cells_changed_total", changed_cells)
+        tracing.record(f"merged in kernel, {changed_cells} cells changed")
+
+        _mirror_to_frontend(
+            {"command": "apply_patch", "operations": compile_patch(opcodes, current_contents, updated_contents)}
+        )
+        _last_applied = synced
+    elif update_cell_contents(get_comm(), result):
+        _last_applied = synced
+    else:
+        # We don't know what state the notebook ended up in, so make sure the next sync is applied.
+        _last_applied = None
+        sync_counters[SyncStatus.TIMED_OUT.value] += 1
+        metrics.increment("syncs_total", status=SyncStatus.TIMED_OUT.value)
+        tracing.record("timed out waiting for the frontend")
+        return {"status": SyncStatus.TIMED_OUT.value, "version": synced.version}
 
-    return "Syncing all cells"
+    sync_counters[SyncStatus.APPLIED.value] += 1
+    metrics.increment("syncs_total", status=SyncStatus.APPLIED.value)
+    return {"status": SyncStatus.APPLIED.value, "version": synced.version}
 
 
 @dispatch_json_request
@@ -147,17 +447,46 @@ def handle_focus_cell_request(request_type: Type[FocusCellRequest], data: dict)
     raise NotImplementedError
 
 
-@dispatch_json_request
-def handle_get_status_request(request_type: Type[GetStatusRequest], data: dict) -> str:
+@dispatch_json_request(queued=False)
+def handle_watch_output_request(request_type: Type[WatchOutputRequest], data: dict) -> Dict[str, str]:
+    """JSON-RPC request handler for 'keep the output of the cell I'm about to execute for me'"""
+    request = request_type(**data)
+
+    output_stream.watch(request.stream_id)
+
+    return {"stream_id": request.stream_id}
+
+
+@dispatch_json_request(queued=False)
+def handle_read_output_request(request_type: Type[ReadOutputRequest], data: dict) -> Dict[str, Any]:
+    """JSON-RPC request handler for 'what did that cell print since I last asked?'"""
+    request = request_type(**data)
+
+    return output_stream.read(request.stream_id, request.wait, request.max_bytes)
+
+
+@dispatch_json_request(queued=False)
+def handle_get_status_request(request_type: Type[GetStatusRequest], data: dict) -> Dict[str, Any]:
     """JSON-RPC request handler for 'get status'"""
     logger.info("Attempting get_status")
 
-    comm = make_comm()
-    comm.send({"command": "get_status"})
+    comm = get_comm()
+    comm.send({"command": "get_status", "headless": _headless is not None})
 
     logger.info("Sent get_status")
 
-    return f"Updating status"
+    return {
+        "message": "Updating status",
+        "sync_counters": dict(sync_counters),
+        "range_executions": {x: attr.asdict(y) for x, y in list(_RANGE_EXECUTIONS.items())},
+        "headless": _headless is not None,
+    }
+
+
+@dispatch_json_request(queued=False)
+def handle_get_metrics_request(request_type: Type[GetMetricsRequest], data: dict) -> Dict[str, Any]:
+    """JSON-RPC request handler for 'get metrics', from the server extension"""
+    return metrics.snapshot()
 
 
 @dispatch_json_request
@@ -165,7 +494,7 @@ def handle_restart_request(request_type: Type[RestartRequest], data: dict) -> st
     """JSON-RPC request handler for 'restart'"""
     request = request_type(**data)
 
-    comm = make_comm()
+    comm = get_comm()
     comm.send({"command": "restart_kernel"})
     logger.info("Sent restart_kernel")
 
@@ -175,44 +504,121 @@ def handle_restart_request(request_type: Type[RestartRequest], data: dict) -> st
 NotebookKernelRequestHandler = generate_request_handler("NotebookKernel", notebook_server_methods)
 
 
-def make_comm():
+def get_comm() -> Comm:
+    """The comm to the notebook frontend that all requests share. Opens one if we don't have one yet."""
+    global _comm
+
+    with _comm_lock:
+        if _comm is None:
+            _comm = make_comm()
+
+        return _comm
+
+
+def _mirror_to_frontend(data: Dict[str, Any]) -> None:
+    """Send `data` to the frontend if one is attached, without opening a comm if not."""
+    with _comm_lock:
+        comm = _comm
+
+    if comm is not None:
+        comm.send(data)
+
+
+def set_comm(comm: Comm) -> None:
+    """Use `comm` for everything from now on, closing the one we used before."""
+    global _comm
+
+    with _comm_lock:
+        previous_comm, _comm = _comm, comm
+
+    if previous_comm is not None and previous_comm is not comm:
+        logger.info("IPYTHON: Replacing comm {}", getattr(previous_comm, "comm_id", previous_comm))
+        previous_comm.close()
+        _forget_synced_contents()
+
+
+def _forget_synced_contents() -> None:
+    """Make the next sync send everything to the frontend again.
+
+    A reloaded page shows the notebook as it was last saved, which may not be what we last synced to it."""
+    global _last_applied
+
+    with lock:
+        _last_applied = None
+        _SYNCED_CONTENTS.clear()
+        _LINE_INDEXES.clear()
+
+
+def register_comm_target() -> None:
+    """Let the frontend open the comm to us.
+
+    It does that every time it (re)loads, so the comm is replaced whenever the page is reloaded,
+    and messages don't go to a comm that the frontend has forgotten about."""
+
+    def _on_frontend_comm_open(comm, _open_msg):
+        logger.info("IPYTHON: Frontend opened comm")
+        attach_comm_handlers(comm)
+        set_comm(comm)
+
+        if _headless is not None:
+            # So the tab knows not to save over the file we write.
+            comm.send({"command": "get_status", "headless": True})
+
+    get_ipython().kernel.comm_manager.register_target(COMM_NAME, _on_frontend_comm_open)
+
+
+def make_comm() -> Comm:
     """A comm is a Jupyter object for communicating between a notebook and kernel.
 
     Set up this object with event handlers."""
-    global merge_complete
-
     logger.info("IPYTHON: Registering Comms")
 
     comm_target_name = COMM_NAME
 
     jupyter_comm = Comm(target_name=comm_target_name)
+    attach_comm_handlers(jupyter_comm)
+
+    logger.info("==> Success")
 
+    return jupyter_comm
+
+
+def attach_comm_handlers(jupyter_comm: Comm) -> None:
     def _get_command(msg) -> Optional[str]:
         return msg["content"]["data"].get("command", None)
 
     @jupyter_comm.on_msg
     def _recv(msg):
-        global merge_complete
         if _get_command(msg) == "merge_notebooks":
             logger.info("GOT UPDATE STATUS")
             merge_notebooks(jupyter_comm, msg["content"]["data"])
             return
 
+        if _get_command(msg) in ("execute_range_progress", "execute_range_complete"):
+            record_range_progress(msg["content"]["data"])
+            return
+
         if _get_command(msg) == "merge_complete":
             logger.info("GOT MERGE COMPLETE")
-            merge_complete = True
+            complete_merge(msg["content"]["data"].get("request_id"), msg["content"]["data"].get("apply_ms"))
             return
 
         logger.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
-        logger.info(msg)
+        logger.info("{}", summarize(msg))
         logger.info("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~")
 
-    logger.info("==> Success")
+    @jupyter_comm.on_close
+    def _close(msg):
+        global _comm
 
-    return jupyter_comm
+        logger.info("IPYTHON: Comm closed")
+        with _comm_lock:
+            if _comm is jupyter_comm:
+                _comm = None
 
 
-def update_cell_contents(comm: Comm, result: Dict[str, Any]) -> None:
+def update_cell_contents(comm: Comm, result: Dict[str, Any]) -> bool:
+    """Send the new cells to the frontend, and wait until it has merged them. Returns False on timeout."""
     # logger.info(Javascript("Jupyter.notebook.get_cells()"))
     def _transform_jupytext_cells(jupytext_cells) -> List[Dict[str, Any]]:
         """TODO: what does this do?"""
@@ -221,27 +627,62 @@ def update_cell_contents(comm: Comm, result: Dict[str, Any]) -> None:
             for i, x in enumerate(result["cells"])
         ]
 
-    comm.send({"command": "start_sync_notebook", "cells": _transform_jupytext_cells(result["cells"])})
-
-    # Wait for the merge_complete flag to get set in the callback.
-    # This way we don't release the lock before syncing is done.
-    for i in range(500):
-        if merge_complete:
-            return
-        time.sleep(0.01)
-    else:
-        logger.warning("Timed out waiting for syncing to complete.")
+    request_id = uuid.uuid4().hex
+    pending = PendingMerge(cells=_transform_jupytext_cells(result["cells"]))
+    _PENDING_MERGES[request_id] = pending
+
+    try:
+        pending.trace.record("asking frontend for its cells")
+        comm.send({"command": "start_sync_notebook", "request_id": request_id, "trace_id": pending.trace.trace_id})
+
+        # Wait for the frontend to tell us it's done (see `complete_merge`).
+        # This way we don't release the lock before syncing is done.
+        timeout = SYNC_TIMEOUT + SYNC_TIMEOUT_PER_CELL * len(pending.cells)
+        if not pending.complete.wait(timeout):
+            logger.warning("Timed out after {:.1f}s waiting for syncing to complete.", timeout)
+            return False
+
+        pending.trace.record("sync complete")
+        return True
+    finally:
+        _PENDING_MERGES.pop(request_id, None)
     # contents = NotebookContents(cells=result["cells"])
 
 
+def _find_pending_merge(request_id: Optional[str]) -> Optional[PendingMerge]:
+    if request_id is None:
+        # From a frontend that doesn't send request ids yet. Syncs hold the lock, so there's at most one.
+        return next(iter(_PENDING_MERGES.values()), None)
+
+    return _PENDING_MERGES.get(request_id)
+
+
+def complete_merge(request_id: Optional[str], apply_ms: Optional[float] = None) -> None:
+    """Called when the frontend says it has finished merging a sync, taking `apply_ms` to apply the changes if it said."""
+    pending = _find_pending_merge(request_id)
+
+    if pending is None:
+        logger.warning("Got merge_complete for unknown sync {}, perhaps it already timed out", request_id)
+        return
+
+    if pending.patch_sent is not None:
+        metrics.observe_stage("apply", time.perf_counter() - pending.patch_sent)
+    pending.trace.record("frontend applied changes" + _frontend_time(apply_ms))
+
+    pending.complete.set()
+
+
 def get_output_text(javascript_cell) -> Optional[str]:
     """Get cell output or return None if no output?"""
     output_tuple = javascript_cell.get("outputs", tuple())
     if not output_tuple:
         return None
 
-    output = output_tuple[0]
+    return output_text(output_tuple[0])
 
+
+def output_text(output: Dict[str, Any]) -> Optional[str]:
+    """The text of one output (or the content of an output message), or None if it has none."""
     if output.get("data", None):
         data = output["data"]
 
@@ -271,28 +712,72 @@ def merge_notebooks(comm: Comm, result: Dict[str, Any]) -> None:
         ]
     )
 
-    new_notebook = NotebookContents(cells=[JupyterCell(**x) for x in result["new_notebook"]])
+    request_id = result.get("request_id")
+
+    pending = _find_pending_merge(request_id)
+    if pending is None:
+        logger.warning("Got merge_notebooks for unknown sync {}, perhaps it already timed out", request_id)
+        return
+
+    metrics.observe_stage("frontend_round_trip", time.perf_counter() - pending.started)
+    pending.trace.record(f"got {len(javascript_cells)} cells from frontend" + _frontend_time(result.get("collect_ms")))
+    new_notebook = NotebookContents(cells=[JupyterCell(**x) for x in pending.cells])
+
+    with metrics.timed("merge"):
+        opcodes = opcode_merge_cell_contents(current_notebook, new_notebook)
+    changed_cells = count_changed_cells(opcodes)
+    metrics.increment("cells_changed_total", changed_cells)
+    pending.trace.record(f"merged, {changed_cells} cells changed")
+    logger.info("Performing {} opcodes...", len(opcodes))
+    logger.debug("{}", summarize(opcodes))
+
+    # Send all of the changes at once, so the frontend can apply them in one go.
+    patch = compile_patch(opcodes, current_notebook, new_notebook)
+    pending.patch_sent = time.perf_counter()
+    comm.send({"command": "apply_patch", "operations": patch, "trace_id": pending.trace.trace_id})
+    pending.trace.record(f"sent frontend {len(patch)} changes")
+
+    logger.info("sending finish_merge command")
+    comm.send({"command": "finish_merge", "request_id": request_id, "trace_id": pending.trace.trace_id})
+
+
+def _frontend_time(milliseconds: Optional[float]) -> str:
+    # The frontend's clock isn't ours, so it tells us how long things took rather than when they happened.
+    return "" if milliseconds is None else f" (took {milliseconds:.1f} ms there)"
+
+
+def count_changed_cells(opcodes: List[OpCodeAction]) -> int:
+    """How many cells `opcodes` insert, replace or delete."""
+    return sum(
+        max(x.current_final_idx - x.current_start_idx, x.updated_final_idx - x.updated_start_idx)
+        for x in opcodes
+        if x.op_code in (OpCodes.INSERT, OpCodes.DELETE, OpCodes.REPLACE)
+    )
+
 
-    opcodes = opcode_merge_cell_contents(current_notebook, new_notebook)
-    logger.info("Performing Opcodes...")
-    logger.info(opcodes)
+def compile_patch(
+    opcodes: List[OpCodeAction], current_notebook: NotebookContents, updated_notebook: NotebookContents
+) -> List[Dict[str, Any]]:
+    """Turn opcodes into an ordered list of `op_code__*` operations, with cell indices the frontend can apply in order."""
+    patch: List[Dict[str, Any]] = []
 
     net_shift = 0
     for op_action in opcodes:
-        net_shift = perform_op_code(comm, op_action, current_notebook, new_notebook, net_shift)
+        net_shift = compile_op_code(patch, op_action, current_notebook, updated_notebook, net_shift)
 
-    logger.info("sending finish_merge command")
-    comm.send({"command": "finish_merge"})
+    return patch
 
 
-def perform_op_code(
-    comm: Comm,
+def compile_op_code(
+    patch: List[Dict[str, Any]],
     op_action: OpCodeAction,
     current_notebook: NotebookContents,
     updated_notebook: NotebookContents,
     net_shift: int,
 ) -> int:
     """
+    Appends the operations for `op_action` to `patch`.
+
     net_shift (int): Tracks the net shift of previous op codes since we can't apply all the operations at the same time to jupyter,
                         since it does not have that kind of editting model.
 
@@ -304,20 +789,20 @@ def perform_op_code(
         pass
 
     elif op_action.op_code == OpCodes.DELETE:
-        logger.info(f"Performing Delete: {op_action}")
+        logger.debug(f"Compiling Delete: {op_action}")
 
         # Since deletion is a bit goofy for jupyter, so it has to be adjusted by net shift thus far.
         cells_to_delete = [x + net_shift for x in range(*op_action.current)]
-        comm.send({"command": "op_code__delete_cells", "cell_indices": cells_to_delete})
+        patch.append({"command": "op_code__delete_cells", "cell_indices": cells_to_delete})
 
         net_shift = net_shift - len(cells_to_delete)
 
     elif op_action.op_code == OpCodes.INSERT:
-        logger.info(f"Performing Insert: {op_action}")
+        logger.debug(f"Compiling Insert: {op_action}")
 
         cells_to_insert = list(range(*op_action.updated))
         for cell_number in cells_to_insert:
-            comm.send(
+            patch.append(
                 {
                     "command": "op_code__insert_cell",
                     "cell_number": cell_number,
@@ -338,7 +823,7 @@ def perform_op_code(
             if current_cells:
                 current_cells.pop(0)
 
-                comm.send(
+                patch.append(
                     {
                         "command": "op_code__replace_cell",
                         "cell_number": cell_number,
@@ -348,8 +833,8 @@ def perform_op_code(
                 )
             # Otherwise, we have new cells to insert so we don't overwrite existing cells
             else:
-                net_shift = perform_op_code(
-                    comm,
+                net_shift = compile_op_code(
+                    patch,
                     OpCodeAction(
                         op_code=OpCodes.INSERT,
                         # NOTE: This is intentionally the last index for both of these
@@ -366,8 +851,8 @@ def perform_op_code(
         # If we have cells left over from the replace (i.e. 1-4 replaced with 1-2),
         #   then we need to delete the rest of them.
         if current_cells:
-            net_shift = perform_op_code(
-                comm,
+            net_shift = compile_op_code(
+                patch,
                 OpCodeAction(
                     op_code=OpCodes.DELETE,
                     current_start_idx=current_cells[0],
@@ -381,6 +866,10 @@ def perform_op_code(
                 net_shift,
             )
 
+    elif op_action.op_code == OpCodes.COPY_OUTPUT:
+        # Outputs are left where they are for now.
+        pass
+
     else:
         raise NotImplementedError
 
@@ -389,7 +878,24 @@ def perform_op_code(
 
 def execute_cell_contents(comm: Comm, cell_number: int) -> None:
     comm.send({"command": "execute", "cell_number": cell_number})
+    tracing.record(f"asked frontend to execute cell {cell_number}")
 
 
 def execute_all_cells(comm: Comm) -> None:
     comm.send({"command": "execute_all"})
+    tracing.record("asked frontend to execute all cells")
+
+
+def execute_cell_range(
+    comm: Comm, request_id: str, start_cell: int, end_cell: Optional[int], stop_on_error: bool
+) -> None:
+    comm.send(
+        {
+            "command": "execute_range",
+            "request_id": request_id,
+            "start_cell": start_cell,
+            "end_cell": end_cell,
+            "stop_on_error": stop_on_error,
+        }
+    )
+    tracing.record(f"asked frontend to execute cells {start_cell} to {end_cell}")
@@ -0,0 +1,101 @@
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+
+class _Node:
+    __slots__ = ("children", "names", "count")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+
+        # Registered names whose path ends at this node
+        self.names: Set[str] = set()
+
+        # How many registered names are at or below this node
+        self.count = 0
+
+
+class NotebookPathIndex:
+    """
+    Finds the registered notebook paths that share the longest tail with a path.
+
+    Paths are stored in a trie keyed by their parts from the end, e.g. `/home/tj/notebook.sync.ipynb` is stored
+    under `notebook.sync.ipynb` -> `tj` -> `home` -> `/`. Following a path down the trie as far as it goes ends
+    on the node whose subtree holds exactly the names that match the most parts, so a lookup costs the depth of
+    the path no matter how many notebooks are registered.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+
+    def __len__(self) -> int:
+        return self._root.count
+
+    @staticmethod
+    def _parts(name: str) -> Tuple[str, ...]:
+        return tuple(reversed(Path(name).parts))
+
+    def add(self, name: str) -> None:
+        parts = self._parts(name)
+
+        node = self._root
+        for part in parts:
+            node = node.children.setdefault(part, _Node())
+
+        if name in node.names:
+            return
+
+        node.names.add(name)
+
+        node = self._root
+        node.count += 1
+        for part in parts:
+            node = node.children[part]
+            node.count += 1
+
+    def remove(self, name: str) -> None:
+        parts = self._parts(name)
+
+        path = [self._root]
+        for part in parts:
+            child = path[-1].children.get(part)
+            if child is None:
+                return
+
+            path.append(child)
+
+        if name not in path[-1].names:
+            return
+
+        path[-1].names.remove(name)
+
+        for node in path:
+            node.count -= 1
+
+        # Drop the nodes nothing is registered under anymore
+        for depth in range(len(parts), 0, -1):
+            if path[depth].count == 0:
+                del path[depth - 1].children[parts[depth - 1]]
+
+    def best_match(self, path: str) -> Optional[str]:
+        """The registered name that shares the most trailing parts with `path`, if exactly one does."""
+        node = self._root
+        for part in self._parts(path):
+            child = node.children.get(part)
+            if child is None:
+                break
+
+            node = child
+
+        # Nothing matched at all, or several names match equally well.
+        if node is self._root or node.count != 1:
+            return None
+
+        while not node.names:
+            (node,) = [x for x in node.children.values() if x.count]
+
+        (name,) = node.names
+        return name
@@ -0,0 +1,295 @@
+"""
+Sends what a cell prints back to the client that asked for it to be executed, while it runs.
+
+A client watches for output (`WatchOutputRequest`) before it executes a cell, which makes an `OutputBuffer`, and
+then sends the buffer's stream id along with the execute request. The handler of that request arms the buffer right
+before it has the cell executed, so the cell fills the buffer with its stdout, stderr, displays and result, and the
+client (through the server extension's `/jupyter_ascending/stream` endpoint) reads it back with `ReadOutputRequest`.
+
+The client reads at its own pace, so the kernel never waits for it: a cell's output is kept up to a maximum
+number of bytes, and anything past that is dropped (and counted) instead of piling up.
+
+`headless.py` uses the same capturing to record the outputs of the cells it runs (see `recording`).
+"""
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from typing import Any
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+import attr
+from loguru import logger
+
+from jupyter_ascending._environment import OUTPUT_STREAM_MAX_BYTES
+from jupyter_ascending._environment import OUTPUT_STREAM_START_TIMEOUT
+
+# How many buffers to keep around, in case clients go away without reading theirs.
+MAX_OUTPUT_BUFFERS = 16
+
+
+@attr.dataclass
+class OutputChunk:
+    #: "stdout", "stderr", "display", "result" or "error"
+    name: str
+    text: str
+
+    #: The whole mime bundle of a display or result, or the name and value of an error. Not sent to clients.
+    data: Optional[Dict[str, Any]] = None
+
+
+class OutputBuffer:
+    """The output of one cell, waiting to be read."""
+
+    def __init__(self, max_bytes: int = OUTPUT_STREAM_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+        self.created = time.monotonic()
+        self.started = False
+        self.done = False
+
+        # Bytes of output kept so far, and dropped because there was more than `max_bytes`.
+        self.kept_bytes = 0
+        self.dropped_bytes = 0
+
+        self._chunks: Deque[OutputChunk] = deque()
+        self._condition = threading.Condition()
+
+    def append(self, name: str, text: str, data: Optional[Dict[str, Any]] = None) -> None:
+        if not text:
+            return
+
+        with self._condition:
+            if self.done:
+                return
+
+            size = len(text.encode("utf8", errors="replace"))
+            if self.kept_bytes + size > self.max_bytes:
+                kept_text = text.encode("utf8", errors="replace")[: self.max_bytes - self.kept_bytes]
+                text = kept_text.decode("utf8", errors="ignore")
+
+                self.dropped_bytes += size - len(kept_text)
+                size = len(kept_text)
+
+            if not text:
+                return
+
+            self.kept_bytes += size
+            if data is None and self._chunks and self._chunks[-1].name == name and self._chunks[-1].data is None:
+                # Cells often print a line at a time, so keep the number of chunks down.
+                self._chunks[-1] = OutputChunk(name=name, text=self._chunks[-1].text + text)
+            else:
+                self._chunks.append(OutputChunk(name=name, text=text, data=data))
+
+            self._condition.notify_all()
+
+    def start(self) -> None:
+        with self._condition:
+            self.started = True
+
+    def finish(self) -> None:
+        with self._condition:
+            self.done = True
+            self._condition.notify_all()
+
+    def expire_if_never_started(self, start_timeout: float = OUTPUT_STREAM_START_TIMEOUT) -> None:
+        with self._condition:
+            if not self.started and time.monotonic() - self.created > start_timeout:
+                logger.info("No cell ran within {}s of watching for output, giving up", start_timeout)
+                self.finish()
+
+    def read(self, wait: float, max_bytes: int) -> Tuple[List[OutputChunk], bool]:
+        """Up to about `max_bytes` of output, waiting up to `wait` seconds for some. Also whether that's all of it."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._chunks or self.done, timeout=wait)
+
+            chunks = []
+            read_bytes = 0
+            while self._chunks and (not chunks or read_bytes < max_bytes):
+                chunk = self._chunks.popleft()
+                chunks.append(chunk)
+                read_bytes += len(chunk.text)
+
+            return chunks, self.done and not self._chunks
+
+
+_BUFFERS: Dict[str, OutputBuffer] = {}
+
+# Ids of buffers waiting for the next cell to run, oldest first.
+_ARMED: Deque[str] = deque()
+
+# The buffer of the cell that is running now, if anyone is watching it.
+_current: Optional[OutputBuffer] = None
+
+# Buffers that get the output of every cell that runs while they're here. See `recording`.
+_recorders: List[OutputBuffer] = []
+
+# The thread running the current cell. Only what it writes is captured, not what other threads (e.g. log sinks, or
+#   `headless.py` saving the notebook) write to stdout and stderr meanwhile.
+_cell_thread: Optional[int] = None
+
+_lock = threading.Lock()
+_installed = False
+
+
+def watch(stream_id: str) -> None:
+    """Make the buffer `stream_id`, for the output of the cell that is executed with it (see `arm`)."""
+    with _lock:
+        _BUFFERS[stream_id] = OutputBuffer()
+
+        while len(_BUFFERS) > MAX_OUTPUT_BUFFERS:
+            stale_id = next(iter(_BUFFERS))
+            _BUFFERS.pop(stale_id).finish()
+            if stale_id in _ARMED:
+                _ARMED.remove(stale_id)
+
+
+def arm(stream_id: str) -> None:
+    """Send the output of the next cell that runs to the buffer `stream_id`.
+
+    Call this right before executing the cell, from the request that executes it, so it gets that cell's output
+    rather than that of whatever cell happens to run next."""
+    with _lock:
+        if stream_id not in _BUFFERS:
+            logger.warning("Nobody is watching output stream {} anymore, not capturing its cell", stream_id)
+            return
+
+        _ARMED.append(stream_id)
+
+
+def read(stream_id: str, wait: float, max_bytes: int) -> Dict[str, Any]:
+    buffer = _BUFFERS.get(stream_id)
+    if buffer is None:
+        return {"chunks": [], "done": True, "dropped_bytes": 0}
+
+    buffer.expire_if_never_started()
+    chunks, done = buffer.read(wait, max_bytes)
+    if done:
+        with _lock:
+            _BUFFERS.pop(stream_id, None)
+            if stream_id in _ARMED:
+                _ARMED.remove(stream_id)
+
+    chunks_without_data = [attr.asdict(x, filter=lambda a, _: a.name != "data") for x in chunks]
+    return {"chunks": chunks_without_data, "done": done, "dropped_bytes": buffer.dropped_bytes}
+
+
+@contextmanager
+def recording(buffer: OutputBuffer) -> Iterator[OutputBuffer]:
+    """Add the output of the cells that run inside this block to `buffer`, whether or not anyone is watching."""
+    with _lock:
+        _recorders.append(buffer)
+
+    try:
+        yield buffer
+    finally:
+        with _lock:
+            _recorders.remove(buffer)
+
+
+def _active_buffers() -> List[OutputBuffer]:
+    buffer = _current
+    return ([] if buffer is None else [buffer]) + _recorders
+
+
+def _capture(name: str, text: str, data: Optional[Dict[str, Any]] = None) -> None:
+    if threading.get_ident() != _cell_thread:
+        return
+
+    for buffer in _active_buffers():
+        buffer.append(name, text, data)
+
+
+def _wrap_write(stream: Any, name: str) -> None:
+    write = stream.write
+
+    def _write(text):
+        _capture(name, text)
+        return write(text)
+
+    stream.write = _write
+
+
+def _display_hook(output_text: Callable[[Dict[str, Any]], Optional[str]]) -> Callable[[Dict[str, Any]], Any]:
+    def _hook(msg):
+        if msg.get("msg_type", msg.get("header", {}).get("msg_type")) == "display_data":
+            _capture("display", (output_text(msg["content"]) or "") + "\n", msg["content"].get("data", {}))
+
+        return msg
+
+    return _hook
+
+
+def install(shell: Any, output_text: Callable[[Dict[str, Any]], Optional[str]]) -> None:
+    """Start capturing the output of cells that someone is watching. Safe to call more than once.
+
+    `output_text` extracts the text of an output, like `jupyter_notebook.get_output_text` does."""
+    global _installed
+
+    if _installed:
+        return
+
+    _wrap_write(sys.stdout, "stdout")
+    _wrap_write(sys.stderr, "stderr")
+
+    display_hook = _display_hook(output_text)
+    # Threads the display hook is registered on.
+    hook_registered: Set[int] = set()
+
+    def _pre_run_cell(info):
+        global _current, _cell_thread
+
+        _cell_thread = threading.get_ident()
+        with _lock:
+            stream_id = _ARMED.popleft() if _ARMED else None
+            _current = _BUFFERS.get(stream_id)
+
+        if _current is not None:
+            _current.start()
+
+        if _active_buffers():
+            # Display hooks are per thread, and this is the thread that runs the cell.
+            shell.display_pub.register_hook(display_hook)
+            hook_registered.add(threading.get_ident())
+
+    def _post_run_cell(result):
+        global _current, _cell_thread
+
+        if threading.get_ident() in hook_registered:
+            shell.display_pub.unregister_hook(display_hook)
+            hook_registered.remove(threading.get_ident())
+
+        # Formatting the result runs every formatter again (HTML, images, ...), so only do it if someone wants it.
+        if not _active_buffers():
+            _cell_thread = None
+            return
+
+        error = result.error_before_exec or result.error_in_exec
+        if error is not None:
+            _capture(
+                "error",
+                "".join(traceback.format_exception(type(error), error, error.__traceback__)),
+                {"ename": type(error).__name__, "evalue": str(error)},
+            )
+        elif result.result is not None:
+            data = shell.display_formatter.format(result.result)[0]
+            _capture("result", (data.get("text/plain") or "") + "\n", data)
+
+        buffer, _current = _current, None
+        _cell_thread = None
+        if buffer is not None:
+            buffer.finish()
+
+    shell.events.register("pre_run_cell", _pre_run_cell)
+    shell.events.register("post_run_cell", _post_run_cell)
+
+    _installed = True
@@ -1,13 +1,25 @@
-from pathlib import Path
+import asyncio
+import atexit
+import json
+import time
+import uuid
+from collections import Counter
+from functools import lru_cache
 from typing import Any
 from typing import Dict
 from typing import Optional
+from typing import Tuple
 
+from aiohttp import ClientConnectorError
+from aiohttp import ClientError
 from aiohttp import ClientSession
+from aiohttp import ClientTimeout
+from aiohttp import TCPConnector
+from aiohttp import TraceConfig
 from jsonrpcclient import Ok
 from jsonrpcclient import parse
 from jsonrpcclient import request
-from jsonrpcserver import async_dispatch as dispatch
+from jsonrpcserver import async_dispatch_to_serializable as dispatch_to_serializable
 from jsonrpcserver import method
 from jsonrpcserver import Error
 from jsonrpcserver import Result
@@ -15,18 +27,100 @@ from jsonrpcserver import Success
 from loguru import logger
 from notebook.base.handlers import IPythonHandler  # type: ignore
 from notebook.utils import url_path_join  # type: ignore
+from tornado.iostream import StreamClosedError
 
+from jupyter_ascending import metrics
+from jupyter_ascending import tracing
+from jupyter_ascending import wire
+from jupyter_ascending._environment import KERNEL_CONNECTIONS_PER_NOTEBOOK
+from jupyter_ascending._environment import KERNEL_REQUEST_TIMEOUT
 from jupyter_ascending._environment import SYNC_EXTENSION
 from jupyter_ascending.errors import UnableToFindNotebookException
-from jupyter_ascending.functional import get_matching_tail_tokens
+from jupyter_ascending.handlers.notebook_index import NotebookPathIndex
+from jupyter_ascending.json_requests import REQUEST_NAMES
+from jupyter_ascending.logger import summarize
 
 _REGISTERED_SERVERS: Dict[str, int] = {}
+# The keys of `_REGISTERED_SERVERS`, indexed so we can find the best match for a path quickly.
+_NOTEBOOK_INDEX = NotebookPathIndex()
+
+# Sessions for forwarding requests to the notebooks, so connections to them are kept alive between requests.
+#   A session belongs to the loop it was made on, so there's one per loop we run on (the server's, or e.g. a test's),
+#   and whether it's for output streams (see `_get_session`). Closed when the server shuts down, see `load_extension`.
+_SESSIONS: Dict[Tuple[asyncio.AbstractEventLoop, bool], ClientSession] = {}
+
+# How long each read of a cell's output waits for the cell to print something, in seconds.
+OUTPUT_STREAM_POLL_WAIT = 5.0
+
+# The format each notebook said it can read requests in. See `wire.py`.
+_NOTEBOOK_WIRE_FORMATS: Dict[str, wire.WireFormat] = {}
+
+# How many connections to the notebooks were opened vs reused.
+connection_counters: Counter = Counter()
 
 
 def _clear_registered_servers():
     global _REGISTERED_SERVERS
+    global _NOTEBOOK_INDEX
 
     _REGISTERED_SERVERS = {}
+    _NOTEBOOK_INDEX = NotebookPathIndex()
+    _NOTEBOOK_WIRE_FORMATS.clear()
+    _find_registered_notebook.cache_clear()
+
+
+def _unregister_notebook_server(notebook_path: str) -> None:
+    if _REGISTERED_SERVERS.pop(notebook_path, None) is None:
+        return
+
+    _NOTEBOOK_INDEX.remove(notebook_path)
+    _find_registered_notebook.cache_clear()
+
+
+async def _on_connection_create_end(session, trace_config_ctx, params):
+    connection_counters["created"] += 1
+
+
+async def _on_connection_reuseconn(session, trace_config_ctx, params):
+    connection_counters["reused"] += 1
+
+
+def _get_session(streaming: bool = False) -> ClientSession:
+    """The session for the running loop.
+
+    Reading a cell's output holds a connection until the cell prints something, so output streams get a session of
+    their own, without a limit. Otherwise a few of them could use up all of a notebook's connections."""
+    key = (asyncio.get_running_loop(), streaming)
+
+    if key not in _SESSIONS or _SESSIONS[key].closed:
+        trace_config = TraceConfig()
+        trace_config.on_connection_create_end.append(_on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(_on_connection_reuseconn)
+
+        _SESSIONS[key] = ClientSession(
+            connector=TCPConnector(limit=0, limit_per_host=0 if streaming else KERNEL_CONNECTIONS_PER_NOTEBOOK),
+            timeout=ClientTimeout(total=KERNEL_REQUEST_TIMEOUT),
+            trace_configs=[trace_config],
+        )
+
+    return _SESSIONS[key]
+
+
+async def _close_session():
+    """Close the sessions of the running loop."""
+    loop = asyncio.get_running_loop()
+
+    for key in [x for x in _SESSIONS if x[0] is loop]:
+        await _SESSIONS.pop(key).close()
+
+
+def _close_sessions_at_exit() -> None:
+    # The server's loop has stopped by now, but it isn't closed, so we can still run it to close its sessions.
+    for (loop, _), session in list(_SESSIONS.items()):
+        if not loop.is_closed() and not loop.is_running():
+            loop.run_until_complete(session.close())
+
+    _SESSIONS.clear()
 
 
 class JupyterAscendingHandler(IPythonHandler):
@@ -39,15 +133,130 @@ class JupyterAscendingHandler(IPythonHandler):
         or you'll get a deadlock in the notebook kernel thread as it processes
         this request. Thus the usage of `asyncio`.
         """
-        request = self.request.body.decode()
-        response = await dispatch(request)
-        logger.info("Got Response:\n\t\t{}", response)
-        self.write(str(response))
+        start = time.perf_counter()
+        for key, value in wire.accept_post_headers().items():
+            self.set_header(key, value)
+
+        for stage, seconds in metrics.parse_timings(self.request.headers.get(metrics.CLIENT_TIMING_HEADER)):
+            if stage in metrics.CLIENT_STAGES:
+                metrics.observe_stage(stage, seconds)
+        metrics.increment("request_bytes_total", len(self.request.body))
+
+        try:
+            request = wire.decode(self.request.body, self.request.headers)
+        except wire.UnreadableBody as e:
+            logger.warning("Got a request we can't read: {}", e)
+            self.set_status(wire.UNREADABLE_BODY_STATUS)
+            return
+
+        # Part of the client's trace if it sent us its id. Each request runs in its own task, so has its own context.
+        with tracing.started(self.request.headers.get(tracing.TRACE_ID_HEADER), process="server") as trace:
+            logger.info("Processing request (trace {})", trace.trace_id)
+            trace.record("got request")
+            response = await dispatch_to_serializable(request, deserializer=lambda x: x)
+            trace.record("answered")
+
+        logger.info("Got Response:\n\t\t{}", summarize(response))
+        if response is None:
+            self.set_status(204)
+            return
+
+        # Answer in the best format the client can read.
+        body, headers = wire.encode(response, wire.choose_for_request(self.request.headers))
+        for key, value in headers.items():
+            self.set_header(key, value)
+
+        metrics.increment("response_bytes_total", len(body))
+        # So the client can tell how much of its wait was spent getting here and back.
+        self.set_header("Server-Timing", metrics.format_timings([("server", time.perf_counter() - start)]))
+        self.set_header(tracing.TRACE_HEADER, tracing.format_events(trace.events))
+        self.write(body)
 
     def check_xsrf_cookie(self):
         """Disable XSRF cookie checking on this request type"""
 
 
+class JupyterAscendingStreamHandler(IPythonHandler):
+    """Streams the output of a cell that runs in a notebook, as JSON lines.
+
+    GET `/jupyter_ascending/stream?file_name=...`. The first line, `{"event": "watching", "stream_id": ...}`, is sent
+    once the notebook is watching. The client then executes the cell with that `stream_id`. Then come
+    `{"event": "output", "name": ..., "text": ...}` lines as the cell prints, and a last `{"event": "done", ...}`.
+
+    We only read more from the notebook once the client has received what we already sent, so a slow client
+    slows the reading down instead of making us buffer. The notebook caps how much it keeps (see `output_stream.py`).
+
+    NOTE: like `JupyterAscendingHandler`, authentication is disabled on this endpoint!!!
+    """
+
+    async def get(self) -> None:
+        file_name = self.get_argument("file_name")
+        stream_id = uuid.uuid4().hex
+
+        try:
+            await _forward_to_notebook(file_name, "WatchOutputRequest", {"file_name": file_name, "stream_id": stream_id})
+        except NotebookRequestFailed as e:
+            self.set_status(404)
+            self.finish(json.dumps({"event": "error", "message": str(e)}))
+            return
+
+        self.set_header("Content-Type", "application/x-ndjson")
+
+        data = {"file_name": file_name, "stream_id": stream_id, "wait": OUTPUT_STREAM_POLL_WAIT, "max_bytes": 65536}
+        try:
+            await self._send_line({"event": "watching", "stream_id": stream_id})
+
+            while True:
+                result = await _forward_to_notebook(file_name, "ReadOutputRequest", data, streaming=True)
+
+                for chunk in result["chunks"]:
+                    await self._send_line({"event": "output", **chunk})
+
+                if result["done"]:
+                    await self._send_line({"event": "done", "dropped_bytes": result["dropped_bytes"]})
+                    return
+        except NotebookRequestFailed as e:
+            await self._send_line({"event": "error", "message": str(e)})
+        except StreamClosedError:
+            logger.info("Client stopped reading output stream {}", stream_id)
+
+    async def _send_line(self, data: Dict[str, Any]) -> None:
+        self.write(json.dumps(data) + "\n")
+        await self.flush()
+
+
+class JupyterAscendingMetricsHandler(IPythonHandler):
+    """Serves the metrics of the server extension and of all registered notebooks, added up. See `metrics.py`.
+
+    GET `/jupyter_ascending/metrics`, in the Prometheus text format.
+
+    NOTE: like `JupyterAscendingHandler`, authentication is disabled on this endpoint!!!
+    """
+
+    async def get(self) -> None:
+        notebooks = {port: path for path, port in _REGISTERED_SERVERS.items()}
+        notebook_metrics = await asyncio.gather(*(_get_notebook_metrics(x, y) for x, y in notebooks.items()))
+
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(metrics.render(metrics.combine([metrics.snapshot()] + [x for x in notebook_metrics if x])))
+
+
+async def _get_notebook_metrics(port_number: int, notebook_path: str) -> Optional[Dict[str, Any]]:
+    # Straight to the notebook, rather than through `_forward_to_notebook`, so collecting metrics doesn't add to them.
+    json_rpc_request = request("GetMetricsRequest", params=dict(data={"file_name": notebook_path}))
+    try:
+        response = parse(await _post_to_notebook(_make_url(port_number), json_rpc_request, timed=False))
+    except (ClientError, asyncio.TimeoutError, wire.UnreadableBody) as e:
+        response = e
+
+    if not isinstance(response, Ok):
+        logger.info("Unable to get metrics from notebook on port {}: {}", port_number, response)
+        metrics.increment("scrape_errors_total")
+        return None
+
+    return response.result
+
+
 def load_extension(nb_server_app):
     """
     Called when the extension is loaded.
@@ -56,29 +265,72 @@ def load_extension(nb_server_app):
         nb_server_app (NotebookWebApplication): handle to the Notebook webserver instance.
     """
     web_app = nb_server_app.web_app
+    # The notebook server has no hook for extensions on shutdown, but it stops its loop before exiting.
+    atexit.register(_close_sessions_at_exit)
+
     host_pattern = ".*$"
     route_pattern = url_path_join(web_app.settings["base_url"], "/jupyter_ascending")
-    web_app.add_handlers(host_pattern, [(route_pattern, JupyterAscendingHandler)])
+    web_app.add_handlers(
+        host_pattern,
+        [
+            (route_pattern, JupyterAscendingHandler),
+            (url_path_join(route_pattern, "stream"), JupyterAscendingStreamHandler),
+            (url_path_join(route_pattern, "metrics"), JupyterAscendingMetricsHandler),
+        ],
+    )
 
 
 @method
 async def register_notebook_server(notebook_path: str, port_number: int) -> Result:
     logger.info("Registering notebook {notebook} on port {port}", notebook=notebook_path, port=port_number)
 
+    # Ports get reused, so any other notebook we have on this port is gone.
+    for stale_path in [k for k, v in _REGISTERED_SERVERS.items() if v == port_number and k != notebook_path]:
+        logger.info("Forgetting notebook {notebook}, which was also on port {port}", notebook=stale_path, port=port_number)
+        _unregister_notebook_server(stale_path)
+
     _REGISTERED_SERVERS[notebook_path] = port_number
+    # It may be a new kernel on a port we've seen before, so find out what it can read again.
+    _NOTEBOOK_WIRE_FORMATS.pop(_make_url(port_number), None)
+    _NOTEBOOK_INDEX.add(notebook_path)
+    _find_registered_notebook.cache_clear()
 
     logger.debug("Updated notebook mappings: {}", _REGISTERED_SERVERS)
     return Success()
 
 
+class NotebookRequestFailed(Exception):
+    pass
+
+
 @method
 async def perform_notebook_request(notebook_path: str, command_name: str, data: Dict[str, Any]) -> Result:
     """Receives a command from the client library, picks the notebook that matches
     the filepath, and forwards the command along to that notebook."""
     logger.debug("Performing notebook request... ")
+    metrics.increment("requests_total", command=command_name if command_name in REQUEST_NAMES else "unknown")
+
+    try:
+        result = await _forward_to_notebook(notebook_path, command_name, data)
+    except NotebookRequestFailed as e:
+        metrics.increment("notebook_errors_total")
+        return Error(1, str(e))
+
+    # Pass the notebook's answer back along to the client.
+    return Success(result)
+
 
+async def _forward_to_notebook(
+    notebook_path: str, command_name: str, data: Dict[str, Any], streaming: bool = False
+) -> Any:
+    """Send a command to the notebook that matches `notebook_path`, and return its result.
+
+    Pass `streaming=True` for reads of a cell's output (see `_get_session`).
+    Raises `NotebookRequestFailed` with a message for the client if that doesn't work out."""
     try:
-        notebook_server = get_server_for_notebook(notebook_path)
+        with metrics.timed("route"):
+            notebook_server = get_server_for_notebook(notebook_path)
+        tracing.record(f"found notebook at {notebook_server}")
     except UnableToFindNotebookException as e:
         message = f"""\
 Unable to find a paired notebook for {notebook_path} in registered notebooks: {_REGISTERED_SERVERS}.
@@ -87,65 +339,110 @@ Either a properly named notebook (ending in .sync.ipynb) is not running, or it d
 Exception details:
 {e}"""
         logger.warning(message)
-        return Error(1, message)
+        raise NotebookRequestFailed(message) from e
+
+    try:
+        json_rpc_request = request(command_name, params=dict(data=data))
+        response = parse(await _post_to_notebook(notebook_server, json_rpc_request, streaming=streaming))
+    except (ClientError, asyncio.TimeoutError, wire.UnreadableBody) as e:
+        message = f"Unable to reach notebook at {notebook_server}: {e!r}"
+        logger.error(message)
+
+        if isinstance(e, ClientConnectorError):
+            # Nothing is listening there anymore, so the notebook was closed. It registers again if it comes back.
+            registered_path = _find_registered_notebook(_normalize_notebook_path(notebook_path))
+            if registered_path is not None:
+                _unregister_notebook_server(registered_path)
+
+        raise NotebookRequestFailed(message) from e
+    finally:
+        logger.debug("Notebook connections: {}", dict(connection_counters))
 
-    async with ClientSession() as session:
-        json = request(command_name, params=dict(data=data))
-        async with session.post(notebook_server, json=json) as response:
-            response = parse(await response.json())
     if not isinstance(response, Ok):
-        message = "Got failed response from notebook: {response}"
+        message = f"Got failed response from notebook: {response}"
         logger.error(message)
-        return Error(1, message)
-    return Success()
+        raise NotebookRequestFailed(message)
+
+    return response.result
+
+
+async def _post_to_notebook(
+    notebook_server: str, json_rpc_request: Dict[str, Any], timed: bool = True, streaming: bool = False
+) -> Any:
+    wire_format = _NOTEBOOK_WIRE_FORMATS.get(notebook_server, wire.PLAIN_JSON)
+    body, headers = wire.encode(json_rpc_request, wire_format)
+
+    headers = {**headers, **wire.accept_headers()}
+    trace = tracing.current()
+    if trace is not None:
+        headers[tracing.TRACE_ID_HEADER] = trace.trace_id
+        trace.record(f"sending {json_rpc_request['method']} to kernel")
+
+    start = time.perf_counter()
+    async with _get_session(streaming).post(notebook_server, data=body, headers=headers) as response:
+        kernel_seconds = metrics.server_seconds(response.headers)
+        if kernel_seconds is not None and timed:
+            metrics.observe_stage("kernel_http", max(time.perf_counter() - start - kernel_seconds, 0.0))
+
+        if trace is not None:
+            events = tracing.parse_events(response.headers.get(tracing.TRACE_HEADER))
+            trace.add_remote(events, start, time.perf_counter(), kernel_seconds)
+            trace.record(f"got answer from kernel, status {response.status}")
+
+        if response.status == wire.UNREADABLE_BODY_STATUS and wire_format != wire.PLAIN_JSON:
+            # The notebook changed (e.g. restarted with other packages installed). Plain JSON always works.
+            logger.info("Notebook at {} couldn't read {}, sending plain JSON", notebook_server, wire_format)
+            _NOTEBOOK_WIRE_FORMATS[notebook_server] = wire.PLAIN_JSON
+        else:
+            _NOTEBOOK_WIRE_FORMATS[notebook_server] = wire.choose_for_next_request(response.headers)
+            response.raise_for_status()
+            return wire.decode(await response.read(), response.headers)
+
+    return await _post_to_notebook(notebook_server, json_rpc_request, timed, streaming)
 
 
 def _make_url(notebook_port: int):
     return f"http://localhost:{notebook_port}"
 
 
-def get_server_for_notebook(notebook_str: str) -> Optional[str]:
-    """Get the URL to the server running on the Jupyter notebook that best matches this filename."""
-    # Normalize to notebook path
-    notebook_str = notebook_str.replace(f".{SYNC_EXTENSION}.py", f".{SYNC_EXTENSION}.ipynb")
-    logger.debug("Finding server for notebook_str, script_path: {}", notebook_str)
+def _normalize_notebook_path(notebook_str: str) -> str:
+    return notebook_str.replace(f".{SYNC_EXTENSION}.py", f".{SYNC_EXTENSION}.ipynb")
 
-    notebook_path = Path(notebook_str)
 
-    def get_score_for_name(registered_name: str) -> int:
-        """
-        Note that it is matching on parts of a path
+@lru_cache(maxsize=1024)
+def _find_registered_notebook(notebook_str: str) -> Optional[str]:
+    """
+    The registered notebook whose path has the most consecutive matching parts with notebook_str,
+    from the end toward the start. None if no notebook matches, or several match equally well.
 
-        Returns the consecutive count of matching parts of a path, from the end toward the start.
+    registered ['tmp', 'notebooks', 'myfile.py']
+    notebook   ['opt', 'notebooks', 'myfile.py']
+     -> 2 matching parts
 
-        registered ['tmp', 'notebooks', 'myfile.py']
-        notebook   ['opt', 'notebooks', 'myfile.py']
-         -> 2
+    registered ['a', 'b', 'c']
+    notebook   ['a', 'b', 'd']
+     -> 0 matching parts
 
-        registered ['a', 'b', 'c']
-        notebook   ['a', 'b', 'd']
-         -> 0
+    Cleared whenever the registered notebooks change.
+    """
+    return _NOTEBOOK_INDEX.best_match(notebook_str)
 
-        """
-        return len(get_matching_tail_tokens(notebook_path.parts, Path(registered_name).parts))
 
-    score_by_name = {x: get_score_for_name(x) for x in _REGISTERED_SERVERS.keys()}
+def get_server_for_notebook(notebook_str: str) -> Optional[str]:
+    """Get the URL to the server running on the Jupyter notebook that best matches this filename."""
+    # Normalize to notebook path
+    notebook_str = _normalize_notebook_path(notebook_str)
+    logger.debug("Finding server for notebook_str, script_path: {}", notebook_str)
 
-    if len(score_by_name) == 0:
+    if len(_REGISTERED_SERVERS) == 0:
         raise UnableToFindNotebookException(f"No registered notebooks")
 
-    max_score = max(score_by_name.values())
+    best_match = _find_registered_notebook(notebook_str)
 
-    if max_score <= 0:
+    if best_match is None:
         raise UnableToFindNotebookException(f"Could not find server for notebook_str: {notebook_str}")
 
-    # Only found one reasonable notebook.
-    best_scores = [k for k, v in score_by_name.items() if v == max_score]
+    notebook_port = _REGISTERED_SERVERS[best_match]
 
-    if len(best_scores) == 1:
-        notebook_port = _REGISTERED_SERVERS[best_scores[0]]
-
-        logger.debug("Found server at port {}", notebook_port)
-        return _make_url(notebook_port)
-    else:
-        raise UnableToFindNotebookException(f"Could not find server for notebook_str: {notebook_str}")
+    logger.debug("Found server at port {}", notebook_port)
+    return _make_url(notebook_port)
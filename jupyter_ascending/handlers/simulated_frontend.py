@@ -0,0 +1,114 @@
+"""
+A stand-in for the notebook frontend (`extension.js`), for testing the kernel side without a browser.
+
+It takes the place of the comm that `jupyter_notebook.py` talks to the frontend through, and answers the sync
+protocol the way `extension.js` does, keeping the notebook's cells in a list:
+
+- `start_sync_notebook` is answered with `merge_notebooks`, sending the cells.
+- `apply_patch` and the `op_code__*` messages are applied to the cells.
+- `finish_merge` is answered with `merge_complete`.
+
+Everything else (e.g. `execute`) is only recorded in `received`. Use `reply` to answer those by hand.
+
+By default each message is handled as soon as it's sent. With `latency`, messages are handled one at a time on a
+thread of their own instead, like the browser's event loop does, each after waiting that many seconds.
+"""
+import queue
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+# (cell type, source) for each cell.
+Cells = List[Tuple[str, str]]
+
+
+class SimulatedFrontend:
+    def __init__(self, cells: Optional[Cells] = None, latency: Optional[float] = None):
+        self.cells: Cells = list(cells or [])
+        self.received: List[Dict[str, Any]] = []
+        self.closed = False
+
+        self._on_msg: Optional[Callable[[Dict[str, Any]], None]] = None
+        self._latency = latency
+        self._messages: Optional["queue.Queue[Optional[Dict[str, Any]]]"] = None
+
+        if latency is not None:
+            self._messages = queue.Queue()
+            threading.Thread(target=self._handle_messages, name="simulated_frontend", daemon=True).start()
+
+    def on_msg(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        self._on_msg = callback
+
+    def on_close(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+        if self._messages is not None:
+            self._messages.put(None)
+
+    def send(self, data: Dict[str, Any]) -> None:
+        self.received.append(data)
+
+        if self._messages is not None:
+            self._messages.put(data)
+        else:
+            self._handle(data)
+
+    def reply(self, data: Dict[str, Any]) -> None:
+        """Send `data` to the kernel, like `comm.send` in `extension.js`."""
+        assert self._on_msg is not None, "Nothing is listening to this frontend yet"
+        self._on_msg({"content": {"data": data}})
+
+    def _handle_messages(self) -> None:
+        assert self._messages is not None
+
+        while True:
+            data = self._messages.get()
+            if data is None:
+                return
+
+            time.sleep(self._latency or 0)
+            self._handle(data)
+
+    def _handle(self, data: Dict[str, Any]) -> None:
+        command = data["command"]
+
+        if command == "start_sync_notebook":
+            self.reply(
+                {
+                    "command": "merge_notebooks",
+                    "request_id": data["request_id"],
+                    "trace_id": data.get("trace_id"),
+                    "javascript_cells": [{"cell_type": x, "source": y} for x, y in self.cells],
+                    "collect_ms": 0.5,
+                }
+            )
+        elif command == "apply_patch":
+            for operation in data["operations"]:
+                self._apply(operation)
+        elif command.startswith("op_code__"):
+            self._apply(data)
+        elif command == "finish_merge":
+            self.reply(
+                {
+                    "command": "merge_complete",
+                    "request_id": data["request_id"],
+                    "trace_id": data.get("trace_id"),
+                    "apply_ms": 1.5,
+                }
+            )
+
+    def _apply(self, operation: Dict[str, Any]) -> None:
+        if operation["command"] == "op_code__delete_cells":
+            for cell_index in sorted(operation["cell_indices"], reverse=True):
+                del self.cells[cell_index]
+        elif operation["command"] == "op_code__insert_cell":
+            self.cells.insert(operation["cell_number"], (operation["cell_type"], operation["cell_contents"]))
+        elif operation["command"] == "op_code__replace_cell":
+            self.cells[operation["cell_number"]] = (operation["cell_type"], operation["cell_contents"])
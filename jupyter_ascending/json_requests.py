@@ -2,10 +2,17 @@
 +used to send our custom messages to the Jupyter notebook.
 
 TODO: dataclass looks to be depreciated. Replace with attr.define"""
+from enum import Enum
+from typing import Dict
+from typing import List
 from typing import Optional
 
 from attr import dataclass
 
+# Name of the JSON-RPC method in `handlers/server_extension.py` that clients call.
+#   Spelled out here so that clients don't have to import the server extension (and jupyter) to find it.
+PERFORM_NOTEBOOK_REQUEST = "perform_notebook_request"
+
 
 @dataclass
 class JsonBaseRequest:
@@ -17,12 +24,26 @@ class ExecuteRequest(JsonBaseRequest):
     cell_index: int
     contents: Optional[str]
 
+    # Send the cell's output to this output stream. See `WatchOutputRequest`.
+    stream_id: Optional[str] = None
+
 
 @dataclass
 class ExecuteAllRequest(JsonBaseRequest):
     pass
 
 
+@dataclass
+class ExecuteRangeRequest(JsonBaseRequest):
+    """Execute cells `start_cell` to `end_cell` (inclusive, or to the last cell if None) one after another.
+
+    With `stop_on_error`, the cells after one that raises are not executed."""
+
+    start_cell: int
+    end_cell: Optional[int]
+    stop_on_error: bool = True
+
+
 @dataclass
 class RestartRequest(JsonBaseRequest):
     pass
@@ -33,11 +54,83 @@ class SyncRequest(JsonBaseRequest):
     contents: str
 
 
+@dataclass
+class DeltaSyncRequest(JsonBaseRequest):
+    """Sync only the parts of the file that changed since `base_version`. See `delta_sync.py`."""
+
+    base_version: str
+    version: str
+    segment_hashes: List[str]
+    new_segments: Dict[str, str]
+
+
+@dataclass
+class SyncDigestRequest(JsonBaseRequest):
+    """Ask whether the notebook already matches `version` (see `delta_sync.hash_text`), without sending contents."""
+
+    version: str
+
+
+@dataclass
+class SyncAndExecuteRequest(JsonBaseRequest):
+    """Sync `contents`, then execute the cell that `line_number` is in, without anything running in between."""
+
+    contents: str
+    line_number: int
+
+    # Send the cell's output to this output stream. See `WatchOutputRequest`.
+    stream_id: Optional[str] = None
+
+
+class SyncStatus(Enum):
+    """The "status" in the result of a sync request."""
+
+    APPLIED = "applied"
+
+    # The notebook already matched these contents, so nothing was done.
+    UNCHANGED = "unchanged"
+
+    # A newer sync of the same file arrived before this one was applied, so this one was skipped.
+    SUPERSEDED = "superseded"
+
+    # The frontend didn't confirm it applied the sync in time, so the notebook may or may not have these contents.
+    TIMED_OUT = "timed_out"
+
+    # The notebook doesn't have the contents of a DeltaSyncRequest / SyncDigestRequest. Send a SyncRequest instead.
+    FULL_SYNC_REQUIRED = "full_sync_required"
+
+
 @dataclass
 class GetStatusRequest(JsonBaseRequest):
     pass
 
 
+@dataclass
+class GetMetricsRequest(JsonBaseRequest):
+    """The kernel's counters and latency histograms (see `metrics.py`). Sent by the server extension, not clients."""
+
+
+@dataclass
+class WatchOutputRequest(JsonBaseRequest):
+    """Keep the output of the cell executed with this `stream_id`, so it can be read with `ReadOutputRequest`s."""
+
+    stream_id: str
+
+
+@dataclass
+class ReadOutputRequest(JsonBaseRequest):
+    """Read what's new in the output kept for `stream_id`, waiting up to `wait` seconds for something."""
+
+    stream_id: str
+    wait: float
+    max_bytes: int
+
+
 @dataclass
 class FocusCellRequest(JsonBaseRequest):
     cell_index: int
+
+
+# Names of the requests clients can send, so the server extension can label metrics with them without letting
+#   clients make up new labels.
+REQUEST_NAMES = frozenset(x.__name__ for x in JsonBaseRequest.__subclasses__())
@@ -1,25 +1,129 @@
+import datetime
+import hashlib
 import os
 import sys
 import tempfile
+import time
+from typing import Any
+from typing import Iterable
+from typing import List
+from typing import TextIO
 
 from loguru import logger
 
 from jupyter_ascending._environment import LOG_LEVEL
+from jupyter_ascending._environment import LOG_PAYLOAD_MAX_CHARS
+from jupyter_ascending._environment import LOG_RETENTION_DAYS
+from jupyter_ascending._environment import LOG_ROTATION
 from jupyter_ascending._environment import SHOW_TO_STDOUT
 
+LOG_DIRECTORY = os.path.join(tempfile.gettempdir(), "jupyter_ascending")
 
-def setup_logger():
-    log_file = os.path.join(tempfile.gettempdir(), "jupyter_ascending", "log.log")
-    print(f"Logging Jupyter Ascending logs to {log_file}")
+# Strings in payloads longer than this are logged as their length and hash.
+_MAX_STRING_CHARS = 80
 
-    config = {
-        "handlers": [{"sink": log_file, "serialize": False, "level": LOG_LEVEL}],
-    }
+# These keep running, so each gets log files of its own. Clients run for every sync or execute, so they share one.
+_LONG_LIVED_PROCESSES = ("kernel", "server")
+
+
+class PayloadSummary:
+    """A short version of a request or response, for logging: `logger.info("Got {}", summarize(response))`.
+
+    Long strings (like file contents) are replaced by their length and hash, and the whole thing is cut off at
+    `JUPYTER_ASCENDING_LOG_PAYLOAD_MAX_CHARS` characters. It's only worked out if the message is actually logged."""
+
+    def __init__(self, payload: Any, max_chars: int = LOG_PAYLOAD_MAX_CHARS):
+        self.payload = payload
+        self.max_chars = max_chars
+
+    def __str__(self) -> str:
+        # What's left of max_chars, shared by all the parts as they're summarized, so we can stop early.
+        text = _summarize(self.payload, [self.max_chars])
+
+        return text if len(text) <= self.max_chars else text[: self.max_chars] + "..."
+
+
+def summarize(payload: Any) -> PayloadSummary:
+    return PayloadSummary(payload)
+
+
+def _summarize(value: Any, budget: List[int]) -> str:
+    if isinstance(value, dict):
+        return "{" + _summarize_items((f"{x!r}: " + _summarize(y, budget) for x, y in value.items()), budget) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + _summarize_items((_summarize(x, budget) for x in value), budget) + "]"
+
+    if isinstance(value, (str, bytes)) and len(value) > _MAX_STRING_CHARS:
+        data = value.encode("utf8", errors="replace") if isinstance(value, str) else value
+        text = f"<{type(value).__name__} of length {len(value)}, sha1 {hashlib.sha1(data).hexdigest()[:12]}>"
+    else:
+        text = repr(value)[: max(budget[0], 0) + 1]
+
+    budget[0] -= len(text)
+    return text
+
+
+def _summarize_items(items: Iterable[str], budget: List[int]) -> str:
+    parts = []
+    for part in items:
+        parts.append(part)
+
+        if budget[0] < 0:
+            parts.append("...")
+            break
+
+    return ", ".join(parts)
+
+
+def remove_old_logs(max_age_days: float = LOG_RETENTION_DAYS) -> None:
+    """Remove the log files of processes that are gone, which nothing else cleans up.
+
+    The server extension does this when it starts, so clients don't have to look through the directory every time."""
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+
+    try:
+        entries = list(os.scandir(LOG_DIRECTORY))
+    except OSError:
+        return
+
+    for entry in entries:
+        try:
+            if entry.name.startswith("log.") and entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def setup_logger(stream: TextIO = sys.stdout, process_name: str = "client"):
+    """Configure logging to this process's log file, plus `stream` for anything a user should see.
+
+    `stream` can be swapped for stderr by clients that use stdout as a protocol channel.
+    `process_name` ("client", "server" or "kernel") goes in the log file's name. The server and kernels add their
+    process id, and clients all append to the same file."""
+    if process_name in _LONG_LIVED_PROCESSES:
+        log_file = os.path.join(LOG_DIRECTORY, f"log.{process_name}.{os.getpid()}.log")
+        file_handler = {
+            "sink": log_file,
+            "serialize": False,
+            "level": LOG_LEVEL,
+            # Written by a background thread, so logging never waits for the disk.
+            "enqueue": True,
+            "rotation": LOG_ROTATION,
+            "retention": datetime.timedelta(days=LOG_RETENTION_DAYS),
+        }
+    else:
+        log_file = os.path.join(LOG_DIRECTORY, f"log.{process_name}.log")
+        # Old rotated files are removed by the server (see `remove_old_logs`).
+        file_handler = {"sink": log_file, "serialize": False, "level": LOG_LEVEL, "rotation": LOG_ROTATION}
+
+    print(f"Logging Jupyter Ascending logs to {log_file}", file=stream)
+
+    config = {"handlers": [file_handler]}
 
     if SHOW_TO_STDOUT:
-        config["handlers"].append({"sink": sys.stdout, "format": "{time} - {message}", "level": LOG_LEVEL})
+        config["handlers"].append({"sink": stream, "format": "{time} - {message}", "level": LOG_LEVEL})
     else:
         # Always display warning-and-up output
-        config["handlers"].append({"sink": sys.stdout, "format": "{time} - {message}", "level": "WARNING"})
+        config["handlers"].append({"sink": stream, "format": "{time} - {message}", "level": "WARNING"})
 
     logger.configure(**config)  # type: ignore
@@ -0,0 +1,211 @@
+"""
+Counters and latency histograms, so we can tell where a slow sync spends its time.
+
+The kernel and the server extension each record their own (`increment`, `observe` and `timed`), and clients report
+how long they took to read and parse files with their next request (see `client_lib.timed_stage`). The server
+extension serves all of them at GET `/jupyter_ascending/metrics`, in the Prometheus text format, adding up the
+kernels of all registered notebooks.
+
+Latencies all go in the `jupyter_ascending_stage_seconds` histogram, labelled by stage:
+
+- client_read, client_parse: the client reading the .sync.py file, and parsing it (e.g. to find a cell).
+- route: finding the notebook for a file (`get_server_for_notebook`).
+- kernel_http: the server extension's request to the kernel, minus the time the kernel spent on it.
+- kernel_parse: the kernel reading the synced file with jupytext.
+- frontend_round_trip: from asking the browser for its cells to getting them.
+- merge: `opcode_merge_cell_contents`.
+- apply: from sending the browser the changes to it saying they're applied.
+- sync: all of a sync, in the kernel.
+
+There's no stage for the client's own request to the server extension: a client could only report it with its next
+request, and most clients (e.g. `python -m jupyter_ascending.requests.sync`) send just one. Use `--trace` to see it.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+PREFIX = "jupyter_ascending_"
+
+#: Clients send the stages they timed since their last request in this header, like `Server-Timing`.
+CLIENT_TIMING_HEADER = "Jupyter-Ascending-Client-Timing"
+#: The stages clients may report, so a client can't make up new labels.
+CLIENT_STAGES = ("client_read", "client_parse")
+
+#: Upper bounds of the histogram buckets, in seconds. Fixed, so histograms from different processes add up.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_DESCRIPTIONS = {
+    "stage_seconds": "Time spent in each stage of handling a request.",
+    "requests_total": "Requests received by the server extension, by command.",
+    "request_bytes_total": "Bytes of request bodies received by the server extension.",
+    "response_bytes_total": "Bytes of response bodies sent by the server extension.",
+    "notebook_errors_total": "Requests the server extension couldn't forward to a notebook.",
+    "syncs_total": "Syncs received by kernels, by what happened to them.",
+    "sync_bytes_total": "Bytes of .sync.py contents synced to kernels.",
+    "cells_changed_total": "Cells inserted, replaced or deleted by syncs.",
+    "executes_total": "Execute requests received by kernels, by kind.",
+    "scrape_errors_total": "Kernels that didn't answer while collecting metrics.",
+}
+
+# (name, labels) as kept internally. Labels are sorted (key, value) pairs.
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+_lock = threading.Lock()
+_counters: Dict[_Key, float] = {}
+# For each histogram, the number of observations in each bucket (and one more past the last), then the sum.
+_histograms: Dict[_Key, List[float]] = {}
+
+
+def _key(name: str, labels: Dict[str, Any]) -> _Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def increment(name: str, amount: float = 1, **labels: Any) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.setdefault(key, [0.0] * (len(BUCKETS) + 2))
+
+        bucket = next((i for i, x in enumerate(BUCKETS) if value <= x), len(BUCKETS))
+        histogram[bucket] += 1
+        histogram[-1] += value
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    observe("stage_seconds", seconds, stage=stage)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Record how long the block takes as `stage`, even if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def format_timings(timings: Iterable[Tuple[str, float]]) -> str:
+    """A `Server-Timing` header value for (name, seconds) pairs."""
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings)
+
+
+def parse_timings(header: Optional[str]) -> List[Tuple[str, float]]:
+    """The (name, seconds) pairs of a `Server-Timing` header value. Anything that doesn't parse is left out."""
+    timings = []
+    for metric in (header or "").split(","):
+        name, *parameters = [x.strip() for x in metric.split(";")]
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            try:
+                if key == "dur" and name:
+                    timings.append((name, float(value) / 1000))
+            except ValueError:
+                pass
+
+    return timings
+
+
+def server_seconds(headers: Any) -> Optional[float]:
+    """How long the server said it spent on a request, from the `Server-Timing` header of its response."""
+    return dict(parse_timings(headers.get("Server-Timing"))).get("server")
+
+
+def snapshot() -> Dict[str, Any]:
+    """Everything recorded so far, in a form that can be sent as JSON and added up with `combine`."""
+    with _lock:
+        return {
+            "counters": [[name, dict(labels), value] for (name, labels), value in _counters.items()],
+            "histograms": [[name, dict(labels), list(values)] for (name, labels), values in _histograms.items()],
+        }
+
+
+def combine(snapshots: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Add up snapshots from several processes."""
+    counters: Dict[_Key, float] = {}
+    histograms: Dict[_Key, List[float]] = {}
+
+    for data in snapshots:
+        for name, labels, value in data.get("counters", []):
+            key = _key(name, labels)
+            counters[key] = counters.get(key, 0) + value
+
+        for name, labels, values in data.get("histograms", []):
+            if len(values) != len(BUCKETS) + 2:
+                # From a process with other buckets, so they can't be added up.
+                continue
+
+            key = _key(name, labels)
+            histograms[key] = [x + y for x, y in zip(histograms.get(key, [0.0] * len(values)), values)]
+
+    return {
+        "counters": [[name, dict(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, dict(labels), values] for (name, labels), values in histograms.items()],
+    }
+
+
+def _format_labels(labels: Dict[str, str], **extra: str) -> str:
+    labels = {**labels, **extra}
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(data: Dict[str, Any]) -> str:
+    """`data` in the Prometheus text format."""
+    lines: List[str] = []
+
+    def _header(name: str, metric_type: str) -> None:
+        lines.append(f"# HELP {PREFIX}{name} {_DESCRIPTIONS.get(name, name)}")
+        lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+
+    previous_name = None
+    for name, labels, value in sorted(data["counters"], key=lambda x: (x[0], sorted(x[1].items()))):
+        if name != previous_name:
+            _header(name, "counter")
+            previous_name = name
+
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+
+    previous_name = None
+    for name, labels, values in sorted(data["histograms"], key=lambda x: (x[0], sorted(x[1].items()))):
+        if name != previous_name:
+            _header(name, "histogram")
+            previous_name = name
+
+        cumulative = 0.0
+        for bound, count in zip([*map(repr, BUCKETS), "+Inf"], values[:-1]):
+            cumulative += count
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels, le=bound)} {_format_value(cumulative)}")
+
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {_format_value(cumulative)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def reset() -> None:
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
@@ -71,6 +71,106 @@ define(["base/js/namespace"], function (Jupyter) {
         Jupyter.notebook.execute_all_cells();
     }
 
+    // The kernel never replies to cells it was running (or was going to run) when these happen.
+    const KERNEL_GONE_EVENTS = "kernel_restarting.Kernel kernel_dead.Kernel";
+
+    function execute_cell_and_wait(cell, stop_on_error) {
+        // Resolves with the status of the kernel's reply: "ok", "error" or "aborted".
+        // Rejects if the kernel restarts or dies first, since then the reply never comes.
+        return new Promise(function (resolve, reject) {
+            if (cell.cell_type !== "code" || cell.get_text().trim().length === 0) {
+                // Nothing is sent to the kernel for these, so there won't be a reply.
+                cell.execute();
+                resolve("ok");
+                return;
+            }
+
+            const on_kernel_gone = function (event) {
+                Jupyter.notebook.events.off(KERNEL_GONE_EVENTS, on_kernel_gone);
+                reject(new Error(`The kernel went away (${event.type}) while a cell was executing`));
+            };
+            Jupyter.notebook.events.on(KERNEL_GONE_EVENTS, on_kernel_gone);
+
+            // Hook into the callbacks the cell passes to the kernel, so we hear about the reply too.
+            const get_callbacks = cell.get_callbacks;
+            cell.get_callbacks = function () {
+                const callbacks = get_callbacks.apply(cell, arguments);
+                const reply = callbacks.shell.reply;
+                callbacks.shell.reply = function (msg) {
+                    Jupyter.notebook.events.off(KERNEL_GONE_EVENTS, on_kernel_gone);
+                    reply(msg);
+                    resolve(msg.content.status);
+                };
+                return callbacks;
+            };
+
+            try {
+                cell.execute(stop_on_error);
+            } finally {
+                delete cell.get_callbacks;
+            }
+        });
+    }
+
+    async function execute_cell_range(comm_obj, data) {
+        const last_cell = Jupyter.notebook.ncells() - 1;
+        const end_cell = data.end_cell === null ? last_cell : Math.min(data.end_cell, last_cell);
+
+        // Get the cells up front, so syncs that happen while we're executing can't change which ones we run.
+        let cells = [];
+        for (let cell_number = Math.max(data.start_cell, 0); cell_number <= end_cell; cell_number++) {
+            cells.push([cell_number, Jupyter.notebook.get_cell(cell_number)]);
+        }
+
+        // Why we stopped before the end of the range, if something other than a cell did that.
+        let error = null;
+        for (const [cell_number, cell] of cells) {
+            let status;
+            try {
+                status = await execute_cell_and_wait(cell, data.stop_on_error);
+            } catch (e) {
+                error = e.message;
+                status = "aborted";
+            }
+
+            send_range_update(comm_obj, {
+                command: "execute_range_progress",
+                request_id: data.request_id,
+                cell_number: cell_number,
+                status: status,
+            });
+
+            if (error !== null || (status !== "ok" && data.stop_on_error)) {
+                break;
+            }
+        }
+
+        send_range_update(comm_obj, {command: "execute_range_complete", request_id: data.request_id, error: error});
+    }
+
+    function send_range_update(comm_obj, message) {
+        // After a restart the comm may be gone along with the old kernel. Nobody is waiting for this then.
+        try {
+            comm_obj.send(message);
+        } catch (e) {
+            console.warn("Jupyter Ascending: unable to report progress of a cell range", message, e);
+        }
+    }
+
+    function set_cell_outputs(data) {
+        // The kernel ran the cell itself (see headless.py), so just show what it got.
+        let cell = get_cell_from_notebook(data.cell_number);
+        if (cell.cell_type !== "code") {
+            return;
+        }
+
+        cell.clear_output();
+        for (const output of data.outputs) {
+            cell.output_area.append_output(output);
+        }
+        cell.set_input_prompt(data.execution_count);
+    }
+
     function op_code__delete_cells(data) {
         console.log("Deleting cell...", data);
 
@@ -98,6 +198,35 @@ define(["base/js/namespace"], function (Jupyter) {
         update_cell_contents(data);
     }
 
+    // How long the last patch took to apply, in milliseconds, sent back to the kernel with merge_complete.
+    let last_patch_ms = null;
+
+    function apply_patch(data) {
+        // The kernel already worked out the index of every operation,
+        // so they just need to be applied in order.
+        console.log("Applying patch with", data.operations.length, "operations");
+        const started = performance.now();
+
+        for (const operation of data.operations) {
+            switch (operation.command) {
+                case "op_code__delete_cells":
+                    op_code__delete_cells(operation);
+                    break;
+                case "op_code__insert_cell":
+                    op_code__insert_cell(operation);
+                    break;
+                case "op_code__replace_cell":
+                    op_code__replace_cell(operation);
+                    break;
+                default:
+                    console.log("Got an unexpected patch operation: ", operation);
+                    break;
+            }
+        }
+
+        last_patch_ms = performance.now() - started;
+    }
+
     // function focus_cell(data) {
     //   let cell = get_cell_from_notebook(data.cell_number);
 
@@ -114,7 +243,13 @@ define(["base/js/namespace"], function (Jupyter) {
         return cells_cloned;
     }
 
-    function get_status(comm_obj) {
+    function get_status(comm_obj, data) {
+        if (data.headless) {
+            // The kernel keeps the notebook and writes it to disk itself (see headless.py),
+            // so saving from here would overwrite what it wrote.
+            Jupyter.notebook.set_autosave_interval(0);
+        }
+
         comm_obj.send({
             command: "update_status",
             status: get_cells_without_outputs(),
@@ -122,11 +257,89 @@ define(["base/js/namespace"], function (Jupyter) {
     }
 
     function start_sync_notebook(comm_obj, msg) {
+        // The kernel holds on to the new cells, so we only need to send it ours.
+        const started = performance.now();
+        const javascript_cells = get_cells_without_outputs();
+
+        // Our clock isn't the kernel's, so we tell it how long things took for its trace, rather than when.
         comm_obj.send({
             command: "merge_notebooks",
-            javascript_cells: get_cells_without_outputs(),
-            new_notebook: msg.content.data.cells,
+            request_id: msg.content.data.request_id,
+            trace_id: msg.content.data.trace_id,
+            javascript_cells: javascript_cells,
+            collect_ms: performance.now() - started,
+        });
+    }
+
+    function attach_comm_handlers(comm) {
+        // Register handlers for later messages:
+        comm.on_msg(function (msg) {
+            if (IS_DEBUG) {
+                console.log("Processing a message");
+                console.log(msg);
+            }
+
+            const data = msg.content.data;
+            const command = data.command;
+
+            switch (command) {
+                case "start_sync_notebook":
+                    console.log("Starting Sync");
+                    return start_sync_notebook(comm, msg);
+                case "op_code__delete_cells":
+                    return op_code__delete_cells(data);
+                case "op_code__insert_cell":
+                    return op_code__insert_cell(data);
+                case "op_code__replace_cell":
+                    return op_code__replace_cell(data);
+                case "apply_patch":
+                    return apply_patch(data);
+                case "get_status":
+                    console.log("Sending get_status");
+                    return get_status(comm, data);
+                case "update":
+                    return update_cell_contents(data);
+                case "execute":
+                    return execute_cell_contents(data);
+                case "execute_all":
+                    return execute_all_cells();
+                case "execute_range":
+                    return execute_cell_range(comm, data);
+                case "set_outputs":
+                    return set_cell_outputs(data);
+                case "status":
+                    console.log("give em the status");
+                    return;
+                case "restart_kernel":
+                    Jupyter.notebook.kernel.restart();
+                    return;
+                case "finish_merge":
+                    comm.send({
+                        command: "merge_complete",
+                        request_id: data.request_id,
+                        trace_id: data.trace_id,
+                        apply_ms: last_patch_ms,
+                    });
+                    last_patch_ms = null;
+                    return;
+                default:
+                    console.log("Got an unexpected message: ", msg);
+                    return;
+            }
+        });
+
+        comm.on_close(function (msg) {
+            console.log("close", msg);
+        });
+    }
+
+    function open_comm() {
+        // We open the comm ourselves (instead of waiting for the kernel to do it), so that
+        // after a page reload the kernel knows to stop using the comm the old page had.
+        const comm = Jupyter.notebook.kernel.comm_manager.new_comm(TARGET_NAME, {
+            command: "frontend_attached",
         });
+        attach_comm_handlers(comm);
     }
 
     function create_and_register_comm() {
@@ -143,55 +356,13 @@ define(["base/js/namespace"], function (Jupyter) {
             // comm is the frontend comm instance
             // msg is the comm_open message, which can carry data
             function (comm, _msg) {
-                // Register handlers for later messages:
-                comm.on_msg(function (msg) {
-                    if (IS_DEBUG) {
-                        console.log("Processing a message");
-                        console.log(msg);
-                    }
-
-                    const data = msg.content.data;
-                    const command = data.command;
-
-                    switch (command) {
-                        case "start_sync_notebook":
-                            console.log("Starting Sync");
-                            return start_sync_notebook(comm, msg);
-                        case "op_code__delete_cells":
-                            return op_code__delete_cells(data);
-                        case "op_code__insert_cell":
-                            return op_code__insert_cell(data);
-                        case "op_code__replace_cell":
-                            return op_code__replace_cell(data);
-                        case "get_status":
-                            console.log("Sending get_status");
-                            return get_status(comm);
-                        case "update":
-                            return update_cell_contents(data);
-                        case "execute":
-                            return execute_cell_contents(data);
-                        case "execute_all":
-                            return execute_all_cells();
-                        case "status":
-                            console.log("give em the status");
-                            return;
-                        case "restart_kernel":
-                            Jupyter.notebook.kernel.restart();
-                            return;
-                        case "finish_merge":
-                            comm.send({command: 'merge_complete'});
-                            return;
-                        default:
-                            console.log("Got an unexpected message: ", msg);
-                            return;
-                    }
-                });
-
-                comm.on_close(function (msg) {
-                    console.log("close", msg);
-                });
+                attach_comm_handlers(comm);
             }
         );
+
+        if (is_synced_notebook()) {
+            open_comm();
+        }
     }
 
     // Export the required load_ipython_extension function
@@ -213,25 +384,30 @@ define(["base/js/namespace"], function (Jupyter) {
                     console.log("Opening... ", get_notebook_name());
                     console.log("Is synced: ", is_synced_notebook());
 
+                    function on_kernel_restarted() {
+                        console.log("Registering notebook after kernel restart...");
+                        Jupyter.notebook.kernel.execute("import jupyter_ascending.extension; jupyter_ascending.extension.set_everything_up()");
+                        if (is_synced_notebook()) {
+                            open_comm();
+                        }
+                    }
+
+                    // Only listen for restarts once the comm is set up, so that the kernel
+                    // becoming ready for the first time doesn't open a second comm.
                     console.log("Attemping create comm...");
                     if (Jupyter.notebook.kernel) {
                         create_and_register_comm();
+                        Jupyter.notebook.events.on("kernel_ready.Kernel", on_kernel_restarted);
                     } else {
                         Jupyter.notebook.events.one(
                             "kernel_ready.Kernel",
                             () => {
                                 console.log("We actually reloaded!");
                                 create_and_register_comm();
+                                Jupyter.notebook.events.on("kernel_ready.Kernel", on_kernel_restarted);
                             }
                         );
                     }
-                    Jupyter.notebook.events.on(
-                        "kernel_ready.Kernel",
-                        () => {
-                            console.log("Registering notebook after kernel restart...");
-                            Jupyter.notebook.kernel.execute("import jupyter_ascending.extension; jupyter_ascending.extension.set_everything_up()");
-                        }
-                    );
 
                     console.log("... success!");
 
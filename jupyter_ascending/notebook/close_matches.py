@@ -0,0 +1,106 @@
+"""Batched `difflib.get_close_matches(word, possibilities, n=1)` for many words against the same possibilities.
+
+`get_close_matches` counts the characters of every possibility again for each word, then computes
+`SequenceMatcher.ratio` for every possibility that passes its quick checks. Here each string's characters
+are counted once, and an upper bound on the ratio of every (word, possibility) pair is computed in one go
+(with NumPy if it's installed). Then only the possibilities whose bound could still beat the best ratio found
+so far get an exact ratio, which gives exactly what `get_close_matches` would have.
+"""
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Collection
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+#: Characters are counted in this many bins (by code point), so comparing counts is quick.
+CHARACTER_COUNT_BINS = 128
+
+#: Roughly how many numbers to hold in memory at once when computing bounds with NumPy.
+_MAX_CHUNK_SIZE = 4_000_000
+
+
+def character_counts(string: str) -> Tuple[int, ...]:
+    """How many characters of `string` fall in each bin. Never less than the true number of shared characters."""
+    counts = [0] * CHARACTER_COUNT_BINS
+    for character, count in Counter(string).items():
+        counts[ord(character) % CHARACTER_COUNT_BINS] += count
+
+    return tuple(counts)
+
+
+def _ratio_bound(common: int, total: int) -> float:
+    # Same as `SequenceMatcher.quick_ratio`, but from binned counts, so never smaller than it.
+    return 2.0 * common / total if total else 1.0
+
+
+class CloseMatcher:
+    def __init__(self, words: Sequence[str], possibilities: Sequence[str], cutoff: float = 0.6):
+        self.words = words
+        self.possibilities = possibilities
+        self.cutoff = cutoff
+
+        self._bounds = self._ratio_bounds()
+
+    def _ratio_bounds(self) -> List[List[float]]:
+        """_ratio_bounds()[i][j] is at least the ratio between words[i] and possibilities[j]."""
+        if not self.words or not self.possibilities:
+            return [[] for _ in self.words]
+
+        word_counts = [character_counts(x) for x in self.words]
+        possibility_counts = [character_counts(x) for x in self.possibilities]
+
+        if np is None:
+            return [
+                [
+                    _ratio_bound(sum(map(min, counts, other_counts)), len(word) + len(possibility))
+                    for possibility, other_counts in zip(self.possibilities, possibility_counts)
+                ]
+                for word, counts in zip(self.words, word_counts)
+            ]
+
+        words = np.array(word_counts, dtype=np.int32)
+        possibilities = np.array(possibility_counts, dtype=np.int32)
+        totals = np.add.outer(
+            np.array([len(x) for x in self.words], dtype=np.float64),
+            np.array([len(x) for x in self.possibilities], dtype=np.float64),
+        )
+
+        common = np.empty(totals.shape, dtype=np.float64)
+        chunk_size = max(1, _MAX_CHUNK_SIZE // (len(self.possibilities) * CHARACTER_COUNT_BINS))
+        for start in range(0, len(self.words), chunk_size):
+            chunk = words[start : start + chunk_size]
+            common[start : start + chunk_size] = np.minimum(chunk[:, None, :], possibilities[None, :, :]).sum(axis=2)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bounds = np.where(totals > 0, 2.0 * common / totals, 1.0)
+
+        return bounds.tolist()
+
+    def closest(self, word_index: int, remaining: Collection[int]) -> Optional[str]:
+        """`get_close_matches(words[word_index], [possibilities[x] for x in remaining], n=1)`, or None if empty."""
+        bounds = self._bounds[word_index]
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(self.words[word_index])
+
+        best: Optional[Tuple[float, str]] = None
+        for bound, possibility_index in sorted(((bounds[x], x) for x in remaining), reverse=True):
+            if bound < self.cutoff or (best is not None and bound < best[0]):
+                break
+
+            possibility = self.possibilities[possibility_index]
+            matcher.set_seq1(possibility)
+            ratio = matcher.ratio()
+
+            # Like get_close_matches, ties go to the larger string.
+            if ratio >= self.cutoff and (best is None or (ratio, possibility) > best):
+                best = (ratio, possibility)
+
+        return None if best is None else best[1]
@@ -0,0 +1,244 @@
+"""Diffing sequences of cells, for notebooks too big for `difflib.SequenceMatcher`.
+
+Notebooks of up to `SEQUENCE_MATCHER_MAX_CELLS` cells are still diffed with `SequenceMatcher`, which is just as fast
+there. Past that, its diff would take long enough to matter, and this one is used instead:
+
+Each cell's contents is interned to an int first, so the diff only ever compares ints.
+Then, like `git diff --patience`:
+
+1. Matching cells at the start and the end are matched right away.
+2. Cells that appear exactly once on each side are used as anchors: the longest run of them that is in the
+    same order on both sides is matched, and the gaps between them are diffed the same way.
+3. Gaps with no unique cells left are diffed with Myers' algorithm.
+
+If that takes longer than the time budget (e.g. a huge gap full of repeated cells), whatever gaps are left
+are treated as replaced. That is always a correct diff, just not the smallest one.
+
+The result has the same format as `SequenceMatcher.get_opcodes`. It's the same diff for a single insert, delete,
+replace or move, but with several edits it can match different cells, which can change which cells keep their
+outputs after a sync. That's why smaller notebooks, which is most of them, stay with `SequenceMatcher`.
+"""
+import bisect
+import time
+from collections import Counter
+from difflib import SequenceMatcher
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import Sequence
+from typing import Tuple
+
+#: (tag, current_start, current_final, updated_start, updated_final), as in `SequenceMatcher.get_opcodes`.
+OpCode = Tuple[str, int, int, int, int]
+
+#: (current_start, updated_start, size)
+_Block = Tuple[int, int, int]
+
+#: Seconds to spend before giving up on finding the smallest diff.
+DEFAULT_TIME_BUDGET = 0.5
+
+#: Notebooks with up to this many cells (on both sides) are diffed with `SequenceMatcher`, exactly like before.
+#:   It takes under 10ms at this size (see `benchmarks/bench_diff.py`).
+SEQUENCE_MATCHER_MAX_CELLS = 2000
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+def _intern(current: Sequence[Hashable], updated: Sequence[Hashable]) -> Tuple[List[int], List[int]]:
+    ids: Dict[Hashable, int] = {}
+
+    return [ids.setdefault(x, len(ids)) for x in current], [ids.setdefault(x, len(ids)) for x in updated]
+
+
+def _unique_anchors(a: List[int], b: List[int], alo: int, ahi: int, blo: int, bhi: int) -> List[Tuple[int, int]]:
+    """The longest list of (i, j) where a[i] == b[j] is unique in both ranges and i and j both increase."""
+    a_counts = Counter(a[alo:ahi])
+    b_counts = Counter(b[blo:bhi])
+
+    b_index = {b[j]: j for j in range(blo, bhi) if b_counts[b[j]] == 1}
+    candidates = [(i, b_index[a[i]]) for i in range(alo, ahi) if a_counts[a[i]] == 1 and a[i] in b_index]
+
+    if not candidates:
+        return []
+
+    # Longest increasing subsequence of the j's (patience sorting). It's built from the end, so that when there
+    #   are several that are just as long, we prefer matching earlier cells like SequenceMatcher does.
+    tails: List[int] = []
+    tail_indices: List[int] = []
+    next_in_chain = [-1] * len(candidates)
+    for candidate_index in range(len(candidates) - 1, -1, -1):
+        j = -candidates[candidate_index][1]
+        pile = bisect.bisect_left(tails, j)
+        if pile > 0:
+            next_in_chain[candidate_index] = tail_indices[pile - 1]
+
+        if pile == len(tails):
+            tails.append(j)
+            tail_indices.append(candidate_index)
+        else:
+            tails[pile] = j
+            tail_indices[pile] = candidate_index
+
+    anchors = []
+    candidate_index = tail_indices[-1]
+    while candidate_index != -1:
+        anchors.append(candidates[candidate_index])
+        candidate_index = next_in_chain[candidate_index]
+
+    return anchors
+
+
+def _myers(a: List[int], b: List[int], alo: int, ahi: int, blo: int, bhi: int, deadline: float) -> List[_Block]:
+    """Matching blocks of the smallest diff between the two ranges."""
+    n = ahi - alo
+    m = bhi - blo
+
+    # v[k] is the furthest x reached on diagonal k = x - y. Keep each round's v for the traceback.
+    v = {1: 0}
+    trace = []
+    for d in range(n + m + 1):
+        if time.monotonic() > deadline:
+            raise _OutOfTime()
+
+        trace.append(dict(v))
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[k - 1] < v[k + 1]):
+                x = v[k + 1]
+            else:
+                x = v[k - 1] + 1
+
+            y = x - k
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+
+            v[k] = x
+            if x >= n and y >= m:
+                break
+        else:
+            continue
+
+        break
+
+    blocks = []
+    x, y = n, m
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1] < v[k + 1]):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+
+        previous_x = v[previous_k]
+        previous_y = previous_x - previous_k
+
+        size = min(x - previous_x, y - previous_y) if d > 0 else x
+        if size > 0:
+            blocks.append((alo + x - size, blo + y - size, size))
+
+        x, y = previous_x, previous_y
+
+    return blocks[::-1]
+
+
+def _matching_blocks(a: List[int], b: List[int], deadline: float) -> List[_Block]:
+    blocks: List[_Block] = []
+
+    # Ranges still to diff. Blocks are sorted at the end, so the order we handle them in doesn't matter.
+    pending = [(0, len(a), 0, len(b))]
+    out_of_time = False
+    while pending:
+        alo, ahi, blo, bhi = pending.pop()
+
+        start = 0
+        while alo + start < ahi and blo + start < bhi and a[alo + start] == b[blo + start]:
+            start += 1
+
+        if start:
+            blocks.append((alo, blo, start))
+            alo += start
+            blo += start
+
+        end = 0
+        while alo < ahi - end and blo < bhi - end and a[ahi - end - 1] == b[bhi - end - 1]:
+            end += 1
+
+        if end:
+            blocks.append((ahi - end, bhi - end, end))
+            ahi -= end
+            bhi -= end
+
+        if alo == ahi or blo == bhi:
+            continue
+
+        if out_of_time or time.monotonic() > deadline:
+            out_of_time = True
+            continue
+
+        anchors = _unique_anchors(a, b, alo, ahi, blo, bhi)
+        if anchors:
+            for i, j in anchors:
+                previous_i, previous_j, previous_size = blocks[-1] if blocks else (-1, -1, 0)
+                if i == alo == previous_i + previous_size and j == blo == previous_j + previous_size:
+                    # Straight after the previous match, so just make that one longer.
+                    blocks[-1] = (previous_i, previous_j, previous_size + 1)
+                else:
+                    if i > alo or j > blo:
+                        pending.append((alo, i, blo, j))
+                    blocks.append((i, j, 1))
+
+                alo, blo = i + 1, j + 1
+
+            pending.append((alo, ahi, blo, bhi))
+            continue
+
+        try:
+            blocks.extend(_myers(a, b, alo, ahi, blo, bhi, deadline))
+        except _OutOfTime:
+            out_of_time = True
+
+    blocks.sort()
+
+    # Merge adjacent blocks, so equal runs come out as one opcode like they do from SequenceMatcher.
+    merged: List[_Block] = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        else:
+            merged.append((i, j, size))
+
+    merged.append((len(a), len(b), 0))
+    return merged
+
+
+def diff_opcodes(
+    current: Sequence[Hashable],
+    updated: Sequence[Hashable],
+    time_budget: float = DEFAULT_TIME_BUDGET,
+    sequence_matcher_max_cells: int = SEQUENCE_MATCHER_MAX_CELLS,
+) -> List[OpCode]:
+    """How to turn `current` into `updated`, in the format of `SequenceMatcher.get_opcodes`."""
+    if max(len(current), len(updated)) <= sequence_matcher_max_cells:
+        return SequenceMatcher(None, current, updated).get_opcodes()
+
+    a, b = _intern(current, updated)
+    deadline = time.monotonic() + time_budget
+
+    opcodes: List[OpCode] = []
+    i = j = 0
+    for ai, bj, size in _matching_blocks(a, b, deadline):
+        if i < ai and j < bj:
+            opcodes.append(("replace", i, ai, j, bj))
+        elif i < ai:
+            opcodes.append(("delete", i, ai, j, bj))
+        elif j < bj:
+            opcodes.append(("insert", i, ai, j, bj))
+
+        i, j = ai + size, bj + size
+        if size:
+            opcodes.append(("equal", ai, i, bj, j))
+
+    return opcodes
@@ -0,0 +1,240 @@
+"""Which cell each line of a .sync.py file is in, so the cell under the cursor can be found quickly.
+
+Parsing a file with jupytext takes a while for big files, so the cell boundaries are kept in a `LineIndex`. When the
+file changed, the cells whose lines are unchanged at the start and end of the file are kept, and only the ones in
+between are parsed again. Finding the cell for a line is then a binary search.
+
+Used by both the client (see `requests/line_index.py`, which caches indexes between calls) and the kernel (for
+sync-and-execute requests).
+"""
+import bisect
+import copy
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import attr
+from loguru import logger
+
+from jupyter_ascending.delta_sync import hash_text
+
+# How many lines to give the jupytext reader to start with when reading a cell. See `_CellReader.read_cell`.
+_INITIAL_WINDOW = 64
+
+
+@attr.dataclass
+class LineIndex:
+    #: The format jupytext guessed for the file, e.g. "py:percent".
+    text_format: str
+
+    #: Number of lines in the jupytext header, before the first cell.
+    header_end: int
+
+    #: Hash of the header lines.
+    header_hash: str
+
+    #: For each cell, the number of the line after its last one.
+    ends: List[int]
+
+    #: For each cell, the hash of its lines.
+    cell_hashes: List[str]
+
+    #: Whether the file's cells can be parsed again starting from any cell (see `_CellReader.resumable`).
+    resumable: bool
+
+    mtime_ns: int = 0
+    size: int = -1
+
+    def cell_for_line(self, line_number: int) -> int:
+        """The index of the cell that `line_number` is in, the same as `execute._find_cell_number` used to give."""
+        if not self.ends or self.header_end >= line_number:
+            return 0
+
+        return min(bisect.bisect_left(self.ends, line_number), len(self.ends) - 1)
+
+    def starts(self) -> List[int]:
+        return [self.header_end] + self.ends[:-1]
+
+
+def _has_fence(lines: Sequence[str]) -> bool:
+    return any("```" in x or "~~~" in x for x in lines)
+
+
+def _hash_lines(lines: Sequence[str]) -> str:
+    return hash_text("\n".join(lines))
+
+
+class _CellReader:
+    """Reads the cells of a file the way jupytext does."""
+
+    def __init__(self, lines: Sequence[str]):
+        # jupytext is slow to import, so only pay for it when we actually need to parse a file.
+        import jupytext
+
+        # Implementation closely copied from jupytext.
+        #   See https://github.com/mwouts/jupytext/blob/main/jupytext/jupytext.py#L138
+        text = "\n".join(lines)
+        self.text_format = jupytext.formats.divine_format(text)
+        conv = jupytext.jupytext.TextNotebookConverter(self.text_format, None)
+        (metadata, _, _, pos) = jupytext.header.header_to_metadata_and_cell(
+            lines,
+            conv.implementation.header_prefix,
+            conv.implementation.extension,
+            conv.fmt.get(
+                "root_level_metadata_as_raw_cell",
+                conv.config.root_level_metadata_as_raw_cell if conv.config is not None else True,
+            ),
+        )
+        conv.update_fmt_with_notebook_options(metadata, read=True)
+        default_language = jupytext.languages.default_language_from_metadata_and_ext(
+            metadata, conv.implementation.extension
+        )
+
+        self.header_end = pos
+        self.format_name = conv.fmt.get("format_name")
+        self.reader = conv.implementation.cell_reader_class(conv.fmt, default_language)
+
+        self._initial_state = self._reader_state()
+        self._state_changed = False
+
+    def _reader_state(self) -> Tuple[Any, Any]:
+        return getattr(self.reader, "comment", None), getattr(self.reader, "language", None)
+
+    @property
+    def resumable(self) -> bool:
+        # Readers keep a little state from one cell to the next: for percent scripts, the comment string and
+        #   language, which only unusual cells change. As long as they haven't, reading from any cell's start
+        #   with a new reader reads the same way.
+        return self.format_name == "percent" and not self._state_changed
+
+    def read_cell(self, lines: Sequence[str], start: int) -> int:
+        """Read the cell starting at line `start`, and return the line after it."""
+        end = self._read_cell(lines, start)
+        self._state_changed = self._state_changed or self._reader_state() != self._initial_state
+
+        return end
+
+    def _read_cell(self, lines: Sequence[str], start: int) -> int:
+        # Giving the reader all the remaining lines for every cell is quadratic, so give it a window and make it
+        #   bigger if the cell might continue past it. Markdown and raw cells with a fenced block in them look
+        #   ahead for the end of the fence, so those are read again with everything.
+        #   Reading changes the reader a little, so each attempt uses a copy.
+        window = _INITIAL_WINDOW
+        while True:
+            end = min(start + window, len(lines))
+            reader = copy.copy(self.reader)
+            _, length = reader.read(lines[start:end])
+
+            if end == len(lines) or (
+                length < end - start and (reader.cell_type == "code" or not _has_fence(lines[start : start + length]))
+            ):
+                self.reader = reader
+                return start + length
+
+            if length < end - start:
+                _, length = self.reader.read(lines[start:])
+                return start + length
+
+            window *= 2
+
+
+def _read_cells(
+    reader: _CellReader, lines: Sequence[str], start: int, stop_at: Dict[int, int]
+) -> Tuple[List[int], int]:
+    """Read cells from line `start`, until the end of the file or a cell that ends up starting at a key of `stop_at`.
+
+    Returns the ends of the cells read, and the value of `stop_at` we stopped at (or -1)."""
+    ends = []
+    while start < len(lines):
+        if start in stop_at:
+            return ends, stop_at[start]
+
+        start = reader.read_cell(lines, start)
+        ends.append(start)
+
+    return ends, -1
+
+
+def build_line_index(lines: Sequence[str], previous: Optional[LineIndex] = None) -> LineIndex:
+    """Index the cells of `lines`, reusing the cells of `previous` that didn't change if it's given."""
+    reader = _CellReader(lines)
+    header_hash = _hash_lines(lines[: reader.header_end])
+
+    if (
+        previous is not None
+        and previous.resumable
+        and reader.resumable
+        and (previous.text_format, previous.header_end, previous.header_hash)
+        == (reader.text_format, reader.header_end, header_hash)
+    ):
+        index = _update_line_index(reader, lines, previous)
+        if index is not None:
+            return index
+
+        # The reader may have read something that changed it, so start over with a new one.
+        reader = _CellReader(lines)
+
+    ends, _ = _read_cells(reader, lines, reader.header_end, {})
+
+    return LineIndex(
+        text_format=reader.text_format,
+        header_end=reader.header_end,
+        header_hash=header_hash,
+        ends=ends,
+        cell_hashes=[_hash_lines(lines[x:y]) for x, y in zip([reader.header_end] + ends, ends)],
+        resumable=reader.resumable,
+    )
+
+
+def _update_line_index(reader: _CellReader, lines: Sequence[str], previous: LineIndex) -> Optional[LineIndex]:
+    """Read only the cells that changed since `previous`. None if that didn't work out."""
+    starts = previous.starts()
+    cell_count = len(previous.ends)
+
+    def unchanged(cell: int, shift: int) -> bool:
+        start = starts[cell] + shift
+        return start >= 0 and _hash_lines(lines[start : previous.ends[cell] + shift]) == previous.cell_hashes[cell]
+
+    # Cells at the start that didn't change.
+    prefix = 0
+    while prefix < cell_count and unchanged(prefix, 0):
+        prefix += 1
+
+    # Cells at the end that didn't change, shifted by the number of lines added or removed.
+    shift = len(lines) - (previous.ends[-1] if previous.ends else previous.header_end)
+    suffix = 0
+    while suffix < cell_count - prefix and unchanged(cell_count - suffix - 1, shift):
+        suffix += 1
+
+    if prefix == cell_count and shift == 0:
+        return attr.evolve(previous)
+
+    # A cell's end can depend on the lines after it, so the last unchanged cell at the start is read again.
+    prefix = max(prefix - 1, 0)
+    start = starts[prefix] if cell_count else previous.header_end
+
+    stop_at = {starts[i] + shift: i for i in range(cell_count - suffix, cell_count)}
+    middle_ends, stopped_at = _read_cells(reader, lines, start, stop_at)
+    if not reader.resumable:
+        return None
+
+    ends = previous.ends[:prefix] + middle_ends
+    cell_hashes = previous.cell_hashes[:prefix] + [
+        _hash_lines(lines[x:y]) for x, y in zip([start] + middle_ends, middle_ends)
+    ]
+    if stopped_at >= 0:
+        ends += [x + shift for x in previous.ends[stopped_at:]]
+        cell_hashes += previous.cell_hashes[stopped_at:]
+
+    logger.debug("Reused {} of {} cells in line index", len(ends) - len(middle_ends), len(ends))
+    return LineIndex(
+        text_format=previous.text_format,
+        header_end=previous.header_end,
+        header_hash=previous.header_hash,
+        ends=ends,
+        cell_hashes=cell_hashes,
+        resumable=True,
+    )
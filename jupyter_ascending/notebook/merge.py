@@ -1,21 +1,30 @@
 import abc
+import bisect
+import math
+import operator
+import re
 from collections import defaultdict
-from difflib import SequenceMatcher
-from difflib import get_close_matches
 from enum import Enum
+from typing import Any
 from typing import Dict
+from typing import FrozenSet
 from typing import List
+from typing import Optional
 from typing import Set
 from typing import Tuple
+from typing import Type
 from typing import Union
 
 import attr
 import editdistance
 
+from jupyter_ascending.notebook.close_matches import CloseMatcher
+from jupyter_ascending.notebook.close_matches import character_counts
 from jupyter_ascending.notebook.data_types import CellMovements
 from jupyter_ascending.notebook.data_types import JupyterCell
 from jupyter_ascending.notebook.data_types import Movement
 from jupyter_ascending.notebook.data_types import NotebookContents
+from jupyter_ascending.notebook.diff import diff_opcodes
 from jupyter_ascending.notebook.evolve import evolve_notebook_cells
 
 Number = Union[int, float]
@@ -58,8 +67,6 @@ def opcode_merge_cell_contents(
     raw_current_contents = _get_raw_contents(current_notebook)
     raw_updated_contents = _get_raw_contents(updated_notebook)
 
-    sequence_matcher = SequenceMatcher(None, raw_current_contents, raw_updated_contents)
-
     current_cells_consumed: Set[int] = set()
     cells_to_update_text: List[int] = []
 
@@ -70,7 +77,7 @@ def opcode_merge_cell_contents(
         current_final_idx,
         updated_start_idx,
         updated_final_idx,
-    ) in sequence_matcher.get_opcodes():
+    ) in diff_opcodes(raw_current_contents, raw_updated_contents):
 
         if opcode in {"replace", "insert"}:
             cells_to_update_text.extend(range(updated_start_idx, updated_final_idx))
@@ -84,13 +91,18 @@ def opcode_merge_cell_contents(
 
     current_cells_remaining = set(range(len(raw_current_contents))) - current_cells_consumed
 
-    for updated_cell_index in cells_to_update_text:
-        closest_match = get_close_matches(
-            raw_updated_contents[updated_cell_index], [raw_current_contents[x] for x in current_cells_remaining], n=1
-        )
+    # Cells that changed might just have moved, so find where they came from to keep their output.
+    unmatched_current_cells = sorted(current_cells_remaining)
+    close_matcher = CloseMatcher(
+        [raw_updated_contents[x] for x in cells_to_update_text],
+        [raw_current_contents[x] for x in unmatched_current_cells],
+    )
+    possibility_index = {x: i for i, x in enumerate(unmatched_current_cells)}
 
-        if closest_match:
-            match = closest_match[0]
+    for word_index, updated_cell_index in enumerate(cells_to_update_text):
+        match = close_matcher.closest(word_index, [possibility_index[x] for x in current_cells_remaining])
+
+        if match is not None:
 
             for current_cell_idx in current_cells_remaining:
                 if raw_current_contents[current_cell_idx] == match:
@@ -111,51 +123,86 @@ def opcode_merge_cell_contents(
 
 
 def merge_cell_contents(
-    current_notebook: NotebookContents, updated_notebook: NotebookContents
+    current_notebook: NotebookContents,
+    updated_notebook: NotebookContents,
+    distancer: Optional[Type["BaseStringDistancer"]] = None,
+    prune: bool = True,
 ) -> Tuple[NotebookContents, CellMovements]:
+    """Match up the cells of both notebooks, keeping each current cell's output where we can.
+
+    Cells with the same source are matched first. Then, starting with the current cell that has the closest
+    updated cell, each current cell takes the closest updated cell that is still free.
+
+    With `prune`, distances are only computed for cells that could possibly be the closest one (see
+    `BaseStringDistancer`), which gives the same matches as computing all of them.
+    """
     # TODO: change name of current_notebook to be remote notebook? some other name that makes it obvious
     if current_notebook.content_equals(updated_notebook):
         return current_notebook, CellMovements(movements=[])
 
-    current_cell_stack = [x for x in current_notebook.cells]
-    updated_cell_stack = [x for x in updated_notebook.cells]
+    distancer = distancer or LevenshteinDistance
 
     movements = []
     final_cells = []
 
     # 1. Check if we have cells that are exactly the same source
     #   We just update to the new index
-    current_cells_to_remove = []
-    for current_cell in current_cell_stack:
-        for updated_cell in updated_cell_stack:
-            if current_cell.source == updated_cell.source:
+    updated_cells_by_source: Dict[Tuple[str, ...], List[JupyterCell]] = defaultdict(list)
+    for updated_cell in updated_notebook.cells:
+        updated_cells_by_source[updated_cell.source].append(updated_cell)
 
-                # Create movements
-                if current_cell.index != updated_cell.index:
-                    movements.append(Movement(previous=current_cell.index, current=updated_cell.index))
+    current_cell_stack = []
+    matched_updated_cells = set()
+    for current_cell in current_notebook.cells:
+        same_source_cells = updated_cells_by_source.get(current_cell.source)
+        if not same_source_cells:
+            current_cell_stack.append(current_cell)
+            continue
 
-                final_cells.append(attr.evolve(current_cell, index=updated_cell.index))
+        updated_cell = same_source_cells.pop(0)
+        matched_updated_cells.add(id(updated_cell))
 
-                # Remove at the end, since it's not good to modify iterators while iterating
-                current_cells_to_remove.append(current_cell)
+        # Create movements
+        if current_cell.index != updated_cell.index:
+            movements.append(Movement(previous=current_cell.index, current=updated_cell.index))
 
-                updated_cell_stack.remove(updated_cell)
-                break
+        final_cells.append(attr.evolve(current_cell, index=updated_cell.index))
 
-    for cell in current_cells_to_remove:
-        current_cell_stack.remove(cell)
+    updated_cell_stack = [x for x in updated_notebook.cells if id(x) not in matched_updated_cells]
 
-    # 2. gather up all the differences between the remaining cells
-    distancer = LevenshteinDistance
+    # 2. Find most closely related cells (so, small distance)
+    #       If I run out of updated_cell_stack, then we're done. No more cells to give
+    #       If I run out of current_cell_stack, then we need to delete those (however that looks).
+    if prune:
+        matches = _match_closest_cells_pruned(current_cell_stack, updated_cell_stack, distancer)
+    else:
+        matches = _match_closest_cells(current_cell_stack, updated_cell_stack, distancer)
+
+    for current_cell, best_updated_cell in matches:
+        evolved_cell = attr.evolve(current_cell, index=best_updated_cell.index, source=best_updated_cell.source)
+        final_cells.append(evolved_cell)
+
+    # Any other updated cells we have must have been inserted.
+    #   We can simply insert them into the final cells
+    #   (Unless there is something I missed here...)
+    matched_updated_cells = {id(x) for _, x in matches}
+    final_cells.extend(x for x in updated_cell_stack if id(x) not in matched_updated_cells)
+
+    return evolve_notebook_cells(current_notebook, final_cells), CellMovements(movements=movements)
+
+
+def _match_closest_cells(
+    current_cell_stack: List[JupyterCell], updated_cell_stack: List[JupyterCell], distancer: Type["BaseStringDistancer"]
+) -> List[Tuple[JupyterCell, JupyterCell]]:
+    """Computes the distance between every pair of cells."""
+    current_cell_stack = list(current_cell_stack)
+    updated_cell_stack = list(updated_cell_stack)
 
     distance_between_cells: Dict[JupyterCell, List[CellDistance]] = defaultdict(list)
     for current_cell in current_cell_stack:
         # TODO: What if all the distances are bad?
         # TODO: maybe use a different measure? like some confidence that they're the same
         for updated_cell in updated_cell_stack:
-            if current_cell.source == updated_cell.source:
-                assert False, f"{current_cell} / {updated_cell}::\n{final_cells}"
-
             distance = distancer.find_distance(current_cell.joined_source, updated_cell.joined_source)
             distance_between_cells[current_cell].append(CellDistance(distance, updated_cell))
 
@@ -163,15 +210,13 @@ def merge_cell_contents(
             sorted(distance_between_cells[current_cell], key=distancer.sort_function)
         )
 
-    # 3. Find most closely related cells (so, small distance)
-    #       If I run out of updated_cell_stack, then we're done. No more cells to give
-    #       If I run out of current_cell_stack, then we need to delete those (however that looks).
-
     def find_most_likely_cell(x):
         distance = distance_between_cells[x]
 
         return distancer.sort_function(distance[0])
 
+    matches = []
+
     # TODO: This might be way too many loops?
     while current_cell_stack and distance_between_cells and updated_cell_stack:
         sorted_cell_list = sorted(current_cell_stack, key=find_most_likely_cell)
@@ -186,19 +231,80 @@ def merge_cell_contents(
         assert best_updated_cell in updated_cell_stack
         updated_cell_stack.remove(best_updated_cell)
 
-        evolved_cell = attr.evolve(current_cell, index=best_updated_cell.index, source=best_updated_cell.source)
-        final_cells.append(evolved_cell)
+        matches.append((current_cell, best_updated_cell))
 
-    # Any other updated cells we have must have been inserted.
-    #   We can simply insert them into the final cells
-    #   (Unless there is something I missed here...)
-    while updated_cell_stack:
-        final_cells.append(updated_cell_stack.pop())
+    return matches
 
-    # Should have no more updated cells to input
-    assert not updated_cell_stack
 
-    return evolve_notebook_cells(current_notebook, final_cells), CellMovements(movements=movements)
+def _match_closest_cells_pruned(
+    current_cell_stack: List[JupyterCell], updated_cell_stack: List[JupyterCell], distancer: Type["BaseStringDistancer"]
+) -> List[Tuple[JupyterCell, JupyterCell]]:
+    """Same matches as `_match_closest_cells`, but skips the pairs that can't be the closest.
+
+    Updated cells are sorted by `distancer.bucket_key`, and each search walks outward from the current cell's key,
+    stopping once the key gap alone means every cell left is further away than the best one found.
+    """
+    if not current_cell_stack or not updated_cell_stack:
+        return []
+
+    updated_sources = [x.joined_source for x in updated_cell_stack]
+    updated_signatures = [distancer.signature(x) for x in updated_sources]
+    updated_keys = [distancer.bucket_key(x) for x in updated_signatures]
+
+    by_key = sorted(range(len(updated_cell_stack)), key=updated_keys.__getitem__)
+    sorted_keys = [updated_keys[x] for x in by_key]
+
+    def find_closest(source: str, available: Optional[Set[int]]) -> Tuple[Number, int]:
+        """(distance, position) of the closest updated cell, preferring earlier cells when tied."""
+        signature = distancer.signature(source)
+        key = distancer.bucket_key(signature)
+
+        best: Optional[Tuple[Number, int]] = None
+        below = bisect.bisect_left(sorted_keys, key) - 1
+        above = below + 1
+        while below >= 0 or above < len(by_key):
+            if above >= len(by_key) or (below >= 0 and key - sorted_keys[below] <= sorted_keys[above] - key):
+                position, gap = by_key[below], key - sorted_keys[below]
+                below -= 1
+            else:
+                position, gap = by_key[above], sorted_keys[above] - key
+                above += 1
+
+            if best is not None and distancer.key_gap_bound(gap) > best[0]:
+                break
+
+            if available is not None and position not in available:
+                continue
+
+            if best is not None and distancer.lower_bound(signature, updated_signatures[position]) > best[0]:
+                continue
+
+            max_distance = math.inf if best is None else best[0]
+            distance = distancer.find_bounded_distance(source, updated_sources[position], max_distance)
+            if best is None or (distance, position) < best:
+                best = (distance, position)
+
+        assert best is not None
+        return best
+
+    # Which cell is closest never changes, so neither does the order we go through the current cells in.
+    closest = [find_closest(x.joined_source, None) for x in current_cell_stack]
+    order = sorted(range(len(current_cell_stack)), key=lambda x: closest[x][0])
+
+    available = set(range(len(updated_cell_stack)))
+    matches = []
+    for current_position in order:
+        if not available:
+            break
+
+        _, updated_position = closest[current_position]
+        if updated_position not in available:
+            _, updated_position = find_closest(current_cell_stack[current_position].joined_source, available)
+
+        available.remove(updated_position)
+        matches.append((current_cell_stack[current_position], updated_cell_stack[updated_position]))
+
+    return matches
 
 
 @attr.dataclass
@@ -208,21 +314,196 @@ class CellDistance:
 
 
 class BaseStringDistancer(abc.ABC):
+    """
+    A distance between cell sources. Smaller is closer.
+
+    Pruning (see `merge_cell_contents`) relies on two cheap lower bounds on the distance, so a distancer
+    only needs to compute `find_distance` for pairs of cells that could turn out to be the closest:
+
+    - `key_gap_bound`: a bound from how far apart two strings' `bucket_key`s are. It must not decrease as the gap grows.
+    - `lower_bound`: a bound from the `signature`s of the two strings, which are only computed once per cell.
+
+    The defaults never prune anything.
+    """
+
     @staticmethod
     def find_distance(string_1: str, string_2: str) -> Number:
         raise NotImplementedError
 
+    @classmethod
+    def find_bounded_distance(cls, string_1: str, string_2: str, max_distance: Number) -> Number:
+        """The distance, if it is at most `max_distance`. Otherwise anything bigger than `max_distance`."""
+        return cls.find_distance(string_1, string_2)
+
+    @staticmethod
+    def signature(string: str) -> Any:
+        return string
+
+    @staticmethod
+    def bucket_key(signature: Any) -> float:
+        return 0.0
+
+    @staticmethod
+    def key_gap_bound(gap: float) -> Number:
+        return 0
+
+    @staticmethod
+    def lower_bound(signature_1: Any, signature_2: Any) -> Number:
+        return 0
+
     @staticmethod
     def sort_function(distance: CellDistance) -> Number:
         raise NotImplementedError
 
 
 class LevenshteinDistance(BaseStringDistancer):
+    # NOTE: There's no `find_bounded_distance`: editdistance's threshold check is slower than its full `eval`.
+
     @staticmethod
     def find_distance(string_1: str, string_2: str) -> int:
-        # TODO: Maybe use jaro winkler instead
         return editdistance.eval(string_1, string_2)
 
+    @staticmethod
+    def signature(string: str) -> Tuple[int, Tuple[int, ...]]:
+        return len(string), character_counts(string)
+
+    @staticmethod
+    def bucket_key(signature: Tuple[int, Tuple[int, ...]]) -> float:
+        return signature[0]
+
+    @staticmethod
+    def key_gap_bound(gap: float) -> Number:
+        # Every insert or delete changes the length by one.
+        return gap
+
+    @staticmethod
+    def lower_bound(signature_1: Tuple[int, Tuple[int, ...]], signature_2: Tuple[int, Tuple[int, ...]]) -> Number:
+        # Every edit changes at most two character counts by one.
+        counts_difference = sum(map(abs, map(operator.sub, signature_1[1], signature_2[1])))
+        return max(abs(signature_1[0] - signature_2[0]), (counts_difference + 1) // 2)
+
+    @staticmethod
+    def sort_function(distance: CellDistance) -> Number:
+        return distance.distance
+
+
+class JaroWinklerDistance(BaseStringDistancer):
+    """1 - Jaro-Winkler similarity, so 0 for equal strings and 1 for strings with nothing in common."""
+
+    PREFIX_SCALE = 0.1
+    MAX_PREFIX = 4
+
+    @classmethod
+    def find_distance(cls, string_1: str, string_2: str) -> float:
+        return 1 - cls._similarity(string_1, string_2)
+
+    @classmethod
+    def _similarity(cls, string_1: str, string_2: str) -> float:
+        if not string_1 and not string_2:
+            return 1.0
+
+        if not string_1 or not string_2:
+            return 0.0
+
+        window = max(max(len(string_1), len(string_2)) // 2 - 1, 0)
+
+        matched_2 = [False] * len(string_2)
+        matches_1 = []
+        for i, character in enumerate(string_1):
+            for j in range(max(0, i - window), min(len(string_2), i + window + 1)):
+                if not matched_2[j] and string_2[j] == character:
+                    matched_2[j] = True
+                    matches_1.append(character)
+                    break
+
+        matches = len(matches_1)
+        if matches == 0:
+            return 0.0
+
+        matches_2 = [x for x, matched in zip(string_2, matched_2) if matched]
+        transpositions = sum(x != y for x, y in zip(matches_1, matches_2)) / 2
+
+        jaro = (matches / len(string_1) + matches / len(string_2) + (matches - transpositions) / matches) / 3
+
+        prefix = 0
+        for x, y in zip(string_1[: cls.MAX_PREFIX], string_2[: cls.MAX_PREFIX]):
+            if x != y:
+                break
+
+            prefix += 1
+
+        return jaro + prefix * cls.PREFIX_SCALE * (1 - jaro)
+
+    @staticmethod
+    def signature(string: str) -> Tuple[int, Tuple[int, ...]]:
+        return len(string), character_counts(string)
+
+    @staticmethod
+    def bucket_key(signature: Tuple[int, Tuple[int, ...]]) -> float:
+        return math.log(signature[0] + 1)
+
+    @classmethod
+    def _distance_bound(cls, length_1: int, length_2: float, max_matches: float) -> float:
+        # The best similarity with at most `max_matches` matching characters and no transpositions.
+        if length_1 == 0 and length_2 == 0:
+            return 0.0
+
+        if max_matches <= 0:
+            return 1.0
+
+        jaro = (max_matches / length_1 + max_matches / length_2 + 1) / 3
+        return 1 - (jaro + cls.MAX_PREFIX * cls.PREFIX_SCALE * (1 - jaro))
+
+    @classmethod
+    def key_gap_bound(cls, gap: float) -> Number:
+        # The gap says the lengths (plus one) differ by at least a factor of e ** gap.
+        return max(0.0, cls._distance_bound(1, math.exp(gap), 1))
+
+    @classmethod
+    def lower_bound(cls, signature_1: Tuple[int, Tuple[int, ...]], signature_2: Tuple[int, Tuple[int, ...]]) -> Number:
+        # Characters in the same bin might not be equal, so this can only overcount matches.
+        common_characters = sum(map(min, signature_1[1], signature_2[1]))
+        return max(0.0, cls._distance_bound(signature_1[0], signature_2[0], common_characters))
+
+    @staticmethod
+    def sort_function(distance: CellDistance) -> Number:
+        return distance.distance
+
+
+class TokenSetDistance(BaseStringDistancer):
+    """Jaccard distance between the sets of tokens (words and punctuation) in each string."""
+
+    TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+    @classmethod
+    def find_distance(cls, string_1: str, string_2: str) -> float:
+        return cls._jaccard_distance(cls.signature(string_1), cls.signature(string_2))
+
+    @staticmethod
+    def _jaccard_distance(tokens_1: FrozenSet[str], tokens_2: FrozenSet[str]) -> float:
+        if not tokens_1 and not tokens_2:
+            return 0.0
+
+        return 1 - len(tokens_1 & tokens_2) / len(tokens_1 | tokens_2)
+
+    @classmethod
+    def signature(cls, string: str) -> FrozenSet[str]:
+        return frozenset(cls.TOKEN_PATTERN.findall(string))
+
+    @staticmethod
+    def bucket_key(signature: FrozenSet[str]) -> float:
+        return math.log(len(signature) + 1)
+
+    @staticmethod
+    def key_gap_bound(gap: float) -> Number:
+        # Two sets can share at most all of the smaller one.
+        return 1 - math.exp(-gap)
+
+    @classmethod
+    def lower_bound(cls, signature_1: FrozenSet[str], signature_2: FrozenSet[str]) -> Number:
+        # Cheap enough to just compute.
+        return cls._jaccard_distance(signature_1, signature_2)
+
     @staticmethod
     def sort_function(distance: CellDistance) -> Number:
         return distance.distance
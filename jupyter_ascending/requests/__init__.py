@@ -1,31 +1,5 @@
-"""
-from typing import Optional
-
-from attr import dataclass
-
-
-@dataclass
-class JsonBaseRequest:
-    file_name: str
-
-
-@dataclass
-class ExecuteRequest(JsonBaseRequest):
-    cell_index: int
-    contents: Optional[str]
-
-
-@dataclass
-class SyncRequest(JsonBaseRequest):
-    contents: str
-
-
-@dataclass
-class GetStatusRequest(JsonBaseRequest):
-    pass
-
+"""The python client library for Jupyter Ascending. See `readme.md` in this directory.
 
-@dataclass
-class FocusCellRequest(JsonBaseRequest):
-    cell_index: int
+Each module here is a small CLI, so keep imports in this package cheap:
+anything heavy (jupytext, jupyter, ipykernel) should only be imported by the code that needs it.
 """
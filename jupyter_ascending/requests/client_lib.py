@@ -1,3 +1,10 @@
+import time
+from contextlib import contextmanager
+from typing import Any
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
 from typing import TypeVar
 
 import attr
@@ -5,42 +12,143 @@ import requests
 from jsonrpcclient import Ok
 from jsonrpcclient import parse
 from jsonrpcclient import request
+from loguru import logger
 from requests.exceptions import ConnectionError  # type: ignore
 
+from jupyter_ascending import metrics
+from jupyter_ascending import tracing
+from jupyter_ascending import wire
 from jupyter_ascending._environment import EXECUTE_HOST_URL
-from jupyter_ascending.handlers.server_extension import perform_notebook_request
+from jupyter_ascending._environment import TRACE_FILE
+from jupyter_ascending.json_requests import PERFORM_NOTEBOOK_REQUEST
 from jupyter_ascending.json_requests import JsonBaseRequest
 
 GenericJsonRequest = TypeVar("GenericJsonRequest", bound=JsonBaseRequest)
 
+# Shared between requests so that long-lived clients (see `coprocess.py`) keep their connection alive.
+_SESSION: Optional[requests.Session] = None
+
+# The format the server said it can read requests in. Plain JSON until it tells us. See `wire.py`.
+_SERVER_WIRE_FORMAT = wire.PLAIN_JSON
+
+# Stages we timed since the last request, sent along with the next one so the server can record them.
+_UNREPORTED_TIMINGS: List[Tuple[str, float]] = []
+
 
 class RequestFailure(Exception):
     pass
 
 
-def request_notebook_command(json_request: GenericJsonRequest):
+def _get_session() -> requests.Session:
+    global _SESSION
+
+    if _SESSION is None:
+        _SESSION = requests.Session()
+
+    return _SESSION
+
+
+@contextmanager
+def timed_stage(stage: str) -> Iterator[None]:
+    """Time the block as `stage` (one of `metrics.CLIENT_STAGES`), to report to the server with the next request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _UNREPORTED_TIMINGS.append((stage, time.perf_counter() - start))
+        tracing.record(f"{stage} done")
+
+
+@contextmanager
+def traced(print_timeline: bool = False) -> Iterator[None]:
+    """Trace all the requests sent in the block as one (see `tracing.py`).
+
+    Prints the timeline afterwards if `print_timeline`, and appends it to `JUPYTER_ASCENDING_TRACE_FILE` if that's set.
+    Within another `traced` block, this one is just part of that one's trace."""
+    if tracing.current() is not None:
+        yield
+        return
+
+    with tracing.started(process="client") as trace:
+        try:
+            yield
+        finally:
+            trace.record("done")
+
+            if print_timeline:
+                print(tracing.format_timeline(trace))
+            if TRACE_FILE:
+                tracing.write(trace, TRACE_FILE)
+
+
+def request_notebook_command(json_request: GenericJsonRequest) -> Any:
     """This is a command to be used by the client libraries to send a command to this server.
 
-    It calls unpacks the JsonRequest and calls `perform_notebook_request` defined above."""
+    It calls unpacks the JsonRequest and calls `perform_notebook_request` in the server extension.
+
+    Returns whatever the notebook's handler for this request returned.
+
+    Every request carries the id of a trace, so its log lines can be found in the logs of every process it went
+    through. It's the id of the caller's trace if it's in a `traced` block."""
+    command_name = type(json_request).__name__
     try:
         json = request(
-            perform_notebook_request.__name__,
+            PERFORM_NOTEBOOK_REQUEST,
             params=dict(
-                command_name=type(json_request).__name__,
+                command_name=command_name,
                 notebook_path=json_request.file_name,
                 data=attr.asdict(json_request),
             ),
         )
-        response = requests.post(EXECUTE_HOST_URL, json=json)
-        response.raise_for_status()
-        result = parse(response.json())
+
+        with traced():
+            trace = tracing.current()
+            logger.debug("Sending {} (trace {})", command_name, trace.trace_id)
+            trace.record(f"sending {command_name}")
+
+            result = parse(_post(json))
+            trace.record(f"got {command_name} result")
 
         if not isinstance(result, Ok):
             raise RequestFailure(f"JSONRPC request returned as failure: {result}")
 
+        return result.result
+
     except ConnectionError as e:
         raise RequestFailure("Unable to connect to server. Perhaps notebook is not running?") from e
-    except requests.exceptions.HTTPError as e:
+    except (requests.exceptions.HTTPError, wire.UnreadableBody) as e:
         raise RequestFailure(
             "Unable to process request. Is jupyter-ascending installed in the server's python environment? Perhaps something else is running on this port?"
         ) from e
+
+
+def _post(json: Any) -> Any:
+    global _SERVER_WIRE_FORMAT
+
+    wire_format = _SERVER_WIRE_FORMAT
+    body, headers = wire.encode(json, wire_format)
+
+    headers = {**headers, **wire.accept_headers()}
+    trace = tracing.current()
+    if trace is not None:
+        headers[tracing.TRACE_ID_HEADER] = trace.trace_id
+    if _UNREPORTED_TIMINGS:
+        headers[metrics.CLIENT_TIMING_HEADER] = metrics.format_timings(_UNREPORTED_TIMINGS)
+        _UNREPORTED_TIMINGS.clear()
+
+    start = time.perf_counter()
+    response = _get_session().post(EXECUTE_HOST_URL, data=body, headers=headers)
+
+    if trace is not None:
+        events = tracing.parse_events(response.headers.get(tracing.TRACE_HEADER))
+        trace.add_remote(events, start, time.perf_counter(), metrics.server_seconds(response.headers))
+
+    if response.status_code == wire.UNREADABLE_BODY_STATUS and wire_format != wire.PLAIN_JSON:
+        # The server changed since it told us what it can read. Plain JSON always works.
+        _SERVER_WIRE_FORMAT = wire.PLAIN_JSON
+        return _post(json)
+
+    response.raise_for_status()
+    _SERVER_WIRE_FORMAT = wire.choose_for_next_request(response.headers)
+
+    return wire.decode(response.content, response.headers)
@@ -0,0 +1,164 @@
+"""
+A long-lived client for editor plugins, similar to how an editor keeps a language server running.
+
+Instead of starting a new python process for every sync / execute, an editor can start
+
+    python -m jupyter_ascending.requests.coprocess
+
+once and write one JSON object per line to its stdin, e.g.
+
+    {"id": 1, "command": "sync", "filename": "/path/to/example.sync.py"}
+    {"id": 2, "command": "execute", "filename": "/path/to/example.sync.py", "linenumber": 16}
+    {"id": 3, "command": "execute_range", "filename": "/path/to/example.sync.py", "startline": 10, "endline": 40}
+
+`execute_range` takes "startcell" / "endcell", or "startline" / "endline", or "aboveline" or "belowline"
+(see `execute_range.resolve_range`), and "stoponerror" (default true).
+
+For each line, one JSON object is written to stdout:
+
+    {"id": 2, "ok": true, "result": "Executing cell `0`"}
+    {"id": 3, "ok": false, "error": "Unable to connect to server. Perhaps notebook is not running?"}
+
+Logs go to stderr (and the usual log file), so stdout only ever contains responses.
+"""
+import json
+import sys
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import TextIO
+
+from loguru import logger
+
+from jupyter_ascending.logger import setup_logger
+from jupyter_ascending.requests import execute
+from jupyter_ascending.requests import execute_all
+from jupyter_ascending.requests import execute_range
+from jupyter_ascending.requests import get_status
+from jupyter_ascending.requests import restart
+from jupyter_ascending.requests import sync
+from jupyter_ascending.requests.client_lib import RequestFailure
+
+
+class CommandError(Exception):
+    pass
+
+
+def _get_argument(message: Dict[str, Any], name: str) -> Any:
+    if name not in message:
+        raise CommandError(f"Missing required argument '{name}'")
+
+    return message[name]
+
+
+def _sync(message: Dict[str, Any]) -> Any:
+    return sync.sync_file(_get_argument(message, "filename"))
+
+
+def _execute(message: Dict[str, Any]) -> Any:
+    file_name = _get_argument(message, "filename")
+    line_number = int(_get_argument(message, "linenumber"))
+
+    # Same as the CLI: sync code and execute it in one request, unless the editor says it already synced.
+    if message.get("sync", True):
+        return execute.sync_and_execute(file_name, line_number)
+
+    return execute.send(file_name, line_number)
+
+
+def _execute_all(message: Dict[str, Any]) -> Any:
+    file_name = _get_argument(message, "filename")
+
+    if message.get("sync", True):
+        sync.sync_file(file_name, check_digest=True)
+
+    return execute_all.send(file_name)
+
+
+def _execute_range(message: Dict[str, Any]) -> Any:
+    file_name = _get_argument(message, "filename")
+
+    text = None
+    if message.get("sync", True):
+        # Read the file once, so the lines are found in the cells that were synced, even if it changes meanwhile.
+        with open(file_name, "r") as reader:
+            text = reader.read()
+        sync.sync_file(file_name, check_digest=True, text=text)
+
+    if "startcell" in message or "endcell" in message:
+        start_cell, end_cell = message.get("startcell", 0), message.get("endcell")
+    else:
+        start_cell, end_cell = execute_range.resolve_range(
+            file_name,
+            start_line=message.get("startline"),
+            end_line=message.get("endline"),
+            above_line=message.get("aboveline"),
+            below_line=message.get("belowline"),
+            text=text,
+        )
+
+    return execute_range.send(file_name, start_cell, end_cell, stop_on_error=message.get("stoponerror", True))
+
+
+def _restart(message: Dict[str, Any]) -> Any:
+    return restart.send(_get_argument(message, "filename"))
+
+
+def _status(message: Dict[str, Any]) -> Any:
+    return get_status.send(_get_argument(message, "filename"))
+
+
+COMMANDS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "sync": _sync,
+    "execute": _execute,
+    "execute_all": _execute_all,
+    "execute_range": _execute_range,
+    "restart": _restart,
+    "status": _status,
+}
+
+
+def handle_line(line: str) -> Dict[str, Any]:
+    """Run the command described by one line of input and build the response for it."""
+    try:
+        message = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"id": None, "ok": False, "error": f"Invalid JSON: {e}"}
+
+    if not isinstance(message, dict):
+        return {"id": None, "ok": False, "error": "Expected a JSON object"}
+
+    message_id = message.get("id")
+    command_name = message.get("command")
+
+    if command_name not in COMMANDS:
+        return {"id": message_id, "ok": False, "error": f"Unknown command: {command_name}"}
+
+    try:
+        result = COMMANDS[command_name](message)
+    except (CommandError, RequestFailure, OSError, ValueError) as e:
+        logger.warning("Command {} failed: {}", command_name, e)
+        return {"id": message_id, "ok": False, "error": str(e)}
+    except Exception as e:
+        logger.exception("Unexpected error while running {}", command_name)
+        return {"id": message_id, "ok": False, "error": repr(e)}
+
+    return {"id": message_id, "ok": True, "result": result}
+
+
+def serve(input_stream: TextIO, output_stream: TextIO) -> None:
+    """Answer commands from `input_stream` until it is closed."""
+    for line in input_stream:
+        if not line.strip():
+            continue
+
+        response = handle_line(line)
+        output_stream.write(json.dumps(response, default=str) + "\n")
+        output_stream.flush()
+
+
+if __name__ == "__main__":
+    setup_logger(stream=sys.stderr)
+    logger.info("Starting co-process client")
+
+    serve(sys.stdin, sys.stdout)
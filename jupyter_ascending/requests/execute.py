@@ -1,70 +1,85 @@
 import argparse
 from functools import partial
 from pathlib import Path
+from typing import Any
 from typing import List
+from typing import Optional
 
 from loguru import logger
-import jupytext
 
+from jupyter_ascending._environment import SYNC_EXTENSION
+from jupyter_ascending.delta_sync import SegmentedContents
 from jupyter_ascending.json_requests import ExecuteRequest
+from jupyter_ascending.json_requests import SyncAndExecuteRequest
 from jupyter_ascending.logger import setup_logger
+from jupyter_ascending.notebook.line_index import build_line_index
+from jupyter_ascending.requests.client_lib import RequestFailure
 from jupyter_ascending.requests.client_lib import request_notebook_command
-from jupyter_ascending.requests.sync import send as sync_send
+from jupyter_ascending.requests.client_lib import timed_stage
+from jupyter_ascending.requests.client_lib import traced
+from jupyter_ascending.requests.line_index import find_cell_number
+from jupyter_ascending.requests.output_stream import OutputStream
+from jupyter_ascending.requests.sync import record_sync_result
+from jupyter_ascending.requests.sync import sync_file
 
 
 def _find_cell_number(lines: List[str], line_number: int) -> int:
-    """Implementation closely copied from jupytext.
+    return build_line_index(lines).cell_for_line(line_number)
 
-    See https://github.com/mwouts/jupytext/blob/main/jupytext/jupytext.py#L138
-    """
-    text = "\n".join(lines)
-    conv = jupytext.jupytext.TextNotebookConverter(
-        jupytext.formats.divine_format(text), None
-    )
-    (metadata, _, _, pos,) = jupytext.header.header_to_metadata_and_cell(
-        lines,
-        conv.implementation.header_prefix,
-        conv.implementation.extension,
-        conv.fmt.get(
-            "root_level_metadata_as_raw_cell",
-            conv.config.root_level_metadata_as_raw_cell
-            if conv.config is not None
-            else True,
-        ),
-    )
-    conv.update_fmt_with_notebook_options(metadata, read=True)
-    default_language = jupytext.languages.default_language_from_metadata_and_ext(
-        metadata, conv.implementation.extension
-    )
 
-    lines = lines[pos:]
-    num_lines_read, cell_number = pos, 0
-    reader = conv.implementation.cell_reader_class(conv.fmt, default_language)
-    while lines and num_lines_read < line_number:
-        _, pos = reader.read(lines)
-        num_lines_read += pos
-        cell_number += 1
-        lines = lines[pos:]
-    return max(0, cell_number - 1)
-
-
-def send(file_name: str, line_number: int):
+def send(file_name: str, line_number: int, stream_id: Optional[str] = None):
     logger.debug("Starting execute request")
 
     # Always pass absolute path
     file_name = str(Path(file_name).absolute())
 
-    request_obj = partial(ExecuteRequest, file_name=file_name, contents="")
-
-    with open(file_name, "r", encoding="utf8") as reader:
-        lines = reader.readlines()
+    request_obj = partial(ExecuteRequest, file_name=file_name, contents="", stream_id=stream_id)
 
-    cell_index = _find_cell_number(lines, line_number)
+    with timed_stage("client_parse"):
+        cell_index = find_cell_number(file_name, line_number)
 
     final_request = request_obj(cell_index=cell_index)
     logger.info(f"Sending request with {final_request}")
-    request_notebook_command(final_request)
+    result = request_notebook_command(final_request)
     logger.info("... Complete")
+    return result
+
+
+def sync_and_execute(file_name: str, line_number: int, stream_id: Optional[str] = None) -> Any:
+    """Sync `file_name`, then execute the cell at `line_number`, in one request.
+
+    The notebook finds the cell in the contents it just synced, so edits made in between can't get mixed in.
+    Pass the `stream_id` of an `OutputStream` to get the cell's output there."""
+    if f".{SYNC_EXTENSION}.py" not in file_name:
+        return send(file_name, line_number, stream_id)
+
+    file_name = str(Path(file_name).absolute())
+
+    with timed_stage("client_read"), open(file_name, "r") as reader:
+        raw_result = reader.read()
+
+    request_obj = SyncAndExecuteRequest(
+        file_name=file_name, contents=raw_result, line_number=line_number, stream_id=stream_id
+    )
+    logger.info("Sending sync and execute request for line {} of {}", line_number, file_name)
+
+    try:
+        result = request_notebook_command(request_obj)
+    except RequestFailure as e:
+        # Probably a notebook running an older version that doesn't know about this request.
+        logger.info("Sync and execute failed, syncing and executing separately: {}", e)
+        sync_file(file_name, check_digest=True)
+        return send(file_name, line_number, stream_id)
+
+    record_sync_result(file_name, SegmentedContents.from_text(raw_result), result)
+
+    logger.info("... Complete")
+    return result
+
+
+@logger.catch
+def sync_and_send(file_name: str, line_number: int, stream_id: Optional[str] = None) -> Any:
+    return sync_and_execute(file_name, line_number, stream_id)
 
 
 if __name__ == "__main__":
@@ -75,9 +90,18 @@ if __name__ == "__main__":
     parser.add_argument(
         "--linenumber", type=int, help="Line number that the cursor is currently on"
     )
+    parser.add_argument("--stream", action="store_true", help="Print the cell's output here as it runs")
+    parser.add_argument("--trace", action="store_true", help="Print a timeline of where the time went")
 
     arguments = parser.parse_args()
 
-    # Sync code first
-    sync_send(arguments.filename)
-    send(arguments.filename, arguments.linenumber)
+    with traced(arguments.trace):
+        if arguments.stream:
+            with OutputStream(arguments.filename) as output:
+                result = sync_and_send(arguments.filename, arguments.linenumber, output.stream_id)
+
+                # Older notebooks answer with a message, newer ones say whether the cell actually ran.
+                if isinstance(result, str) or (isinstance(result, dict) and result.get("executed")):
+                    output.copy_to()
+        else:
+            sync_and_send(arguments.filename, arguments.linenumber)
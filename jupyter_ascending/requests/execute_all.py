@@ -14,9 +14,10 @@ def send(file_name: str):
     file_name = str(Path(file_name).absolute())
 
     request_obj = ExecuteAllRequest(file_name=file_name)
-    request_notebook_command(request_obj)
+    result = request_notebook_command(request_obj)
 
     logger.info("... Complete")
+    return result
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import argparse
+from functools import partial
+from pathlib import Path
+from typing import Any
+from typing import Optional
+from typing import Tuple
+
+from loguru import logger
+
+from jupyter_ascending.json_requests import ExecuteRangeRequest
+from jupyter_ascending.logger import setup_logger
+from jupyter_ascending.notebook.line_index import build_line_index
+from jupyter_ascending.requests.client_lib import request_notebook_command
+from jupyter_ascending.requests.line_index import find_cell_number as find_cached_cell_number
+from jupyter_ascending.requests.sync import send as sync_send
+
+
+def resolve_range(
+    file_name: str,
+    start_line: Optional[int] = None,
+    end_line: Optional[int] = None,
+    above_line: Optional[int] = None,
+    below_line: Optional[int] = None,
+    text: Optional[str] = None,
+) -> Tuple[int, Optional[int]]:
+    """The (start_cell, end_cell) of an `ExecuteRangeRequest` for a range of lines.
+
+    `above_line` runs every cell before the one it's in, and `below_line` runs its cell and every cell after it,
+    like "Run All Above" and "Run All Below" in the notebook. The lines are looked up in `text` if given (e.g. what
+    was just synced), and in the file as it is on disk otherwise."""
+    file_name = str(Path(file_name).absolute())
+
+    if text is None:
+        find_cell_number = partial(find_cached_cell_number, file_name)
+    else:
+        find_cell_number = build_line_index(text.splitlines(keepends=True)).cell_for_line
+
+    if above_line is not None:
+        return 0, find_cell_number(above_line) - 1
+
+    if below_line is not None:
+        return find_cell_number(below_line), None
+
+    start_cell = 0 if start_line is None else find_cell_number(start_line)
+    end_cell = None if end_line is None else find_cell_number(end_line)
+
+    return start_cell, end_cell
+
+
+def send(file_name: str, start_cell: int, end_cell: Optional[int], stop_on_error: bool = True) -> Any:
+    file_name = str(Path(file_name).absolute())
+    logger.info(f"Executing cells {start_cell} to {'the end' if end_cell is None else end_cell} in file: {file_name}...")
+
+    request_obj = ExecuteRangeRequest(
+        file_name=file_name, start_cell=start_cell, end_cell=end_cell, stop_on_error=stop_on_error
+    )
+    result = request_notebook_command(request_obj)
+
+    logger.info("... Complete")
+    return result
+
+
+if __name__ == "__main__":
+    setup_logger()
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--filename", help="Filename to send")
+    parser.add_argument("--start-cell", type=int, help="First cell to execute")
+    parser.add_argument("--end-cell", type=int, help="Last cell to execute")
+    parser.add_argument("--start-line", type=int, help="Execute from the cell this line is in")
+    parser.add_argument("--end-line", type=int, help="Execute up to the cell this line is in")
+    parser.add_argument("--above", type=int, metavar="LINENUMBER", help="Execute every cell above this line's cell")
+    parser.add_argument("--below", type=int, metavar="LINENUMBER", help="Execute this line's cell and every one below")
+    parser.add_argument("--keep-going", action="store_true", help="Keep executing cells after one raises")
+
+    arguments = parser.parse_args()
+
+    # Sync code first
+    sync_send(arguments.filename)
+
+    if arguments.start_cell is not None or arguments.end_cell is not None:
+        cells = (arguments.start_cell or 0, arguments.end_cell)
+    else:
+        cells = resolve_range(
+            arguments.filename, arguments.start_line, arguments.end_line, arguments.above, arguments.below
+        )
+
+    send(arguments.filename, *cells, stop_on_error=not arguments.keep_going)
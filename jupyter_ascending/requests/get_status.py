@@ -10,7 +10,7 @@ def send(file_name: str):
     file_name = str(Path(file_name).absolute())
 
     request_obj = GetStatusRequest(file_name=file_name)
-    request_notebook_command(request_obj)
+    return request_notebook_command(request_obj)
 
 
 if __name__ == "__main__":
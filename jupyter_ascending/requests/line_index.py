@@ -0,0 +1,86 @@
+"""Cached `LineIndex`es of .sync.py files, so `execute` can find the cell under the cursor quickly.
+
+The indexes are kept:
+
+- in memory, for long-lived clients (see `coprocess.py`).
+- on disk, next to the log file, so one-off `execute` calls can use them too.
+
+Both are keyed by the file's path and checked against its mtime and size. When the file changed, the index is
+rebuilt from the cached one, which only parses the cells that changed (see `notebook/line_index.py`).
+"""
+import json
+import os
+import tempfile
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+import attr
+from loguru import logger
+
+from jupyter_ascending.delta_sync import hash_text
+from jupyter_ascending.notebook.line_index import LineIndex
+from jupyter_ascending.notebook.line_index import build_line_index
+
+#: Cached indexes are stored here, one file per .sync.py file.
+INDEX_DIRECTORY = os.path.join(tempfile.gettempdir(), "jupyter_ascending", "line_index")
+
+#: Bump when the stored format changes, so old files are ignored.
+_INDEX_FORMAT = 1
+
+_INDEXES: Dict[str, LineIndex] = {}
+
+
+def _index_path(file_name: str) -> str:
+    return os.path.join(INDEX_DIRECTORY, hash_text(file_name) + ".json")
+
+
+def _load_index(file_name: str) -> Optional[LineIndex]:
+    try:
+        with open(_index_path(file_name), "r") as reader:
+            stored: Dict[str, Any] = json.load(reader)
+
+        if stored.pop("format") != _INDEX_FORMAT:
+            return None
+
+        return LineIndex(**stored)
+    except (OSError, ValueError, TypeError, KeyError):
+        return None
+
+
+def _save_index(file_name: str, index: LineIndex) -> None:
+    try:
+        os.makedirs(INDEX_DIRECTORY, exist_ok=True)
+
+        # Write somewhere else first, so another client never reads half a file.
+        temporary_path = f"{_index_path(file_name)}.{os.getpid()}"
+        with open(temporary_path, "w") as writer:
+            json.dump({"format": _INDEX_FORMAT, **attr.asdict(index)}, writer)
+
+        os.replace(temporary_path, _index_path(file_name))
+    except OSError as e:
+        logger.warning("Unable to save line index for {}: {}", file_name, e)
+
+
+def get_line_index(file_name: str) -> LineIndex:
+    """The index for `file_name`, as it is on disk now."""
+    stat = os.stat(file_name)
+
+    index = _INDEXES.get(file_name) or _load_index(file_name)
+    if index is not None and (index.mtime_ns, index.size) == (stat.st_mtime_ns, stat.st_size):
+        _INDEXES[file_name] = index
+        return index
+
+    with open(file_name, "r", encoding="utf8") as reader:
+        lines = reader.readlines()
+
+    index = attr.evolve(build_line_index(lines, index), mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+
+    _INDEXES[file_name] = index
+    _save_index(file_name, index)
+
+    return index
+
+
+def find_cell_number(file_name: str, line_number: int) -> int:
+    return get_line_index(file_name).cell_for_line(line_number)
@@ -0,0 +1,96 @@
+"""Receive the output of a cell while it runs. See `handlers/output_stream.py` for how the notebook side works."""
+import json
+import sys
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+from typing import TextIO
+
+import requests
+
+from jupyter_ascending._environment import EXECUTE_HOST_URL
+from jupyter_ascending.requests.client_lib import RequestFailure
+
+# Where each kind of output goes when copied to a terminal.
+_STDERR_NAMES = {"stderr", "error"}
+
+
+class OutputStream:
+    """The output of a cell executed in the notebook paired with `file_name`.
+
+    Open it (as a context manager) before executing the cell, and execute the cell with its `stream_id`. Then iterate
+    over it for `{"name": ..., "text": ...}` chunks as the cell prints them. Iterating stops once the cell is done."""
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+
+        # Pass this along with the request that executes the cell. Set once the stream is open.
+        self.stream_id: Optional[str] = None
+
+        # How much output the notebook dropped because there was too much of it. Set once iterating is done.
+        self.dropped_bytes = 0
+
+        self._response: Optional[requests.Response] = None
+        self._lines: Optional[Iterator[bytes]] = None
+
+    def __enter__(self) -> "OutputStream":
+        try:
+            # No read timeout: a cell can go a long time without printing anything.
+            self._response = requests.get(
+                f"{EXECUTE_HOST_URL}/stream", params={"file_name": self.file_name}, stream=True, timeout=(5, None)
+            )
+        except requests.exceptions.ConnectionError as e:
+            raise RequestFailure("Unable to connect to server. Perhaps notebook is not running?") from e
+
+        self._lines = self._response.iter_lines()
+
+        first_event = self._next_event()
+        if first_event is None or first_event["event"] != "watching":
+            self.close()
+            raise RequestFailure(f"Unable to watch output: {first_event}")
+
+        self.stream_id = first_event["stream_id"]
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._response is not None:
+            self._response.close()
+
+    def _next_event(self) -> Optional[Dict[str, Any]]:
+        assert self._lines is not None
+
+        for line in self._lines:
+            if line:
+                return json.loads(line)
+
+        return None
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        while True:
+            event = self._next_event()
+
+            if event is None:
+                raise RequestFailure("Output stream ended before the cell was done")
+
+            if event["event"] == "error":
+                raise RequestFailure(event["message"])
+
+            if event["event"] == "done":
+                self.dropped_bytes = event["dropped_bytes"]
+                return
+
+            yield {"name": event["name"], "text": event["text"]}
+
+    def copy_to(self, stdout: TextIO = sys.stdout, stderr: TextIO = sys.stderr) -> None:
+        """Write the output to `stdout` and `stderr` as it comes in."""
+        for chunk in self:
+            stream = stderr if chunk["name"] in _STDERR_NAMES else stdout
+            stream.write(chunk["text"])
+            stream.flush()
+
+        if self.dropped_bytes:
+            stderr.write(f"[{self.dropped_bytes} bytes of output not shown]\n")
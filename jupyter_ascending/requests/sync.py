@@ -1,29 +1,105 @@
 import argparse
 from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
 
 from loguru import logger
 
 from jupyter_ascending._environment import SYNC_EXTENSION
+from jupyter_ascending.delta_sync import SegmentedContents
+from jupyter_ascending.json_requests import DeltaSyncRequest
+from jupyter_ascending.json_requests import SyncDigestRequest
 from jupyter_ascending.json_requests import SyncRequest
+from jupyter_ascending.json_requests import SyncStatus
 from jupyter_ascending.logger import setup_logger
+from jupyter_ascending.requests.client_lib import RequestFailure
 from jupyter_ascending.requests.client_lib import request_notebook_command
+from jupyter_ascending.requests.client_lib import timed_stage
+from jupyter_ascending.requests.client_lib import traced
 
+# What we last synced for each file. Only useful to long-lived clients (see `coprocess.py`),
+#   which can then send just the cells that changed since.
+_LAST_SYNCED: Dict[str, SegmentedContents] = {}
 
-@logger.catch
-def send(file_name: str):
+
+def _send_without_contents(request_obj: Any) -> Any:
+    """Send a request that saves us from sending the whole file.
+
+    Returns the notebook's result, or None if it needs a full sync instead."""
+    try:
+        result = request_notebook_command(request_obj)
+    except RequestFailure as e:
+        # Probably a notebook running an older version that doesn't know about this request.
+        logger.info("{} failed, falling back to full sync: {}", type(request_obj).__name__, e)
+        return None
+
+    if isinstance(result, dict) and result.get("status") == SyncStatus.FULL_SYNC_REQUIRED.value:
+        logger.info("Notebook asked for a full sync")
+        return None
+
+    return result
+
+
+def sync_file(file_name: str, check_digest: bool = False, text: Optional[str] = None) -> Any:
+    """Send the contents of `file_name` to its paired notebook, raising `RequestFailure` if that fails.
+
+    With `check_digest=True`, first asks the notebook whether it already has these contents, and only sends them if
+    it doesn't. That saves sending the file when it's usually unchanged (e.g. syncing before an execute, when the
+    editor already synced on save), but costs an extra round trip when it did change.
+
+    Pass the file's `text` if you already read it, so the notebook gets exactly what you looked at."""
     if f".{SYNC_EXTENSION}.py" not in file_name:
-        return
+        return None
 
     logger.info(f"Syncing File: {file_name}...")
     file_name = str(Path(file_name).absolute())
 
-    with open(file_name, "r") as reader:
-        raw_result = reader.read()
+    if text is None:
+        with timed_stage("client_read"), open(file_name, "r") as reader:
+            text = reader.read()
 
-    request_obj = SyncRequest(file_name=file_name, contents=raw_result)
-    request_notebook_command(request_obj)
+    with timed_stage("client_parse"):
+        contents = SegmentedContents.from_text(text)
+
+    if file_name in _LAST_SYNCED:
+        base = _LAST_SYNCED[file_name]
+        request_obj: Any = DeltaSyncRequest(
+            file_name=file_name,
+            base_version=base.version,
+            version=contents.version,
+            segment_hashes=contents.segment_hashes,
+            new_segments=contents.new_segments_since(base),
+        )
+    elif check_digest:
+        request_obj = SyncDigestRequest(file_name=file_name, version=contents.version)
+    else:
+        request_obj = None
+
+    result = None if request_obj is None else _send_without_contents(request_obj)
+
+    if result is None:
+        request_obj = SyncRequest(file_name=file_name, contents=text)
+        result = request_notebook_command(request_obj)
+
+    record_sync_result(file_name, contents, result)
 
     logger.info("... Complete")
+    return result
+
+
+def record_sync_result(file_name: str, contents: SegmentedContents, result: Any) -> None:
+    """Remember what the notebook has for `file_name` after a request that synced `contents`."""
+    if isinstance(result, dict) and result.get("status") == SyncStatus.SUPERSEDED.value:
+        # A newer sync got there first, so the notebook never had these contents.
+        _LAST_SYNCED.pop(file_name, None)
+    else:
+        _LAST_SYNCED[file_name] = contents
+
+
+@logger.catch
+def send(file_name: str):
+    return sync_file(file_name)
 
 
 if __name__ == "__main__":
@@ -31,6 +107,8 @@ if __name__ == "__main__":
     setup_logger()
 
     parser.add_argument("--filename", help="Filename to send")
+    parser.add_argument("--trace", action="store_true", help="Print a timeline of where the time went")
 
     arguments = parser.parse_args()
-    send(arguments.filename)
+    with traced(arguments.trace):
+        send(arguments.filename)
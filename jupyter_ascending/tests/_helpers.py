@@ -0,0 +1,58 @@
+"""Things several test modules use. Fixtures are in `conftest.py`."""
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from jupyter_ascending._environment import SYNC_EXTENSION
+
+NOTEBOOK_NAME = f"/home/user/notebook.{SYNC_EXTENSION}.ipynb"
+
+FILE_TEXT = """# %%
+x = 1
+
+# %% [markdown]
+# Some words
+
+# %%
+print(x)
+"""
+
+
+class FakeShell:
+    """Just enough of IPython's shell for `output_stream.install`."""
+
+    def __init__(self):
+        self.callbacks: Dict[str, Callable] = {}
+        self.display_hooks: List[Callable] = []
+
+        self.events = self
+        self.display_pub = self
+        self.display_formatter = self
+
+    def register(self, event: str, callback: Callable) -> None:
+        self.callbacks[event] = callback
+
+    def register_hook(self, hook: Callable) -> None:
+        self.display_hooks.append(hook)
+
+    def unregister_hook(self, hook: Callable) -> None:
+        self.display_hooks.remove(hook)
+
+    def format(self, value: Any, include=None):
+        return {"text/plain": repr(value)}, {}
+
+    def run_cell(self, body: Callable[[], Any]) -> None:
+        """Run `body` like a cell, with its return value as the cell's result."""
+        result = type("ExecutionResult", (), {"error_before_exec": None, "error_in_exec": None, "result": None})()
+        self.callbacks["pre_run_cell"](None)
+        try:
+            result.result = body()
+        except Exception as e:
+            result.error_in_exec = e
+        self.callbacks["post_run_cell"](result)
+
+    def display(self, text: str) -> None:
+        msg = {"msg_type": "display_data", "content": {"data": {"text/plain": text}}}
+        for hook in self.display_hooks:
+            msg = hook(msg)
@@ -0,0 +1,53 @@
+import io
+import sys
+from typing import Type
+
+import pytest
+
+from jupyter_ascending.handlers import jupyter_notebook
+from jupyter_ascending.handlers import output_stream
+from jupyter_ascending.handlers.jupyter_notebook import output_text
+from jupyter_ascending.handlers.simulated_frontend import SimulatedFrontend
+from jupyter_ascending.requests import line_index
+from jupyter_ascending.tests._helpers import FakeShell
+
+
+@pytest.fixture(autouse=True)
+def line_index_cache(tmp_path, monkeypatch):
+    """Keep the line indexes that tests build out of the real cache, and out of each other's way."""
+    monkeypatch.setattr(line_index, "INDEX_DIRECTORY", str(tmp_path / "line_index"))
+    monkeypatch.setattr(line_index, "_INDEXES", {})
+
+
+@pytest.fixture
+def install(monkeypatch):
+    """Install `output_stream` on a new shell (a `FakeShell` unless given another type), and return the shell."""
+    monkeypatch.setattr(output_stream, "_installed", False)
+    monkeypatch.setattr(output_stream, "_BUFFERS", {})
+    monkeypatch.setattr(output_stream, "_ARMED", output_stream.deque())
+
+    def _install(shell_type: Type[FakeShell] = FakeShell) -> FakeShell:
+        # pytest swaps sys.stdout between setup and the test, so this has to happen in the test itself.
+        monkeypatch.setattr(sys, "stdout", io.StringIO())
+        monkeypatch.setattr(sys, "stderr", io.StringIO())
+
+        fake_shell = shell_type()
+        output_stream.install(fake_shell, output_text)
+
+        return fake_shell
+
+    return _install
+
+
+@pytest.fixture
+def frontend(monkeypatch):
+    monkeypatch.setattr(jupyter_notebook, "_comm", None)
+    monkeypatch.setattr(jupyter_notebook, "_last_applied", None)
+    monkeypatch.setattr(jupyter_notebook, "_SYNCED_CONTENTS", {})
+    monkeypatch.setattr(jupyter_notebook, "_LINE_INDEXES", {})
+
+    simulated_frontend = SimulatedFrontend()
+    jupyter_notebook.attach_comm_handlers(simulated_frontend)
+    jupyter_notebook.set_comm(simulated_frontend)
+
+    return simulated_frontend
@@ -0,0 +1,41 @@
+import random
+from difflib import get_close_matches
+
+import pytest
+
+from jupyter_ascending.notebook import close_matches
+from jupyter_ascending.notebook.close_matches import CloseMatcher
+
+WORDS = ["x", "y", "df", "print", "(", ")", " = ", " + ", "1", "22", "\n", "é", "plot"]
+
+
+def _random_string(rng: random.Random) -> str:
+    return "".join(rng.choice(WORDS) for _ in range(rng.randint(0, 8)))
+
+
+@pytest.fixture(params=["numpy", "python"])
+def backend(request, monkeypatch):
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(close_matches, "np", None)
+
+
+def test_same_as_get_close_matches(backend):
+    rng = random.Random(0)
+
+    for _ in range(300):
+        words = [_random_string(rng) for _ in range(rng.randint(0, 6))]
+        possibilities = [_random_string(rng) for _ in range(rng.randint(0, 10))]
+
+        matcher = CloseMatcher(words, possibilities)
+
+        # Take matches away as we go, like opcode_merge_cell_contents does.
+        remaining = list(range(len(possibilities)))
+        for word_index, word in enumerate(words):
+            expected = get_close_matches(word, [possibilities[x] for x in remaining], n=1)
+
+            assert matcher.closest(word_index, remaining) == (expected[0] if expected else None)
+
+            if expected:
+                remaining.remove(next(x for x in remaining if possibilities[x] == expected[0]))
@@ -0,0 +1,159 @@
+import io
+import json
+
+from jupyter_ascending._environment import SYNC_EXTENSION
+from jupyter_ascending.json_requests import ExecuteRangeRequest
+from jupyter_ascending.json_requests import ExecuteRequest
+from jupyter_ascending.json_requests import SyncAndExecuteRequest
+from jupyter_ascending.json_requests import SyncDigestRequest
+from jupyter_ascending.json_requests import SyncRequest
+from jupyter_ascending.json_requests import SyncStatus
+from jupyter_ascending.requests import coprocess
+from jupyter_ascending.requests import execute
+from jupyter_ascending.requests import execute_range
+from jupyter_ascending.requests import sync
+from jupyter_ascending.requests.client_lib import RequestFailure
+
+
+def _run(*messages) -> list:
+    input_stream = io.StringIO("".join(json.dumps(x) + "\n" for x in messages))
+    output_stream = io.StringIO()
+
+    coprocess.serve(input_stream, output_stream)
+
+    return [json.loads(x) for x in output_stream.getvalue().splitlines()]
+
+
+def test_invalid_lines_do_not_stop_the_server():
+    output_stream = io.StringIO()
+    coprocess.serve(io.StringIO('not json\n\n{"id": 3, "command": "nope"}\n'), output_stream)
+
+    responses = [json.loads(x) for x in output_stream.getvalue().splitlines()]
+    assert len(responses) == 2
+    assert responses[0]["ok"] is False
+    assert responses[1] == {"id": 3, "ok": False, "error": "Unknown command: nope"}
+
+
+def test_missing_argument():
+    (response,) = _run({"id": 1, "command": "restart"})
+
+    assert response["ok"] is False
+    assert "filename" in response["error"]
+
+
+def test_execute_syncs_and_executes_in_one_request(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    sync_file.write_text("# %%\nx = 1\n# %%\ny = 2\n")
+
+    sent = []
+
+    def fake_request(json_request):
+        sent.append(json_request)
+        return {"status": SyncStatus.APPLIED.value, "cell_index": 1, "executed": True}
+
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+    monkeypatch.setattr(execute, "request_notebook_command", fake_request)
+
+    (response,) = _run({"id": 7, "command": "execute", "filename": str(sync_file), "linenumber": 4})
+
+    assert response["ok"] is True
+    assert [type(x) for x in sent] == [SyncAndExecuteRequest]
+    assert (sent[0].contents, sent[0].line_number) == (sync_file.read_text(), 4)
+
+
+def test_execute_falls_back_to_syncing_then_executing(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    sync_file.write_text("# %%\nx = 1\n# %%\ny = 2\n")
+
+    sent = []
+
+    def fake_request(json_request):
+        sent.append(json_request)
+        if isinstance(json_request, SyncAndExecuteRequest):
+            # An older notebook.
+            raise RequestFailure("Method not found")
+        if isinstance(json_request, SyncDigestRequest):
+            return {"status": SyncStatus.FULL_SYNC_REQUIRED.value}
+
+        return "done"
+
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+    monkeypatch.setattr(sync, "request_notebook_command", fake_request)
+    monkeypatch.setattr(execute, "request_notebook_command", fake_request)
+
+    (response,) = _run({"id": 7, "command": "execute", "filename": str(sync_file), "linenumber": 4})
+
+    assert response == {"id": 7, "ok": True, "result": "done"}
+    assert [type(x) for x in sent] == [SyncAndExecuteRequest, SyncDigestRequest, SyncRequest, ExecuteRequest]
+    assert sent[-1].cell_index == 1
+
+
+def test_request_failures_are_reported(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    sync_file.write_text("# %%\nx = 1\n")
+
+    def failing_request(json_request):
+        raise RequestFailure("Unable to connect to server. Perhaps notebook is not running?")
+
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+    monkeypatch.setattr(sync, "request_notebook_command", failing_request)
+
+    (response,) = _run({"id": "a", "command": "sync", "filename": str(sync_file)})
+
+    assert response["id"] == "a"
+    assert response["ok"] is False
+    assert "Unable to connect" in response["error"]
+
+
+def test_execute_range_resolves_lines_to_cells(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    sync_file.write_text("# %%\nx = 1\n# %%\ny = 2\n# %%\nz = 3\n")
+
+    sent = []
+
+    def fake_request(json_request):
+        sent.append(json_request)
+        return "done"
+
+    monkeypatch.setattr(execute_range, "request_notebook_command", fake_request)
+
+    messages = [
+        {"id": 1, "command": "execute_range", "filename": str(sync_file), "startline": 4, "endline": 6, "sync": False},
+        {"id": 2, "command": "execute_range", "filename": str(sync_file), "aboveline": 5, "sync": False},
+        {"id": 3, "command": "execute_range", "filename": str(sync_file), "belowline": 4, "sync": False},
+        {"id": 4, "command": "execute_range", "filename": str(sync_file), "startcell": 1, "stoponerror": False},
+    ]
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+    monkeypatch.setattr(sync, "request_notebook_command", fake_request)
+
+    responses = _run(*messages)
+
+    assert [x["ok"] for x in responses] == [True] * 4
+    ranges = [(x.start_cell, x.end_cell, x.stop_on_error) for x in sent if isinstance(x, ExecuteRangeRequest)]
+    assert ranges == [(1, 2, True), (0, 1, True), (1, None, True), (1, None, False)]
+
+
+def test_execute_range_finds_lines_in_what_was_synced(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    sync_file.write_text("# %%\nx = 1\n# %%\ny = 2\n")
+
+    sent = []
+
+    def fake_request(json_request):
+        sent.append(json_request)
+        if isinstance(json_request, SyncDigestRequest):
+            return {"status": SyncStatus.FULL_SYNC_REQUIRED.value}
+        if isinstance(json_request, SyncRequest):
+            # Saved again while the sync was on its way.
+            sync_file.write_text("# %%\nv = 0\nw = 0\nx = 0\ny = 0\n" + json_request.contents)
+
+        return "done"
+
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+    monkeypatch.setattr(sync, "request_notebook_command", fake_request)
+    monkeypatch.setattr(execute_range, "request_notebook_command", fake_request)
+
+    (response,) = _run({"id": 1, "command": "execute_range", "filename": str(sync_file), "belowline": 4})
+
+    assert response["ok"] is True
+    assert [(x.start_cell, x.end_cell) for x in sent if isinstance(x, ExecuteRangeRequest)] == [(1, None)]
@@ -0,0 +1,133 @@
+from jupyter_ascending._environment import SYNC_EXTENSION
+from jupyter_ascending.delta_sync import SegmentedContents
+from jupyter_ascending.delta_sync import split_segments
+from jupyter_ascending.json_requests import DeltaSyncRequest
+from jupyter_ascending.json_requests import SyncDigestRequest
+from jupyter_ascending.json_requests import SyncRequest
+from jupyter_ascending.json_requests import SyncStatus
+from jupyter_ascending.requests import sync
+
+FILE_TEXT = """# ---
+# jupyter:
+#   jupytext:
+#     formats: py:percent
+# ---
+
+# %%
+x = 1
+
+# %% [markdown]
+# Some words
+
+# %%
+print(x)
+"""
+
+
+def test_split_segments_round_trips():
+    segments = split_segments(FILE_TEXT)
+
+    assert len(segments) == 4
+    assert segments[1].startswith("# %%\n")
+    assert "".join(segments) == FILE_TEXT
+
+    assert split_segments("") == []
+    assert "".join(split_segments("no markers\nat all")) == "no markers\nat all"
+
+
+def test_only_changed_segments_are_sent():
+    base = SegmentedContents.from_text(FILE_TEXT)
+    updated = SegmentedContents.from_text(FILE_TEXT.replace("print(x)", "print(x + 1)"))
+
+    new_segments = updated.new_segments_since(base)
+    assert list(new_segments.values()) == ["# %%\nprint(x + 1)\n"]
+
+    rebuilt = base.rebuild(updated.segment_hashes, new_segments, updated.version)
+    assert rebuilt == FILE_TEXT.replace("print(x)", "print(x + 1)")
+
+
+def test_rebuild_refuses_missing_segments():
+    base = SegmentedContents.from_text(FILE_TEXT)
+    updated = SegmentedContents.from_text(FILE_TEXT + "\n# %%\ny = 2\n")
+
+    assert base.rebuild(updated.segment_hashes, {}, updated.version) is None
+    assert base.rebuild(base.segment_hashes, {}, updated.version) is None
+
+
+class FakeNotebook:
+    """Plays the part of the notebook's sync handlers."""
+
+    def __init__(self):
+        self.synced = {}
+        self.last_applied = None
+        self.requests = []
+
+    def __call__(self, json_request):
+        self.requests.append(json_request)
+
+        if isinstance(json_request, SyncDigestRequest):
+            if self.last_applied is not None and self.last_applied.version == json_request.version:
+                self.synced[json_request.file_name] = self.last_applied
+                return {"status": SyncStatus.UNCHANGED.value}
+
+            return {"status": SyncStatus.FULL_SYNC_REQUIRED.value}
+
+        if isinstance(json_request, DeltaSyncRequest):
+            base = self.synced.get(json_request.file_name)
+            if base is None or base.version != json_request.base_version:
+                return {"status": SyncStatus.FULL_SYNC_REQUIRED.value}
+
+            contents = base.rebuild(json_request.segment_hashes, json_request.new_segments, json_request.version)
+        else:
+            contents = json_request.contents
+
+        self.synced[json_request.file_name] = self.last_applied = SegmentedContents.from_text(contents)
+        return {"status": SyncStatus.APPLIED.value}
+
+
+def test_client_sends_deltas_and_falls_back(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    notebook = FakeNotebook()
+
+    monkeypatch.setattr(sync, "request_notebook_command", notebook)
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+
+    sync_file.write_text(FILE_TEXT)
+    sync.sync_file(str(sync_file))
+
+    sync_file.write_text(FILE_TEXT + "\n# %%\ny = 2\n")
+    sync.sync_file(str(sync_file))
+
+    assert [type(x) for x in notebook.requests] == [SyncRequest, DeltaSyncRequest]
+    # The blank line we added belongs to the previous cell, so that one is sent again too.
+    assert list(notebook.requests[1].new_segments.values()) == ["# %%\nprint(x)\n\n", "# %%\ny = 2\n"]
+
+    # The notebook forgot what it had (e.g. the kernel restarted), so we need a full sync again.
+    notebook.synced.clear()
+    notebook.last_applied = None
+    sync.sync_file(str(sync_file))
+
+    assert [type(x) for x in notebook.requests[2:]] == [DeltaSyncRequest, SyncRequest]
+    assert notebook.synced[str(sync_file)].version == SegmentedContents.from_text(sync_file.read_text()).version
+
+
+def test_client_checks_digest_before_sending_contents(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    sync_file.write_text(FILE_TEXT)
+
+    notebook = FakeNotebook()
+    notebook.last_applied = SegmentedContents.from_text(FILE_TEXT)
+
+    monkeypatch.setattr(sync, "request_notebook_command", notebook)
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+
+    result = sync.sync_file(str(sync_file), check_digest=True)
+
+    assert result["status"] == SyncStatus.UNCHANGED.value
+    assert [type(x) for x in notebook.requests] == [SyncDigestRequest]
+
+    # Without asking for it, the contents are sent straight away.
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+    sync.sync_file(str(sync_file))
+
+    assert [type(x) for x in notebook.requests[1:]] == [SyncRequest]
@@ -0,0 +1,76 @@
+import random
+from difflib import SequenceMatcher
+from typing import List
+
+from jupyter_ascending.notebook.diff import diff_opcodes
+
+
+def _apply_opcodes(current: List, updated: List, opcodes: list) -> List:
+    result = []
+    position = 0
+    for tag, current_start, current_final, updated_start, updated_final in opcodes:
+        assert current_start == position
+        position = current_final
+
+        if tag == "equal":
+            assert current[current_start:current_final] == updated[updated_start:updated_final]
+
+        result.extend(updated[updated_start:updated_final])
+
+    assert position == len(current)
+    return result
+
+
+def test_random_sequences():
+    rng = random.Random(0)
+
+    for _ in range(1000):
+        current = [rng.randint(0, 5) for _ in range(rng.randint(0, 15))]
+        updated = [rng.randint(0, 5) for _ in range(rng.randint(0, 15))]
+
+        opcodes = diff_opcodes(current, updated, sequence_matcher_max_cells=0)
+        assert _apply_opcodes(current, updated, opcodes) == updated
+
+
+def test_single_edits_match_sequence_matcher():
+    rng = random.Random(0)
+
+    for _ in range(1000):
+        current = [f"cell {i}" for i in range(rng.randint(1, 30))]
+        updated = list(current)
+
+        edit = rng.choice(["insert", "delete", "replace", "move"])
+        index = rng.randrange(len(current))
+        if edit == "insert":
+            updated.insert(index, "new cell")
+        elif edit == "delete":
+            del updated[index]
+        elif edit == "replace":
+            updated[index] = "new cell"
+        else:
+            updated.insert(rng.randrange(len(updated)), updated.pop(index))
+
+        opcodes = diff_opcodes(current, updated, sequence_matcher_max_cells=0)
+        assert opcodes == SequenceMatcher(None, current, updated).get_opcodes()
+
+
+def test_small_notebooks_are_diffed_like_before():
+    rng = random.Random(0)
+
+    for _ in range(1000):
+        # Several edits, where the two diffs can disagree.
+        current = [rng.choice(["x = 1", "", "df.head()"]) if rng.random() < 0.2 else f"cell {i}" for i in range(30)]
+        updated = [x + " # edited" if rng.random() < 0.2 else x for x in current if rng.random() < 0.9]
+
+        assert diff_opcodes(current, updated) == SequenceMatcher(None, current, updated).get_opcodes()
+
+
+def test_out_of_time_is_still_correct():
+    # Nothing unique to anchor on, so this needs Myers, which gives up right away.
+    current = ["a", "b"] * 50
+    updated = ["b", "a", "a"] * 40
+
+    opcodes = diff_opcodes(current, updated, time_budget=0, sequence_matcher_max_cells=0)
+
+    assert _apply_opcodes(current, updated, opcodes) == updated
+    assert [x[0] for x in opcodes] == ["replace"]
@@ -1,3 +1,11 @@
+from jupyter_ascending._environment import SYNC_EXTENSION
+from jupyter_ascending.json_requests import ExecuteRequest
+from jupyter_ascending.json_requests import SyncAndExecuteRequest
+from jupyter_ascending.json_requests import SyncDigestRequest
+from jupyter_ascending.json_requests import SyncStatus
+from jupyter_ascending.requests import execute
+from jupyter_ascending.requests import sync
+from jupyter_ascending.requests.client_lib import RequestFailure
 from jupyter_ascending.requests.execute import _find_cell_number
 
 
@@ -52,3 +60,48 @@ print("world!")        # Line 21, Cell 1
     # Both return the last cell.
     assert _find_cell_number(lines, 23) == 1
     assert _find_cell_number(lines, 25) == 1
+
+
+def test_sync_and_execute_sends_one_request(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    sync_file.write_text("# %%\nx = 1\n# %%\ny = 2\n")
+
+    sent = []
+
+    def fake_request(json_request):
+        sent.append(json_request)
+        return {"status": SyncStatus.APPLIED.value, "executed": True, "cell_index": 1}
+
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+    monkeypatch.setattr(execute, "request_notebook_command", fake_request)
+
+    result = execute.sync_and_execute(str(sync_file), 4)
+
+    assert result["executed"] is True
+    assert [type(x) for x in sent] == [SyncAndExecuteRequest]
+    assert sent[0].line_number == 4
+    assert sent[0].contents == sync_file.read_text()
+    assert str(sync_file) in sync._LAST_SYNCED
+
+
+def test_sync_and_execute_falls_back_for_older_notebooks(tmp_path, monkeypatch):
+    sync_file = tmp_path / f"example.{SYNC_EXTENSION}.py"
+    sync_file.write_text("# %%\nx = 1\n# %%\ny = 2\n")
+
+    sent = []
+
+    def fake_request(json_request):
+        sent.append(json_request)
+        if isinstance(json_request, SyncAndExecuteRequest):
+            raise RequestFailure("JSONRPC request returned as failure: method not found")
+
+        return {"status": SyncStatus.APPLIED.value}
+
+    monkeypatch.setattr(sync, "_LAST_SYNCED", {})
+    monkeypatch.setattr(sync, "request_notebook_command", fake_request)
+    monkeypatch.setattr(execute, "request_notebook_command", fake_request)
+
+    execute.sync_and_execute(str(sync_file), 4)
+
+    assert [type(x) for x in sent] == [SyncAndExecuteRequest, SyncDigestRequest, ExecuteRequest]
+    assert sent[-1].cell_index == 1
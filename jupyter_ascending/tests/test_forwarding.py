@@ -0,0 +1,171 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+
+import pytest
+from aiohttp import ClientResponseError
+from jsonrpcserver import Success
+
+from jupyter_ascending import wire
+from jupyter_ascending.errors import UnableToFindNotebookException
+from jupyter_ascending.handlers import ServerMethods
+from jupyter_ascending.handlers import generate_request_handler
+from jupyter_ascending.handlers import server_extension
+from jupyter_ascending.handlers import start_server_in_thread
+from jupyter_ascending.handlers.server_extension import _clear_registered_servers
+from jupyter_ascending.handlers.server_extension import _close_session
+from jupyter_ascending.handlers.server_extension import _forward_to_notebook
+from jupyter_ascending.handlers.server_extension import _post_to_notebook
+from jupyter_ascending.handlers.server_extension import get_server_for_notebook
+from jupyter_ascending.handlers.server_extension import perform_notebook_request
+from jupyter_ascending.handlers.server_extension import register_notebook_server
+from jupyter_ascending.tests._helpers import NOTEBOOK_NAME
+
+# Set to let `wait` answer.
+_waiting = threading.Event()
+
+
+@pytest.fixture
+def notebook_server():
+    methods = ServerMethods("Test Start", "Test Close")
+
+    def echo(data):
+        return Success(data)
+
+    def wait(data):
+        _waiting.wait(timeout=10)
+        return Success(data)
+
+    methods.add(echo)
+    methods.add(wait)
+
+    server = start_server_in_thread(generate_request_handler("Test", methods))
+    _clear_registered_servers()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+    _clear_registered_servers()
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused(notebook_server, monkeypatch):
+    monkeypatch.setattr(server_extension, "connection_counters", server_extension.connection_counters.copy())
+    server_extension.connection_counters.clear()
+
+    await register_notebook_server(NOTEBOOK_NAME, notebook_server.server_address[1])
+
+    try:
+        for i in range(3):
+            result = await perform_notebook_request(NOTEBOOK_NAME, "echo", {"i": i})
+            assert result == Success({"i": i})
+    finally:
+        await _close_session()
+
+    assert server_extension.connection_counters == {"created": 1, "reused": 2}
+
+
+@pytest.mark.asyncio
+async def test_unreachable_notebook_is_an_error(notebook_server):
+    port = notebook_server.server_address[1]
+    notebook_server.shutdown()
+    notebook_server.server_close()
+
+    await register_notebook_server(NOTEBOOK_NAME, port)
+
+    try:
+        result = await perform_notebook_request(NOTEBOOK_NAME, "echo", {})
+    finally:
+        await _close_session()
+
+    assert result._error.code == 1
+    assert "Unable to reach notebook" in result._error.message
+
+    # The notebook is gone, so we stop routing to it.
+    with pytest.raises(UnableToFindNotebookException):
+        get_server_for_notebook(NOTEBOOK_NAME)
+
+
+@pytest.mark.asyncio
+async def test_requests_to_notebooks_are_compressed_once_they_say_they_can_read_it(notebook_server):
+    await register_notebook_server(NOTEBOOK_NAME, notebook_server.server_address[1])
+    data = {"contents": "print('hello')\n" * 1000}
+
+    try:
+        assert await perform_notebook_request(NOTEBOOK_NAME, "echo", data) == Success(data)
+        assert server_extension._NOTEBOOK_WIRE_FORMATS[get_server_for_notebook(NOTEBOOK_NAME)].content_encoding in (
+            wire.GZIP,
+            wire.ZSTD,
+        )
+
+        assert await perform_notebook_request(NOTEBOOK_NAME, "echo", data) == Success(data)
+    finally:
+        await _close_session()
+
+
+@pytest.mark.asyncio
+async def test_output_streams_dont_use_up_connections(notebook_server, monkeypatch):
+    monkeypatch.setattr(server_extension, "KERNEL_CONNECTIONS_PER_NOTEBOOK", 1)
+    _waiting.clear()
+
+    await register_notebook_server(NOTEBOOK_NAME, notebook_server.server_address[1])
+
+    try:
+        # Like reading the output of a cell that is still running.
+        stream = asyncio.ensure_future(_forward_to_notebook(NOTEBOOK_NAME, "wait", {}, streaming=True))
+        await asyncio.sleep(0.1)
+
+        result = await asyncio.wait_for(perform_notebook_request(NOTEBOOK_NAME, "echo", {"i": 1}), timeout=5)
+        assert result == Success({"i": 1})
+        assert not stream.done()
+
+        _waiting.set()
+        assert await stream == {}
+    finally:
+        _waiting.set()
+        await _close_session()
+
+
+@pytest.mark.parametrize("status, expected_encodings", [(415, [wire.GZIP, None]), (500, [wire.GZIP])])
+@pytest.mark.asyncio
+async def test_only_unreadable_bodies_are_sent_again_as_plain_json(status, expected_encodings):
+    encodings = []
+
+    class RejectingHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            encodings.append(self.headers["Content-Encoding"])
+
+            if self.headers["Content-Encoding"] is None:
+                body = json.dumps({"jsonrpc": "2.0", "result": {}, "id": 1}).encode()
+                self.send_response(200)
+            else:
+                body = b""
+                self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = HTTPServer(("localhost", 0), RejectingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://localhost:{server.server_address[1]}"
+    server_extension._NOTEBOOK_WIRE_FORMATS[url] = wire.WireFormat(content_encoding=wire.GZIP)
+    json_rpc_request = {"jsonrpc": "2.0", "method": "echo", "params": {"contents": "x" * 2000}, "id": 1}
+
+    try:
+        if status == wire.UNREADABLE_BODY_STATUS:
+            assert await _post_to_notebook(url, json_rpc_request) == {"jsonrpc": "2.0", "result": {}, "id": 1}
+        else:
+            # Anything else is a real error, and sending it again could run it twice.
+            with pytest.raises(ClientResponseError):
+                await _post_to_notebook(url, json_rpc_request)
+    finally:
+        await _close_session()
+        server_extension._NOTEBOOK_WIRE_FORMATS.pop(url, None)
+        server.shutdown()
+        server.server_close()
+
+    assert encodings == expected_encodings
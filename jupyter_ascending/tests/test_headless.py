@@ -0,0 +1,157 @@
+import os
+from typing import Any
+from typing import Dict
+from typing import List
+
+import jupytext
+import nbformat
+import pytest
+
+from jupyter_ascending.handlers import jupyter_notebook
+from jupyter_ascending.handlers.headless import HeadlessNotebook
+from jupyter_ascending.json_requests import SyncStatus
+from jupyter_ascending.tests._helpers import FILE_TEXT
+from jupyter_ascending.tests._helpers import FakeShell
+
+
+class FakeKernelShell(FakeShell):
+    """A `FakeShell` that runs cells from their source, like IPython does."""
+
+    def __init__(self):
+        super().__init__()
+        self.execution_count = 1
+        self.namespace: Dict[str, Any] = {"display": self.display}
+
+    def run_cell(self, source: str, store_history: bool = False) -> Any:
+        def body():
+            *statements, last = source.strip().splitlines()
+            exec("\n".join(statements), self.namespace)
+            try:
+                return eval(last, self.namespace)
+            except SyntaxError:
+                exec(last, self.namespace)
+
+        result = type("ExecutionResult", (), {"error_before_exec": None, "error_in_exec": None, "result": None})()
+        self.callbacks["pre_run_cell"](None)
+        try:
+            result.result = body()
+        except Exception as e:
+            result.error_in_exec = e
+        self.callbacks["post_run_cell"](result)
+
+        result.success = result.error_in_exec is None
+        self.execution_count += 1
+
+        return result
+
+
+@pytest.fixture
+def make_notebook(install, tmp_path):
+    mirrored: List[Dict[str, Any]] = []
+
+    def _make_notebook() -> HeadlessNotebook:
+        shell = install(FakeKernelShell)
+        notebook = HeadlessNotebook(
+            str(tmp_path / "example.sync.ipynb"), shell, mirror=mirrored.append, run_soon=lambda f, *args: f(*args)
+        )
+        notebook.mirrored = mirrored
+        return notebook
+
+    return _make_notebook
+
+
+def _cells(*sources: str) -> Any:
+    return jupytext.reads("\n\n".join(f"# %%\n{x}" for x in sources), fmt="py:percent")
+
+
+def test_execute_records_outputs(make_notebook):
+    notebook = make_notebook()
+    notebook.sync(_cells("x = 1\nprint('hello')", "x + 1", "display('shown')", "1 / 0"))
+
+    notebook.execute_range(0, None, stop_on_error=False)
+
+    outputs = [x.outputs for x in notebook.notebook.cells]
+    assert outputs[0] == [nbformat.v4.new_output("stream", name="stdout", text="hello\n")]
+    assert outputs[1] == [nbformat.v4.new_output("execute_result", data={"text/plain": "2"}, execution_count=2)]
+    assert outputs[2][0]["output_type"] == "display_data"
+    assert outputs[3][0]["ename"] == "ZeroDivisionError"
+    assert [x.execution_count for x in notebook.notebook.cells] == [1, 2, 3, 4]
+
+    assert [(x["command"], x["cell_number"]) for x in notebook.mirrored] == [("set_outputs", i) for i in range(4)]
+
+
+def test_execute_keeps_all_of_the_output(make_notebook):
+    notebook = make_notebook()
+    notebook.sync(_cells("print('x' * 1_100_000)"))
+
+    notebook.execute_range(0, None)
+
+    assert notebook.notebook.cells[0].outputs[0]["text"] == "x" * 1_100_000 + "\n"
+
+
+def test_execute_range_stops_on_error(make_notebook):
+    notebook = make_notebook()
+    notebook.sync(_cells("1 / 0", "print('never')"))
+
+    done = []
+    notebook.execute_range(0, 1, on_cell_done=lambda *x: done.append(x), on_complete=lambda: done.append("complete"))
+
+    assert done == [(0, "error"), "complete"]
+    assert notebook.notebook.cells[1].outputs == []
+
+
+def test_sync_keeps_outputs_of_unchanged_cells(make_notebook):
+    notebook = make_notebook()
+    notebook.sync(_cells("print('first')", "print('second')"))
+    notebook.execute_range(0, None)
+    first_id = notebook.notebook.cells[0]["id"]
+
+    notebook.sync(_cells("print('first')", "print('changed')", "print('new')"))
+
+    cells = notebook.notebook.cells
+    assert [x.source for x in cells] == ["print('first')", "print('changed')", "print('new')"]
+    assert cells[0]["id"] == first_id
+    assert cells[0].outputs[0]["text"] == "first\n"
+    assert cells[2].outputs == []
+
+
+def test_save_writes_only_when_changed(make_notebook):
+    notebook = make_notebook()
+    notebook.save()
+    assert not os.path.exists(notebook.path)
+
+    notebook.sync(_cells("print('saved')"))
+    notebook.execute_range(0, None)
+    notebook.save()
+
+    saved = nbformat.read(notebook.path, as_version=4)
+    assert saved.cells[0].outputs[0]["text"] == "saved\n"
+
+    # Loading it again keeps the outputs.
+    assert HeadlessNotebook(notebook.path, notebook.shell, mirror=print, run_soon=print).notebook == saved
+
+
+def test_handlers_work_without_a_frontend(make_notebook, monkeypatch):
+    notebook = make_notebook()
+    monkeypatch.setattr(jupyter_notebook, "_headless", notebook)
+    monkeypatch.setattr(jupyter_notebook, "_comm", None)
+    monkeypatch.setattr(jupyter_notebook, "_last_applied", None)
+    monkeypatch.setattr(jupyter_notebook, "_SYNCED_CONTENTS", {})
+    monkeypatch.setattr(jupyter_notebook, "_LINE_INDEXES", {})
+    monkeypatch.setattr(jupyter_notebook, "_RANGE_EXECUTIONS", {})
+
+    data = {"file_name": "example.sync.py", "contents": FILE_TEXT, "line_number": 2}
+    result = jupyter_notebook.handle_sync_and_execute_request(data)._value.result
+
+    assert result["status"] == SyncStatus.APPLIED.value
+    assert result["executed"] is True
+    assert [x.source for x in notebook.notebook.cells] == ["x = 1", "Some words", "print(x)"]
+    assert notebook.notebook.cells[0].execution_count == 1
+
+    data = {"file_name": "example.sync.py", "start_cell": 1, "end_cell": None}
+    request_id = jupyter_notebook.handle_execute_range_request(data)._value.result["request_id"]
+
+    execution = jupyter_notebook._RANGE_EXECUTIONS[request_id]
+    assert execution.cell_status == {1: "ok", 2: "ok"}
+    assert execution.complete
+    assert notebook.notebook.cells[2].outputs[0]["text"] == "1\n"
@@ -0,0 +1,31 @@
+import subprocess
+import sys
+
+import pytest
+
+from jupyter_ascending.handlers.server_extension import perform_notebook_request
+from jupyter_ascending.json_requests import PERFORM_NOTEBOOK_REQUEST
+
+HEAVY_MODULES = ["notebook", "ipykernel", "jupytext", "aiohttp", "tornado", "jsonrpcserver"]
+
+
+def test_client_method_name_matches_server():
+    assert PERFORM_NOTEBOOK_REQUEST == perform_notebook_request.__name__
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "jupyter_ascending",
+        "jupyter_ascending.requests.sync",
+        "jupyter_ascending.requests.execute",
+        "jupyter_ascending.requests.execute_range",
+        "jupyter_ascending.requests.restart",
+        "jupyter_ascending.requests.coprocess",
+    ],
+)
+def test_clients_do_not_import_jupyter(module):
+    script = f"import sys; import {module}; print(' '.join(sorted(sys.modules)))"
+    loaded = set(subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout.split())
+
+    assert [x for x in HEAVY_MODULES if x in loaded] == []
@@ -0,0 +1,118 @@
+import random
+from typing import List
+
+import jupytext
+
+from jupyter_ascending.notebook.line_index import build_line_index
+from jupyter_ascending.requests import line_index
+from jupyter_ascending.requests.line_index import find_cell_number
+
+HEADER = """# ---
+# jupyter:
+#   jupytext:
+#     formats: py:percent
+#   kernelspec:
+#     display_name: Python 3
+#     language: python
+#     name: python3
+# ---
+
+"""
+
+CELL_LINES = [
+    "x = 1",
+    "",
+    "print(x)",
+    '"""',
+    "# %% not a cell in a string",
+    '"""',
+    "```",
+    "# %% [markdown] not a cell in a fence",
+]
+
+
+def _random_cell(rng: random.Random) -> List[str]:
+    marker = rng.choice(["# %%", "# %% [markdown]", "# %% tags=['x']"])
+    body = [rng.choice(CELL_LINES) if marker == "# %%" else "# " + rng.choice(CELL_LINES)]
+    return [marker] + [x for _ in range(rng.randint(0, 30)) for x in body]
+
+
+def _random_file(rng: random.Random) -> List[str]:
+    lines = HEADER.splitlines(keepends=True) if rng.random() < 0.5 else []
+    for _ in range(rng.randint(0, 12)):
+        lines.extend(x + "\n" for x in _random_cell(rng))
+
+    return lines
+
+
+def _find_cell_number_by_reading(lines: List[str], line_number: int) -> int:
+    """How execute used to find the cell: read cells one by one until we're past the line."""
+    text = "\n".join(lines)
+    conv = jupytext.jupytext.TextNotebookConverter(jupytext.formats.divine_format(text), None)
+    (metadata, _, _, pos) = jupytext.header.header_to_metadata_and_cell(
+        lines,
+        conv.implementation.header_prefix,
+        conv.implementation.extension,
+        conv.fmt.get("root_level_metadata_as_raw_cell", True),
+    )
+    conv.update_fmt_with_notebook_options(metadata, read=True)
+    default_language = jupytext.languages.default_language_from_metadata_and_ext(
+        metadata, conv.implementation.extension
+    )
+
+    lines = lines[pos:]
+    num_lines_read, cell_number = pos, 0
+    reader = conv.implementation.cell_reader_class(conv.fmt, default_language)
+    while lines and num_lines_read < line_number:
+        _, pos = reader.read(lines)
+        num_lines_read += pos
+        cell_number += 1
+        lines = lines[pos:]
+    return max(0, cell_number - 1)
+
+
+def test_same_cells_as_reading_one_by_one():
+    rng = random.Random(0)
+
+    for _ in range(20):
+        lines = _random_file(rng)
+        index = build_line_index(lines)
+
+        for line_number in {0, 1, len(lines), len(lines) + 1} | set(index.ends) | {x + 1 for x in index.ends}:
+            assert index.cell_for_line(line_number) == _find_cell_number_by_reading(lines, line_number)
+
+
+def test_incremental_rebuild_matches_full_rebuild():
+    rng = random.Random(1)
+
+    for _ in range(50):
+        lines = _random_file(rng)
+        previous = build_line_index(lines)
+
+        # Replace a few lines somewhere with a few new cells.
+        start = rng.randint(0, len(lines))
+        end = rng.randint(start, min(len(lines), start + 20))
+        new_lines = [x + "\n" for _ in range(rng.randint(0, 2)) for x in _random_cell(rng)]
+        lines = lines[:start] + new_lines + lines[end:]
+
+        assert build_line_index(lines, previous) == build_line_index(lines)
+
+
+def test_index_is_cached_by_mtime_and_size(tmp_path, monkeypatch):
+    sync_file = tmp_path / "example.sync.py"
+    sync_file.write_text("# %%\nx = 1\n\n# %%\ny = 2\n")
+    assert find_cell_number(str(sync_file), 4) == 1
+
+    # A new process has nothing in memory, but finds the index on disk.
+    monkeypatch.setattr(line_index, "_INDEXES", {})
+    monkeypatch.setattr(line_index, "build_line_index", None)
+    assert find_cell_number(str(sync_file), 4) == 1
+
+
+def test_index_is_rebuilt_when_the_file_changes(tmp_path):
+    sync_file = tmp_path / "example.sync.py"
+    sync_file.write_text("# %%\nx = 1\n\n# %%\ny = 2\n")
+    assert find_cell_number(str(sync_file), 4) == 1
+
+    sync_file.write_text("# %%\nx = 1\n\n# %%\ny = 2\n\n# %%\nz = 3\n")
+    assert find_cell_number(str(sync_file), 7) == 2
@@ -0,0 +1,75 @@
+import io
+import os
+import sys
+import time
+
+import pytest
+from loguru import logger
+
+from jupyter_ascending import logger as logger_module
+from jupyter_ascending.logger import PayloadSummary
+from jupyter_ascending.logger import remove_old_logs
+from jupyter_ascending.logger import setup_logger
+from jupyter_ascending.logger import summarize
+
+
+@pytest.fixture
+def log_directory(monkeypatch, tmp_path):
+    monkeypatch.setattr(logger_module, "LOG_DIRECTORY", str(tmp_path))
+
+    yield tmp_path
+
+    logger.remove()
+    logger.add(sys.stderr)
+
+
+def test_long_strings_are_summarized():
+    contents = "print('hello')\n" * 100000
+
+    text = str(summarize({"method": "sync", "params": {"contents": contents, "file_name": "a.sync.py"}}))
+
+    assert "'method': 'sync'" in text
+    assert "'file_name': 'a.sync.py'" in text
+    assert f"<str of length {len(contents)}, sha1 " in text
+    assert len(text) < 200
+
+
+def test_summaries_are_cut_off():
+    text = str(PayloadSummary(list(range(100000)), max_chars=100))
+
+    assert text.startswith("[0, 1, 2")
+    assert len(text) == 103
+
+
+def test_summaries_are_only_made_if_logged(log_directory, monkeypatch):
+    setup_logger(stream=io.StringIO())
+    monkeypatch.setattr(PayloadSummary, "__str__", lambda self: pytest.fail("Summarized a filtered message"))
+
+    logger.trace("{}", summarize({"x": 1}))
+
+
+def test_each_kernel_logs_to_its_own_file(log_directory):
+    setup_logger(stream=io.StringIO(), process_name="kernel")
+    logger.info("hello {}", summarize("x" * 1000))
+    logger.complete()
+
+    log_file = log_directory / f"log.kernel.{os.getpid()}.log"
+    assert "hello <str of length 1000" in log_file.read_text()
+
+
+def test_clients_share_a_log_file(log_directory):
+    old_log = log_directory / "log.kernel.1.log"
+    old_log.write_text("old")
+    os.utime(old_log, (time.time() - 30 * 24 * 60 * 60,) * 2)
+
+    for i in range(2):
+        setup_logger(stream=io.StringIO())
+        logger.info("client {}", i)
+
+    assert [x.name for x in log_directory.glob("log.client*")] == ["log.client.log"]
+    assert "client 1" in (log_directory / "log.client.log").read_text()
+    # Cleaning up is left to the server.
+    assert old_log.exists()
+
+    remove_old_logs()
+    assert not old_log.exists()
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from jupyter_ascending.notebook.data_types import JupyterCell
+from jupyter_ascending.notebook.data_types import NotebookContents
+from jupyter_ascending.notebook.merge import JaroWinklerDistance
+from jupyter_ascending.notebook.merge import LevenshteinDistance
+from jupyter_ascending.notebook.merge import TokenSetDistance
+from jupyter_ascending.notebook.merge import merge_cell_contents
+
+DISTANCERS = [LevenshteinDistance, JaroWinklerDistance, TokenSetDistance]
+
+WORDS = ["x", "y", "df", "print", "(", ")", " = ", " + ", "1", "22", "\n", "plot"]
+
+
+def _random_source(rng: random.Random) -> str:
+    return "".join(rng.choice(WORDS) for _ in range(rng.randint(0, 8)))
+
+
+def _notebook(sources) -> NotebookContents:
+    return NotebookContents(
+        cells=[JupyterCell(cell_type="code", index=i, source=[x], output=[str(i)]) for i, x in enumerate(sources)]
+    )
+
+
+@pytest.mark.parametrize("distancer", DISTANCERS)
+def test_bounds_are_lower_bounds(distancer):
+    rng = random.Random(0)
+
+    for _ in range(2000):
+        string_1 = _random_source(rng)
+        string_2 = _random_source(rng)
+        signature_1 = distancer.signature(string_1)
+        signature_2 = distancer.signature(string_2)
+
+        distance = distancer.find_distance(string_1, string_2)
+        gap = abs(distancer.bucket_key(signature_1) - distancer.bucket_key(signature_2))
+
+        assert distancer.key_gap_bound(gap) <= distance + 1e-9
+        assert distancer.lower_bound(signature_1, signature_2) <= distance + 1e-9
+
+        bounded = distancer.find_bounded_distance(string_1, string_2, 1)
+        assert bounded == distance if distance <= 1 else bounded > 1
+
+
+@pytest.mark.parametrize("distancer", DISTANCERS)
+def test_pruning_gives_the_same_merge(distancer):
+    rng = random.Random(0)
+
+    for _ in range(300):
+        current = _notebook([_random_source(rng) for _ in range(rng.randint(0, 10))])
+        updated = _notebook([_random_source(rng) for _ in range(rng.randint(0, 10))])
+
+        assert merge_cell_contents(current, updated, distancer, prune=True) == merge_cell_contents(
+            current, updated, distancer, prune=False
+        )
+
+
+def test_edited_cells_keep_their_output():
+    current = _notebook(["import numpy as np", "x = np.arange(10)", "x.sum()"])
+    updated = _notebook(["x = np.arange(10)", "import numpy as np", "x.mean()"])
+
+    merged, _ = merge_cell_contents(current, updated)
+
+    assert [x.output for x in merged.cells] == [("1",), ("0",), ("2",)]
+    assert [x.joined_source for x in merged.cells] == ["x = np.arange(10)", "import numpy as np", "x.mean()"]
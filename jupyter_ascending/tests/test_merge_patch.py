@@ -0,0 +1,75 @@
+import random
+from typing import List
+from typing import Tuple
+
+from jupyter_ascending.handlers.jupyter_notebook import compile_patch
+from jupyter_ascending.notebook.data_types import JupyterCell
+from jupyter_ascending.notebook.data_types import NotebookContents
+from jupyter_ascending.notebook.merge import opcode_merge_cell_contents
+
+
+def _apply_patch(cells: List[Tuple[str, str]], patch: list) -> List[Tuple[str, str]]:
+    """Does what `apply_patch` in extension.js does to a notebook."""
+    cells = list(cells)
+
+    for operation in patch:
+        if operation["command"] == "op_code__delete_cells":
+            for cell_index in sorted(operation["cell_indices"], reverse=True):
+                del cells[cell_index]
+
+        elif operation["command"] == "op_code__insert_cell":
+            cells.insert(operation["cell_number"], (operation["cell_type"], operation["cell_contents"]))
+
+        elif operation["command"] == "op_code__replace_cell":
+            while len(cells) <= operation["cell_number"]:
+                cells.append(("code", ""))
+
+            cells[operation["cell_number"]] = (operation["cell_type"], operation["cell_contents"])
+
+    return cells
+
+
+def _notebook(sources: List[str]) -> NotebookContents:
+    return NotebookContents(
+        cells=[JupyterCell(cell_type="code", index=i, source=[x], output=None) for i, x in enumerate(sources)]
+    )
+
+
+def _check_patch(current: List[str], updated: List[str]) -> list:
+    current_notebook = _notebook(current)
+    updated_notebook = _notebook(updated)
+
+    opcodes = opcode_merge_cell_contents(current_notebook, updated_notebook)
+    patch = compile_patch(opcodes, current_notebook, updated_notebook)
+
+    assert _apply_patch([("code", x) for x in current], patch) == [("code", x) for x in updated]
+
+    return patch
+
+
+def test_no_changes_is_an_empty_patch():
+    assert _check_patch(["a", "b"], ["a", "b"]) == []
+
+
+def test_pasting_many_cells_is_one_patch():
+    updated = ["a"] + [f"pasted_{i}" for i in range(200)] + ["b"]
+
+    patch = _check_patch(["a", "b"], updated)
+
+    assert len(patch) == 200
+    assert all(x["command"] == "op_code__insert_cell" for x in patch)
+
+
+def test_moving_cells_applies_cleanly():
+    # Moves produce copy_output opcodes, which don't change any cells.
+    _check_patch(["a", "b", "c", "d"], ["c", "a", "b", "d"])
+
+
+def test_random_edits_apply_cleanly():
+    rng = random.Random(0)
+
+    for _ in range(500):
+        current = [f"x = {rng.randint(0, 6)}" for _ in range(rng.randint(0, 8))]
+        updated = [f"x = {rng.randint(0, 6)}" for _ in range(rng.randint(0, 8))]
+
+        _check_patch(current, updated)
@@ -0,0 +1,108 @@
+import pytest
+from jsonrpcserver import Success
+
+from jupyter_ascending import metrics
+from jupyter_ascending.handlers import ServerMethods
+from jupyter_ascending.handlers import generate_request_handler
+from jupyter_ascending.handlers import jupyter_notebook
+from jupyter_ascending.handlers import server_extension
+from jupyter_ascending.handlers import start_server_in_thread
+from jupyter_ascending.handlers.server_extension import _clear_registered_servers
+from jupyter_ascending.handlers.server_extension import _close_session
+from jupyter_ascending.handlers.server_extension import perform_notebook_request
+from jupyter_ascending.handlers.server_extension import register_notebook_server
+from jupyter_ascending.json_requests import SyncStatus
+from jupyter_ascending.tests._helpers import FILE_TEXT
+from jupyter_ascending.tests._helpers import NOTEBOOK_NAME
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics(monkeypatch):
+    monkeypatch.setattr(metrics, "_counters", {})
+    monkeypatch.setattr(metrics, "_histograms", {})
+
+
+def _stage_counts(data):
+    return {labels["stage"]: sum(values[:-1]) for name, labels, values in data["histograms"] if name == "stage_seconds"}
+
+
+def test_render_prometheus_text():
+    metrics.increment("syncs_total", status="applied")
+    metrics.increment("syncs_total", status="applied")
+    metrics.observe_stage("merge", 0.003)
+    metrics.observe_stage("merge", 100)
+
+    text = metrics.render(metrics.snapshot())
+
+    assert "# TYPE jupyter_ascending_syncs_total counter" in text
+    assert 'jupyter_ascending_syncs_total{status="applied"} 2' in text
+    assert "# TYPE jupyter_ascending_stage_seconds histogram" in text
+    assert 'jupyter_ascending_stage_seconds_bucket{le="0.0025",stage="merge"} 0' in text
+    assert 'jupyter_ascending_stage_seconds_bucket{le="0.005",stage="merge"} 1' in text
+    assert 'jupyter_ascending_stage_seconds_bucket{le="+Inf",stage="merge"} 2' in text
+    assert 'jupyter_ascending_stage_seconds_sum{stage="merge"} 100.003' in text
+    assert 'jupyter_ascending_stage_seconds_count{stage="merge"} 2' in text
+
+
+def test_snapshots_add_up():
+    metrics.increment("syncs_total", 3, status="applied")
+    metrics.observe_stage("sync", 0.5)
+    data = metrics.snapshot()
+
+    combined = metrics.combine([data, data, {"histograms": [["stage_seconds", {"stage": "sync"}, [1, 2]]]}])
+
+    assert combined["counters"] == [["syncs_total", {"status": "applied"}, 6]]
+    assert _stage_counts(combined) == {"sync": 2}
+
+
+def test_timings_round_trip():
+    header = metrics.format_timings([("client_read", 0.0125), ("server", 1.5)])
+
+    assert metrics.parse_timings(header) == [("client_read", 0.0125), ("server", 1.5)]
+    assert metrics.parse_timings("junk, ;dur=3, x;dur=nope, y;desc=z;dur=2") == [("y", 0.002)]
+    assert metrics.server_seconds({"Server-Timing": header}) == 1.5
+
+
+def test_sync_records_each_stage(frontend):  # noqa: F811
+    result = jupyter_notebook.sync_contents("example.sync.py", FILE_TEXT)
+    assert result["status"] == SyncStatus.APPLIED.value
+
+    data = metrics.snapshot()
+    assert _stage_counts(data) == {"sync": 1, "kernel_parse": 1, "frontend_round_trip": 1, "merge": 1, "apply": 1}
+    assert ["cells_changed_total", {}, 3] in data["counters"]
+    assert ["syncs_total", {"status": "applied"}, 1] in data["counters"]
+
+
+@pytest.mark.asyncio
+async def test_server_collects_metrics_from_notebooks():
+    methods = ServerMethods("Test Start", "Test Close")
+
+    def GetStatusRequest(data):
+        return Success(data)
+
+    def GetMetricsRequest(data):
+        return Success({"counters": [["syncs_total", {"status": "applied"}, 5]], "histograms": []})
+
+    methods.add(GetStatusRequest)
+    methods.add(GetMetricsRequest)
+
+    server = start_server_in_thread(generate_request_handler("Test", methods))
+    _clear_registered_servers()
+    await register_notebook_server(NOTEBOOK_NAME, server.server_address[1])
+
+    try:
+        await perform_notebook_request(NOTEBOOK_NAME, "GetStatusRequest", {})
+        await perform_notebook_request(NOTEBOOK_NAME, "made up", {})
+        notebook_metrics = await server_extension._get_notebook_metrics(server.server_address[1], NOTEBOOK_NAME)
+    finally:
+        await _close_session()
+        server.shutdown()
+        server.server_close()
+        _clear_registered_servers()
+
+    combined = metrics.combine([metrics.snapshot(), notebook_metrics])
+    assert ["syncs_total", {"status": "applied"}, 5] in combined["counters"]
+    assert ["requests_total", {"command": "GetStatusRequest"}, 1] in combined["counters"]
+    # Clients can't make up labels.
+    assert ["requests_total", {"command": "unknown"}, 1] in combined["counters"]
+    assert _stage_counts(combined) == {"route": 2, "kernel_http": 2}
@@ -0,0 +1,180 @@
+from jupyter_ascending.handlers import jupyter_notebook
+from jupyter_ascending.handlers import output_stream
+from jupyter_ascending.handlers.simulated_frontend import SimulatedFrontend
+from jupyter_ascending.json_requests import SyncStatus
+from jupyter_ascending.tests._helpers import FILE_TEXT
+
+
+def test_sync_updates_frontend(frontend):
+    result = jupyter_notebook.sync_contents("example.sync.py", FILE_TEXT)
+
+    assert result["status"] == SyncStatus.APPLIED.value
+    assert frontend.cells == [("code", "x = 1"), ("markdown", "Some words"), ("code", "print(x)")]
+
+    # Nothing changed, so nothing should be sent to the frontend.
+    frontend.received.clear()
+    result = jupyter_notebook.sync_contents("other_client.sync.py", FILE_TEXT)
+
+    assert result["status"] == SyncStatus.UNCHANGED.value
+    assert frontend.received == []
+
+
+def test_sync_waits_for_a_slow_frontend(frontend):
+    slow_frontend = SimulatedFrontend(cells=[("code", "x = 0")], latency=0.01)
+    jupyter_notebook.attach_comm_handlers(slow_frontend)
+    jupyter_notebook.set_comm(slow_frontend)
+
+    try:
+        result = jupyter_notebook.sync_contents("example.sync.py", FILE_TEXT)
+    finally:
+        slow_frontend.close()
+
+    assert result["status"] == SyncStatus.APPLIED.value
+    assert slow_frontend.cells == [("code", "x = 1"), ("markdown", "Some words"), ("code", "print(x)")]
+
+
+def test_sync_times_out_without_frontend(frontend, monkeypatch):
+    monkeypatch.setattr(jupyter_notebook, "SYNC_TIMEOUT", 0.01)
+    monkeypatch.setattr(frontend, "send", frontend.received.append)
+
+    result = jupyter_notebook.sync_contents("example.sync.py", FILE_TEXT)
+
+    assert result["status"] == SyncStatus.TIMED_OUT.value
+    assert jupyter_notebook._last_applied is None
+    assert jupyter_notebook._PENDING_MERGES == {}
+
+
+def test_new_comm_replaces_old_one(frontend):
+    assert jupyter_notebook.get_comm() is frontend
+
+    reloaded_frontend = SimulatedFrontend()
+    jupyter_notebook.attach_comm_handlers(reloaded_frontend)
+    jupyter_notebook.set_comm(reloaded_frontend)
+
+    assert frontend.closed
+    assert jupyter_notebook.get_comm() is reloaded_frontend
+
+
+def test_reloaded_frontend_gets_the_contents_again(frontend):
+    jupyter_notebook.sync_contents("example.sync.py", FILE_TEXT)
+
+    # The reloaded page shows the notebook as it was saved, before the sync.
+    reloaded_frontend = SimulatedFrontend()
+    jupyter_notebook.attach_comm_handlers(reloaded_frontend)
+    jupyter_notebook.set_comm(reloaded_frontend)
+
+    result = jupyter_notebook.sync_contents("example.sync.py", FILE_TEXT)
+
+    assert result["status"] == SyncStatus.APPLIED.value
+    assert reloaded_frontend.received[0]["command"] == "start_sync_notebook"
+    assert reloaded_frontend.cells == [("code", "x = 1"), ("markdown", "Some words"), ("code", "print(x)")]
+
+
+def test_sync_and_execute_executes_the_synced_cell(frontend, monkeypatch):
+    monkeypatch.setattr(jupyter_notebook, "_LINE_INDEXES", {})
+
+    data = {"file_name": "example.sync.py", "contents": FILE_TEXT, "line_number": 8}
+    result = jupyter_notebook.handle_sync_and_execute_request(data)._value.result
+
+    assert result["status"] == SyncStatus.APPLIED.value
+    assert result["executed"] is True
+    assert result["cell_index"] == 2
+    assert frontend.cells == [("code", "x = 1"), ("markdown", "Some words"), ("code", "print(x)")]
+    assert frontend.received[-1] == {"command": "execute", "cell_number": 2}
+
+    # The same line after a cell was added above it.
+    data["contents"] = "# %%\nimport os\n\n" + FILE_TEXT
+    data["line_number"] = 11
+    result = jupyter_notebook.handle_sync_and_execute_request(data)._value.result
+
+    assert result["cell_index"] == 3
+    assert frontend.received[-1] == {"command": "execute", "cell_number": 3}
+
+
+def test_sync_and_execute_arms_the_output_stream_it_was_given(frontend, monkeypatch):
+    monkeypatch.setattr(jupyter_notebook, "_LINE_INDEXES", {})
+    monkeypatch.setattr(output_stream, "_BUFFERS", {})
+    monkeypatch.setattr(output_stream, "_ARMED", output_stream.deque())
+
+    output_stream.watch("a")
+    assert list(output_stream._ARMED) == []
+
+    def send(data):
+        if data["command"] == "execute":
+            # Armed by the time the frontend is asked to execute the cell.
+            assert list(output_stream._ARMED) == ["a"]
+        SimulatedFrontend.send(frontend, data)
+
+    monkeypatch.setattr(frontend, "send", send)
+
+    data = {"file_name": "example.sync.py", "contents": FILE_TEXT, "line_number": 8, "stream_id": "a"}
+    result = jupyter_notebook.handle_sync_and_execute_request(data)._value.result
+
+    assert result["executed"] is True
+    assert frontend.received[-1] == {"command": "execute", "cell_number": 2}
+
+
+def test_sync_and_execute_does_not_execute_after_timeout(frontend, monkeypatch):
+    monkeypatch.setattr(jupyter_notebook, "SYNC_TIMEOUT", 0.01)
+    monkeypatch.setattr(frontend, "send", frontend.received.append)
+
+    data = {"file_name": "example.sync.py", "contents": FILE_TEXT, "line_number": 8}
+    result = jupyter_notebook.handle_sync_and_execute_request(data)._value.result
+
+    assert result["status"] == SyncStatus.TIMED_OUT.value
+    assert result["executed"] is False
+    assert [x["command"] for x in frontend.received] == ["start_sync_notebook"]
+
+
+def test_execute_range_records_progress(frontend, monkeypatch):
+    monkeypatch.setattr(jupyter_notebook, "_RANGE_EXECUTIONS", {})
+
+    data = {"file_name": "example.sync.py", "start_cell": 1, "end_cell": None, "stop_on_error": True}
+    result = jupyter_notebook.handle_execute_range_request(data)._value.result
+
+    request_id = result["request_id"]
+    assert frontend.received[-1] == {
+        "command": "execute_range",
+        "request_id": request_id,
+        "start_cell": 1,
+        "end_cell": None,
+        "stop_on_error": True,
+    }
+
+    frontend.reply({"command": "execute_range_progress", "request_id": request_id, "cell_number": 1, "status": "ok"})
+    frontend.reply({"command": "execute_range_progress", "request_id": request_id, "cell_number": 2, "status": "error"})
+    frontend.reply({"command": "execute_range_complete", "request_id": request_id})
+
+    execution = jupyter_notebook._RANGE_EXECUTIONS[request_id]
+    assert execution.cell_status == {1: "ok", 2: "error"}
+    assert execution.complete
+    assert execution.error is None
+
+
+def test_execute_range_records_why_the_frontend_gave_up(frontend, monkeypatch):
+    monkeypatch.setattr(jupyter_notebook, "_RANGE_EXECUTIONS", {})
+
+    data = {"file_name": "example.sync.py", "start_cell": 0, "end_cell": None, "stop_on_error": False}
+    request_id = jupyter_notebook.handle_execute_range_request(data)._value.result["request_id"]
+
+    # The kernel was interrupted partway through the first cell, then restarted.
+    progress = {"command": "execute_range_progress", "request_id": request_id, "cell_number": 0, "status": "aborted"}
+    frontend.reply(progress)
+    frontend.reply({"command": "execute_range_complete", "request_id": request_id, "error": "kernel restarted"})
+
+    execution = jupyter_notebook._RANGE_EXECUTIONS[request_id]
+    assert execution.cell_status == {0: "aborted"}
+    assert execution.complete
+    assert execution.error == "kernel restarted"
+
+
+def test_execute_range_keeps_only_recent_executions(frontend, monkeypatch):
+    monkeypatch.setattr(jupyter_notebook, "_RANGE_EXECUTIONS", {})
+
+    data = {"file_name": "example.sync.py", "start_cell": 0, "end_cell": 0}
+    request_ids = [
+        jupyter_notebook.handle_execute_range_request(data)._value.result["request_id"]
+        for _ in range(jupyter_notebook.MAX_RANGE_EXECUTIONS + 2)
+    ]
+
+    assert list(jupyter_notebook._RANGE_EXECUTIONS) == request_ids[2:]
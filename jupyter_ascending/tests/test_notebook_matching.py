@@ -1,7 +1,14 @@
+import random
+from pathlib import Path
+from typing import List
+from typing import Optional
+
 import pytest
 
 from jupyter_ascending._environment import SYNC_EXTENSION
 from jupyter_ascending.errors import UnableToFindNotebookException
+from jupyter_ascending.functional import get_matching_tail_tokens
+from jupyter_ascending.handlers.notebook_index import NotebookPathIndex
 from jupyter_ascending.handlers.server_extension import _clear_registered_servers
 from jupyter_ascending.handlers.server_extension import _make_url
 from jupyter_ascending.handlers.server_extension import get_server_for_notebook
@@ -85,3 +92,53 @@ class TestGetSever:
 
         with pytest.raises(UnableToFindNotebookException):
             get_server_for_notebook(not_loaded_notebook_name)
+
+    @pytest.mark.asyncio
+    async def test_port_reused_by_another_notebook(self):
+        old_notebook_name = f"/home/tj/old.{SYNC_EXTENSION}.ipynb"
+        new_notebook_name = f"/home/tj/new.{SYNC_EXTENSION}.ipynb"
+
+        await register_notebook_server(old_notebook_name, 1234)
+        await register_notebook_server(new_notebook_name, 1234)
+
+        assert get_server_for_notebook(new_notebook_name) == _make_url(1234)
+        with pytest.raises(UnableToFindNotebookException):
+            get_server_for_notebook(old_notebook_name)
+
+
+def _best_match_by_scoring(registered: List[str], notebook_str: str) -> Optional[str]:
+    """How notebooks used to be matched: score every registered path."""
+    score_by_name = {
+        x: len(get_matching_tail_tokens(Path(notebook_str).parts, Path(x).parts)) for x in registered
+    }
+    max_score = max(score_by_name.values(), default=0)
+    best_scores = [k for k, v in score_by_name.items() if v == max_score]
+
+    if max_score <= 0 or len(best_scores) != 1:
+        return None
+
+    return best_scores[0]
+
+
+def test_index_matches_scoring():
+    rng = random.Random(0)
+    parts = ["home", "tj", "git", "other", f"notebook.{SYNC_EXTENSION}.ipynb", f"x.{SYNC_EXTENSION}.ipynb"]
+
+    def random_path():
+        return "/" + "/".join(rng.choice(parts) for _ in range(rng.randint(1, 4)))
+
+    for _ in range(200):
+        registered = list({random_path() for _ in range(rng.randint(0, 6))})
+        index = NotebookPathIndex()
+        for name in registered:
+            index.add(name)
+
+        # Removing things should leave the index as if they were never there.
+        for name in rng.sample(registered, rng.randint(0, len(registered))):
+            index.remove(name)
+            registered.remove(name)
+
+        assert len(index) == len(registered)
+        for _ in range(5):
+            notebook_str = random_path()
+            assert index.best_match(notebook_str) == _best_match_by_scoring(registered, notebook_str)
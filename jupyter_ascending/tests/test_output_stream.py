@@ -0,0 +1,172 @@
+import io
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from typing import Any
+from typing import Dict
+from typing import List
+
+import pytest
+
+from jupyter_ascending.handlers import output_stream
+from jupyter_ascending.handlers.output_stream import OutputBuffer
+from jupyter_ascending.requests import output_stream as client_output_stream
+from jupyter_ascending.requests.client_lib import RequestFailure
+from jupyter_ascending.requests.output_stream import OutputStream
+
+
+def _read_all(stream_id: str) -> List[Dict[str, Any]]:
+    result = output_stream.read(stream_id, wait=0, max_bytes=1000)
+    assert result["done"]
+
+    return result["chunks"]
+
+
+def test_watched_cell_output_is_captured(install):
+    shell = install()
+    shell.run_cell(lambda: print("not watched"))
+
+    output_stream.watch("a")
+    # Watching doesn't capture anything yet: this could be a cell someone runs in the browser.
+    shell.run_cell(lambda: print("not executed with the stream"))
+    output_stream.arm("a")
+
+    def cell():
+        print("hello")
+        print("oops", file=sys.stderr)
+        shell.display("a plot")
+        return 42
+
+    shell.run_cell(cell)
+    shell.run_cell(lambda: print("not watched either"))
+
+    assert _read_all("a") == [
+        {"name": "stdout", "text": "hello\n"},
+        {"name": "stderr", "text": "oops\n"},
+        {"name": "display", "text": "a plot\n"},
+        {"name": "result", "text": "42\n"},
+    ]
+    assert "not watched" in sys.stdout.getvalue()
+
+
+def test_only_the_cells_thread_is_captured(install):
+    shell = install()
+    output_stream.watch("a")
+    output_stream.arm("a")
+
+    def cell():
+        # Like a log sink or the headless notebook saving, while the cell runs.
+        other_thread = threading.Thread(target=lambda: print("from another thread"))
+        other_thread.start()
+        other_thread.join()
+        print("from the cell")
+
+    shell.run_cell(cell)
+
+    assert _read_all("a") == [{"name": "stdout", "text": "from the cell\n"}]
+    assert "from another thread" in sys.stdout.getvalue()
+
+
+def test_errors_are_captured(install):
+    shell = install()
+    output_stream.watch("a")
+    output_stream.arm("a")
+    shell.run_cell(lambda: 1 / 0)
+
+    (chunk,) = _read_all("a")
+    assert chunk["name"] == "error"
+    assert "ZeroDivisionError" in chunk["text"]
+
+
+def test_results_are_only_formatted_when_watched(install):
+    shell = install()
+    formatted = []
+    shell.format = lambda value, include=None: formatted.append(value) or ({"text/plain": repr(value)}, {})
+
+    shell.run_cell(lambda: 41)
+    output_stream.watch("a")
+    output_stream.arm("a")
+    shell.run_cell(lambda: 42)
+
+    assert formatted == [42]
+
+
+def test_output_past_max_bytes_is_dropped():
+    buffer = OutputBuffer(max_bytes=10)
+    buffer.append("stdout", "0123456")
+    buffer.append("stdout", "789abcdef")
+    buffer.finish()
+
+    chunks, done = buffer.read(wait=0, max_bytes=1000)
+
+    assert done
+    assert [x.text for x in chunks] == ["0123456789"]
+    assert buffer.dropped_bytes == 6
+
+
+def test_reads_wait_for_output():
+    buffer = OutputBuffer()
+    threading.Timer(0.05, buffer.append, args=("stdout", "late")).start()
+
+    chunks, done = buffer.read(wait=5, max_bytes=1000)
+
+    assert [x.text for x in chunks] == ["late"]
+    assert not done
+
+
+def test_watching_gives_up_if_no_cell_runs():
+    buffer = OutputBuffer()
+    buffer.expire_if_never_started(start_timeout=0)
+
+    assert buffer.read(wait=0, max_bytes=1000) == ([], True)
+
+
+def _serve_stream(lines: List[Dict[str, Any]]) -> HTTPServer:
+    class StreamHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.end_headers()
+            for line in lines:
+                self.wfile.write((json.dumps(line) + "\n").encode())
+
+    server = HTTPServer(("localhost", 0), StreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def test_client_copies_output(monkeypatch):
+    server = _serve_stream(
+        [
+            {"event": "watching", "stream_id": "a"},
+            {"event": "output", "name": "stdout", "text": "hello\n"},
+            {"event": "output", "name": "error", "text": "Traceback\n"},
+            {"event": "done", "dropped_bytes": 3},
+        ]
+    )
+    monkeypatch.setattr(client_output_stream, "EXECUTE_HOST_URL", f"http://localhost:{server.server_address[1]}")
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    try:
+        with OutputStream("example.sync.py") as output:
+            assert output.stream_id == "a"
+            output.copy_to(stdout, stderr)
+    finally:
+        server.shutdown()
+
+    assert stdout.getvalue() == "hello\n"
+    assert stderr.getvalue() == "Traceback\n[3 bytes of output not shown]\n"
+
+
+def test_client_reports_stream_errors(monkeypatch):
+    server = _serve_stream([{"event": "watching", "stream_id": "a"}, {"event": "error", "message": "notebook gone"}])
+    monkeypatch.setattr(client_output_stream, "EXECUTE_HOST_URL", f"http://localhost:{server.server_address[1]}")
+
+    try:
+        with pytest.raises(RequestFailure, match="notebook gone"):
+            with OutputStream("example.sync.py") as output:
+                list(output)
+    finally:
+        server.shutdown()
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import requests
+from jsonrpcclient import Ok
+from jsonrpcclient import parse
+from jsonrpcclient import request
+from jsonrpcserver import Success
+
+from jupyter_ascending.handlers import CommandQueue
+from jupyter_ascending.handlers import ServerMethods
+from jupyter_ascending.handlers import Superseded
+from jupyter_ascending.handlers import generate_request_handler
+from jupyter_ascending.handlers import start_server_in_thread
+
+
+def test_command_queue_runs_in_order():
+    queue = CommandQueue("test_commands")
+    finished = []
+
+    def command(i):
+        time.sleep(0.01 * (3 - i))
+        finished.append(i)
+        return i
+
+    threads = []
+    for i in range(3):
+        threads.append(threading.Thread(target=queue.run, args=(command, i)))
+        threads[-1].start()
+        # Make sure they're submitted in order.
+        time.sleep(0.005)
+
+    for thread in threads:
+        thread.join()
+
+    assert finished == [0, 1, 2]
+
+
+def test_reads_are_not_blocked_by_slow_commands():
+    methods = ServerMethods("Test Start", "Test Close")
+    queue = CommandQueue("test_commands")
+    release_slow_command = threading.Event()
+
+    def slow_command():
+        return Success(queue.run(release_slow_command.wait, 5))
+
+    def read():
+        return Success("read")
+
+    methods.add(slow_command)
+    methods.add(read)
+
+    server = start_server_in_thread(generate_request_handler("Test", methods))
+    url = f"http://localhost:{server.server_address[1]}"
+
+    try:
+        slow_thread = threading.Thread(target=requests.post, args=(url,), kwargs={"json": request("slow_command")})
+        slow_thread.start()
+        # Give it time to reach the server and start waiting.
+        time.sleep(0.2)
+
+        response = parse(requests.post(url, json=request("read"), timeout=2).json())
+        assert isinstance(response, Ok)
+        assert response.result == "read"
+        assert slow_thread.is_alive()
+    finally:
+        release_slow_command.set()
+        server.shutdown()
+        server.server_close()
+
+
+def test_command_queue_drops_superseded_commands():
+    queue = CommandQueue("test_commands")
+    release_blocking_command = threading.Event()
+    results = {}
+
+    def submit(name, coalesce_key):
+        try:
+            results[name] = queue.run(lambda: name, coalesce_key=coalesce_key)
+        except Superseded:
+            results[name] = "superseded"
+
+    blocking_thread = threading.Thread(target=queue.run, args=(release_blocking_command.wait, 5))
+    blocking_thread.start()
+
+    threads = []
+    for name, coalesce_key in [("first", "a.sync.py"), ("other_file", "b.sync.py"), ("second", "a.sync.py")]:
+        threads.append(threading.Thread(target=submit, args=(name, coalesce_key)))
+        threads[-1].start()
+        # Make sure they're submitted in order.
+        time.sleep(0.005)
+
+    release_blocking_command.set()
+    for thread in [blocking_thread] + threads:
+        thread.join()
+
+    assert results == {"first": "superseded", "other_file": "other_file", "second": "second"}
+
+
+def test_command_queue_runs_commands_that_are_not_supersedable():
+    queue = CommandQueue("test_commands")
+    release_blocking_command = threading.Event()
+    results = {}
+
+    def submit(name, supersedable):
+        try:
+            results[name] = queue.run(lambda: name, coalesce_key="a.sync.py", supersedable=supersedable)
+        except Superseded:
+            results[name] = "superseded"
+
+    blocking_thread = threading.Thread(target=queue.run, args=(release_blocking_command.wait, 5))
+    blocking_thread.start()
+
+    threads = []
+    for name, supersedable in [("sync", True), ("sync_and_execute", False), ("later_sync", True)]:
+        threads.append(threading.Thread(target=submit, args=(name, supersedable)))
+        threads[-1].start()
+        time.sleep(0.005)
+
+    release_blocking_command.set()
+    for thread in [blocking_thread] + threads:
+        thread.join()
+
+    assert results == {"sync": "superseded", "sync_and_execute": "sync_and_execute", "later_sync": "later_sync"}
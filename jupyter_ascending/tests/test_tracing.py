@@ -0,0 +1,146 @@
+import json
+
+import pytest
+from jsonrpcserver import Success
+
+from jupyter_ascending import tracing
+from jupyter_ascending.handlers import CommandQueue
+from jupyter_ascending.handlers import ServerMethods
+from jupyter_ascending.handlers import generate_request_handler
+from jupyter_ascending.handlers import jupyter_notebook
+from jupyter_ascending.handlers import start_server_in_thread
+from jupyter_ascending.handlers.server_extension import _clear_registered_servers
+from jupyter_ascending.handlers.server_extension import _close_session
+from jupyter_ascending.handlers.server_extension import perform_notebook_request
+from jupyter_ascending.handlers.server_extension import register_notebook_server
+from jupyter_ascending.json_requests import GetStatusRequest
+from jupyter_ascending.requests import client_lib
+from jupyter_ascending.requests.client_lib import request_notebook_command
+from jupyter_ascending.requests.client_lib import traced
+from jupyter_ascending.tests._helpers import FILE_TEXT
+from jupyter_ascending.tests._helpers import NOTEBOOK_NAME
+
+
+def _event_names(trace):
+    return [event for _, _, event in sorted(trace.events)]
+
+
+def test_remote_events_are_placed_between_send_and_receive():
+    trace = tracing.Trace(process="client")
+    trace.start = 10.0
+
+    # Sent at 1s into the trace, answered 2s later, of which the other side spent 1s.
+    trace.add_remote([(0.0, "server", "got request"), (1.0, "server", "answered")], 11.0, 13.0, 1.0)
+
+    assert trace.events == [(1.5, "server", "got request"), (2.5, "server", "answered")]
+
+
+def test_event_headers_round_trip():
+    events = [(0.001, "server", "got request"), (0.25, "server", "answered")]
+
+    assert tracing.parse_events(tracing.format_events(events)) == events
+    assert tracing.parse_events("not json") == []
+    assert tracing.parse_events('[["x"]]') == []
+    assert tracing.parse_events(None) == []
+
+    many = tracing.parse_events(tracing.format_events([(i, "kernel", str(i)) for i in range(1000)]))
+    assert len(many) == tracing.MAX_HEADER_EVENTS
+    assert many[-1][2] == f"... {1000 - tracing.MAX_HEADER_EVENTS + 1} more events"
+
+
+def test_commands_stay_in_the_trace_of_their_request():
+    queue = CommandQueue("test_tracing")
+
+    with tracing.started(process="kernel") as trace:
+        queue.run(tracing.record, "ran")
+        queue.run(tracing.record, "ran again", coalesce_key="a")
+
+    assert _event_names(trace) == ["queued", "started running", "ran", "queued", "started running", "ran again"]
+
+
+def test_sync_trace_goes_through_the_frontend(frontend):  # noqa: F811
+    with tracing.started(process="kernel") as trace:
+        jupyter_notebook.sync_contents("example.sync.py", FILE_TEXT)
+
+    assert _event_names(trace) == [
+        "parsed 3 cells",
+        "asking frontend for its cells",
+        "got 0 cells from frontend (took 0.5 ms there)",
+        "merged, 3 cells changed",
+        "sent frontend 3 changes",
+        "frontend applied changes (took 1.5 ms there)",
+        "sync complete",
+    ]
+
+    messages = [x for x in frontend.received if x["command"] in ("start_sync_notebook", "apply_patch", "finish_merge")]
+    assert [x["trace_id"] for x in messages] == [trace.trace_id] * 3
+
+
+@pytest.mark.asyncio
+async def test_trace_follows_the_request_to_the_kernel():
+    methods = ServerMethods("Test Start", "Test Close")
+
+    def echo(data):
+        tracing.record(f"echoing in trace {tracing.current().trace_id}")
+        return Success(data)
+
+    methods.add(echo)
+
+    server = start_server_in_thread(generate_request_handler("kernel", methods))
+    _clear_registered_servers()
+    await register_notebook_server(NOTEBOOK_NAME, server.server_address[1])
+
+    try:
+        with tracing.started("abc", process="server") as trace:
+            await perform_notebook_request(NOTEBOOK_NAME, "echo", {})
+    finally:
+        await _close_session()
+        server.shutdown()
+        server.server_close()
+        _clear_registered_servers()
+
+    assert _event_names(trace) == [
+        f"found notebook at http://localhost:{server.server_address[1]}",
+        "sending echo to kernel",
+        "got request",
+        "echoing in trace abc",
+        "answered",
+        "got answer from kernel, status 200",
+    ]
+    assert [process for _, process, _ in sorted(trace.events)] == ["server"] * 2 + ["kernel"] * 3 + ["server"]
+
+
+def test_client_prints_and_saves_the_timeline(monkeypatch, tmp_path, capsys):
+    methods = ServerMethods("Test Start", "Test Close")
+
+    def perform_notebook_request(notebook_path, command_name, data):
+        tracing.record(f"forwarding {command_name}")
+        return Success({"message": "ok"})
+
+    methods.add(perform_notebook_request)
+    server = start_server_in_thread(generate_request_handler("server", methods))
+
+    trace_file = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(client_lib, "EXECUTE_HOST_URL", f"http://localhost:{server.server_address[1]}")
+    monkeypatch.setattr(client_lib, "TRACE_FILE", str(trace_file))
+
+    try:
+        with traced(print_timeline=True):
+            request_notebook_command(GetStatusRequest(file_name="example.sync.py"))
+            request_notebook_command(GetStatusRequest(file_name="example.sync.py"))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    (saved,) = [json.loads(x) for x in trace_file.read_text().splitlines()]
+    assert [event for _, _, event in saved["events"]] == [
+        "sending GetStatusRequest",
+        "got request",
+        "forwarding GetStatusRequest",
+        "answered",
+        "got GetStatusRequest result",
+    ] * 2 + ["done"]
+
+    timeline = capsys.readouterr().out
+    assert f"Trace {saved['trace_id']}" in timeline
+    assert "server           forwarding GetStatusRequest" in timeline
@@ -0,0 +1,93 @@
+import gzip
+import json
+
+import pytest
+import requests
+from jsonrpcclient import request
+from jsonrpcserver import Success
+
+from jupyter_ascending import wire
+from jupyter_ascending.handlers import ServerMethods
+from jupyter_ascending.handlers import generate_request_handler
+from jupyter_ascending.handlers import start_server_in_thread
+
+BIG_DATA = {"contents": "# %%\nprint('hello')\n" * 1000}
+
+
+@pytest.fixture
+def echo_server():
+    methods = ServerMethods("Test Start", "Test Close")
+
+    def echo(data):
+        return Success(data)
+
+    methods.add(echo)
+
+    server = start_server_in_thread(generate_request_handler("Test", methods))
+
+    yield f"http://localhost:{server.server_address[1]}"
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_gzip_round_trip():
+    gzip_format = wire.WireFormat(content_encoding=wire.GZIP)
+
+    body, headers = wire.encode(BIG_DATA, gzip_format)
+    assert headers == {"Content-Type": wire.JSON, "Content-Encoding": wire.GZIP}
+    assert len(body) < len(json.dumps(BIG_DATA)) / 10
+    assert wire.decode(body, headers) == BIG_DATA
+
+    # An HTTP library may have decompressed it already.
+    assert wire.decode(gzip.decompress(body), headers) == BIG_DATA
+
+
+def test_small_bodies_are_not_compressed():
+    body, headers = wire.encode({"x": 1}, wire.WireFormat(content_encoding=wire.GZIP))
+
+    assert headers == {"Content-Type": wire.JSON}
+    assert json.loads(body) == {"x": 1}
+
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+
+    body, headers = wire.encode(BIG_DATA, wire.WireFormat(content_type=wire.MSGPACK, content_encoding=wire.GZIP))
+    assert wire.decode(body, headers) == BIG_DATA
+
+
+def test_only_formats_both_ends_know_are_chosen(monkeypatch):
+    monkeypatch.setattr(wire, "msgpack", None)
+    monkeypatch.setattr(wire, "zstandard", None)
+
+    # What HTTP libraries send by default.
+    assert wire.choose("*/*", "gzip, deflate") == wire.WireFormat(content_encoding=wire.GZIP)
+    assert wire.choose(None, None) == wire.PLAIN_JSON
+    assert wire.choose("application/msgpack, application/json", "zstd, gzip") == wire.WireFormat(
+        content_encoding=wire.GZIP
+    )
+
+    monkeypatch.setattr(wire, "PLAIN_JSON_ONLY", True)
+    assert wire.choose("application/json", "gzip") == wire.PLAIN_JSON
+
+
+def test_server_answers_in_the_format_asked_for(echo_server):
+    json_rpc_request = request("echo", params=dict(data=BIG_DATA))
+
+    # Old clients send plain JSON, and don't ask for anything else.
+    response = requests.post(echo_server, json=json_rpc_request, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.json()["result"] == BIG_DATA
+    assert wire.choose_for_next_request(response.headers).content_encoding != wire.IDENTITY
+
+    body, headers = wire.encode(json_rpc_request, wire.WireFormat(content_encoding=wire.GZIP))
+    response = requests.post(echo_server, data=body, headers={**headers, **wire.accept_headers()})
+    assert response.headers["Content-Encoding"] == wire.readable_encodings()[0]
+    assert wire.decode(response.content, response.headers)["result"] == BIG_DATA
+
+
+def test_server_rejects_unreadable_bodies(echo_server):
+    response = requests.post(echo_server, data=b"not gzip", headers={"Content-Type": wire.MSGPACK})
+
+    assert response.status_code == wire.UNREADABLE_BODY_STATUS
@@ -0,0 +1,130 @@
+"""
+Correlation ids, and a timeline of where the time went for one request, across every process that handled it.
+
+A client starts a trace (`started`), and each request it sends while the trace is current carries the trace's id in
+the `Jupyter-Ascending-Trace-Id` header. The server extension and the kernel each start a trace with that id while they
+handle the request, `record` what they do, and send their events back in the `Jupyter-Ascending-Trace` header of their
+response, where the caller adds them to its own trace (`Trace.add_remote`). The kernel sends the id on to the frontend
+with `start_sync_notebook`, `apply_patch` and `finish_merge`, and the frontend sends it back with `merge_notebooks` and
+`merge_complete`, along with how long it took.
+
+Each process has its own clock (and may be on another machine), so the events of another process are placed assuming
+its request and its response took equally long on the wire. That's close enough to see where the milliseconds went.
+"""
+import json
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+#: Requests carry the id of the trace they're part of in this header.
+TRACE_ID_HEADER = "Jupyter-Ascending-Trace-Id"
+#: Responses carry the events recorded while handling them in this header, as JSON.
+TRACE_HEADER = "Jupyter-Ascending-Trace"
+
+# At most this many events are sent back in a response, to stay well under the header size limits of HTTP libraries.
+MAX_HEADER_EVENTS = 100
+
+# Seconds since the start of the trace, the process, and what happened.
+Event = Tuple[float, str, str]
+
+_current: ContextVar[Optional["Trace"]] = ContextVar("jupyter_ascending_trace", default=None)
+
+
+class Trace:
+    def __init__(self, trace_id: Optional[str] = None, process: str = "client"):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.process = process
+        self.start = time.perf_counter()
+        self.events: List[Event] = []
+
+    def record(self, event: str) -> None:
+        self.events.append((time.perf_counter() - self.start, self.process, event))
+
+    def add_remote(self, events: List[Event], sent: float, received: float, remote_seconds: Optional[float]) -> None:
+        """Add the events another process recorded while handling a request we sent.
+
+        `sent` and `received` are when we sent it and got the answer, by `time.perf_counter()`, and `remote_seconds`
+        is how long the other process said it spent on it (see `metrics.server_seconds`)."""
+        if not events:
+            return
+
+        if remote_seconds is None:
+            remote_seconds = max(at for at, _, _ in events)
+
+        wire_seconds = max(received - sent - remote_seconds, 0.0)
+        offset = sent - self.start + wire_seconds / 2
+        self.events.extend((offset + at, process, event) for at, process, event in events)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def record(event: str) -> None:
+    """Record `event` in the current trace, if there is one."""
+    trace = _current.get()
+    if trace is not None:
+        trace.record(event)
+
+
+@contextmanager
+def started(trace_id: Optional[str] = None, process: str = "client") -> Iterator[Trace]:
+    """Make a new trace the current one for the block.
+
+    Without a `trace_id`, joins the current trace if there is one, so helpers can start a trace of their own
+    when nothing is tracing them."""
+    trace = _current.get()
+    if trace is not None and trace_id is None:
+        yield trace
+        return
+
+    trace = Trace(trace_id, process)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def format_events(events: List[Event]) -> str:
+    """`events` as a `Jupyter-Ascending-Trace` header value."""
+    if len(events) > MAX_HEADER_EVENTS:
+        dropped = len(events) - MAX_HEADER_EVENTS + 1
+        at, process, _ = events[MAX_HEADER_EVENTS - 1]
+        events = events[: MAX_HEADER_EVENTS - 1] + [(at, process, f"... {dropped} more events")]
+
+    return json.dumps([[round(at, 6), process, event] for at, process, event in events])
+
+
+def parse_events(header: Optional[str]) -> List[Event]:
+    """The events of a `Jupyter-Ascending-Trace` header value. Empty if there isn't one, or it doesn't parse."""
+    try:
+        data: Any = json.loads(header or "[]")
+        return [(float(at), str(process), str(event)) for at, process, event in data]
+    except (ValueError, TypeError):
+        return []
+
+
+def format_timeline(trace: Trace) -> str:
+    """The events of `trace` as a table, in order, with how long it was since the one before."""
+    lines = [f"Trace {trace.trace_id}", f"{'ms':>10} {'+ms':>9}  {'process':<16} event"]
+
+    previous = 0.0
+    for at, process, event in sorted(trace.events, key=lambda x: x[0]):
+        lines.append(f"{at * 1000:>10.3f} {(at - previous) * 1000:>9.3f}  {process:<16} {event}")
+        previous = at
+
+    return "\n".join(lines)
+
+
+def write(trace: Trace, path: str) -> None:
+    """Append `trace` to the file at `path`, as a line of JSON."""
+    line = json.dumps({"trace_id": trace.trace_id, "events": sorted(trace.events, key=lambda x: x[0])})
+    with open(path, "a") as f:
+        f.write(line + "\n")